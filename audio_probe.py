@@ -0,0 +1,149 @@
+"""
+從容器標頭快速讀取音頻時長，不解碼音頻 (每個檔案只讀取少量位元組，適合 Drive FUSE 掛載點)。
+
+支持 WAV (RIFF fmt/data 區塊)、FLAC (STREAMINFO)、MP3 (Xing/Info/VBRI 標頭或 CBR 首幀位元率)
+以及 MP4/M4A (moov/mvhd)。無法識別時返回 None，由調用方按檔案大小估計。
+"""
+import os
+import struct
+
+_MP3_BITRATES_KBPS = {
+    # (MPEG-1?, 層) -> 位元率表 (索引 1~14)
+    (True, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)} # 版本位 -> 採樣率表
+_MP3_SYNC_SEARCH_BYTES = 64 * 1024 # 跳過 ID3v2 後尋找首幀同步字的最大範圍
+
+
+def _probe_wav(f, file_size):
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    byte_rate = None
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return None
+        chunk_id, chunk_size = chunk_header[:4], struct.unpack('<I', chunk_header[4:])[0]
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size + (chunk_size & 1))
+            if len(fmt) < 12:
+                return None
+            byte_rate = struct.unpack('<I', fmt[8:12])[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            if chunk_size == 0xFFFFFFFF or chunk_size == 0: # 串流寫入時未回填大小
+                chunk_size = file_size - f.tell()
+            return chunk_size / byte_rate
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+def _probe_flac(f):
+    if f.read(4) != b'fLaC':
+        return None
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0: # 第一個元數據塊必須是 STREAMINFO
+        return None
+    streaminfo = f.read(18)
+    if len(streaminfo) < 18:
+        return None
+    packed = struct.unpack('>Q', streaminfo[10:18])[0]
+    sample_rate = packed >> 44
+    total_samples = packed & ((1 << 36) - 1)
+    if not sample_rate or not total_samples:
+        return None
+    return total_samples / sample_rate
+
+def _probe_mp3(f, file_size):
+    head = f.read(10)
+    audio_start = 0
+    if head[:3] == b'ID3' and len(head) == 10:
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9] # syncsafe 整數
+        audio_start = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+    f.seek(audio_start)
+    data = f.read(_MP3_SYNC_SEARCH_BYTES)
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+            continue
+        header = struct.unpack('>I', data[offset:offset + 4])[0]
+        version_bits = (header >> 19) & 3
+        layer = 4 - ((header >> 17) & 3)
+        bitrate_index = (header >> 12) & 0xF
+        sample_rate_index = (header >> 10) & 3
+        if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            continue # 無效或保留值，繼續尋找
+        is_mpeg1 = version_bits == 3
+        sample_rate = _MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+        samples_per_frame = 384 if layer == 1 else (1152 if layer == 2 or is_mpeg1 else 576)
+        mono = ((header >> 6) & 3) == 3
+        side_info = (17 if mono else 32) if is_mpeg1 else (9 if mono else 17)
+        frame = data[offset:offset + 4 + side_info + 16]
+        xing = frame[4 + side_info:4 + side_info + 16]
+        if xing[:4] in (b'Xing', b'Info') and len(xing) >= 12 and struct.unpack('>I', xing[4:8])[0] & 1:
+            return struct.unpack('>I', xing[8:12])[0] * samples_per_frame / sample_rate
+        vbri = data[offset + 36:offset + 36 + 18]
+        if vbri[:4] == b'VBRI' and len(vbri) >= 18:
+            return struct.unpack('>I', vbri[14:18])[0] * samples_per_frame / sample_rate
+        bitrate = _MP3_BITRATES_KBPS[(is_mpeg1, layer)][bitrate_index - 1] * 1000
+        return (file_size - audio_start - offset) * 8 / bitrate
+    return None
+
+def _probe_mp4(f, file_size):
+    def boxes(start, end):
+        position = start
+        while position + 8 <= end:
+            f.seek(position)
+            header = f.read(8)
+            if len(header) < 8:
+                return
+            size, box_type = struct.unpack('>I4s', header)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                header_size = 16
+            elif size == 0:
+                size = end - position
+            if size < header_size:
+                return
+            yield box_type, position + header_size, position + size
+            position += size
+
+    for box_type, body_start, body_end in boxes(0, file_size):
+        if box_type != b'moov': # moov 可能位於 mdat 之後，只讀取標頭跳過 mdat
+            continue
+        for child_type, child_start, _ in boxes(body_start, body_end):
+            if child_type != b'mvhd':
+                continue
+            f.seek(child_start)
+            version = f.read(4)[0]
+            if version == 1:
+                _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+            else:
+                _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+            return duration / timescale if timescale else None
+        return None
+    return None
+
+def probe_audio_duration(path):
+    """返回音頻時長 (秒)；無法從標頭判斷 (格式不支持、檔案損壞) 時返回 None。"""
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        file_size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            if extension == '.wav':
+                return _probe_wav(f, file_size)
+            if extension == '.flac':
+                return _probe_flac(f)
+            if extension == '.mp3':
+                return _probe_mp3(f, file_size)
+            if extension in ('.m4a', '.mp4'):
+                return _probe_mp4(f, file_size)
+    except (OSError, struct.error, IndexError):
+        return None
+    return None
@@ -0,0 +1,448 @@
+"""
+離線基準測試用的替身 (fake)：在沒有 Colab、Drive、GPU 與 Google API 的一般 Linux 上
+運行 local_transcriber / sheets_gemini_processor 的真實流程。
+
+install_fakes() 會在 sys.modules 中註冊 faster_whisper、google.colab、google.auth、
+google.generativeai、gspread、pypdf、IPython.display 與 requests 的替身模組，
+並將 time.sleep 替換為只記錄、不等待的虛擬睡眠。各替身的延遲、429 注入機率與
+配額 (每分鐘請求數) 均可由 FakeConfig 配置。
+"""
+import os
+import re
+import sys
+import time
+import random
+import struct
+import threading
+from types import ModuleType, SimpleNamespace
+
+_real_sleep = time.sleep
+_real_monotonic = time.monotonic
+
+
+class FakeConfig:
+    """替身行為配置與統計計數。"""
+
+    def __init__(self, seed=0, whisper_rtf=0.0, whisper_hallucination_rate=0.0, gemini_latency_seconds=0.0, gemini_429_rate=0.0,
+                 gemini_rpm_quota=None, sheets_latency_seconds=0.0, sheets_429_rate=0.0,
+                 sheets_writes_per_minute_quota=None, gemini_edit_rate=0.05, gemini_draft_edit_rate=None,
+                 gemini_draft_latency_seconds=None, gemini_uncertain_rate=0.0, gemini_uncertain_marker="[?]"):
+        self.rng = random.Random(seed)
+        self.whisper_rtf = whisper_rtf # 模擬推理耗時 = 音頻時長 × whisper_rtf (真實等待)
+        self.whisper_hallucination_rate = whisper_hallucination_rate # 完整解碼時每個片段變為重複循環或幻覺字句的機率
+        self.gemini_latency_seconds = gemini_latency_seconds
+        self.gemini_429_rate = gemini_429_rate
+        self.gemini_rpm_quota = gemini_rpm_quota # 每個 API 金鑰每分鐘請求數上限 (以虛擬時鐘計)
+        self.gemini_edit_rate = gemini_edit_rate # 替身模型修改每個字元的機率
+        # 初稿 (名稱含 "flash") 替身模型的修改機率與延遲，None 表示與 Pro 相同；
+        # gemini_uncertain_rate 為初稿模型在行首加上不確定標記的機率
+        self.gemini_draft_edit_rate = gemini_draft_edit_rate
+        self.gemini_draft_latency_seconds = gemini_draft_latency_seconds
+        self.gemini_uncertain_rate = gemini_uncertain_rate
+        self.gemini_uncertain_marker = gemini_uncertain_marker
+        self.sheets_latency_seconds = sheets_latency_seconds
+        self.sheets_429_rate = sheets_429_rate
+        self.sheets_writes_per_minute_quota = sheets_writes_per_minute_quota
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.slept_seconds = 0.0
+        self.sleep_calls = 0
+        self.whisper_calls = 0
+        self.whisper_audio_seconds = 0.0
+        self.whisper_batched_calls = 0
+        self.whisper_clip_calls = 0
+        self.whisper_clip_seconds = 0.0
+        self.gemini_calls = 0
+        self.gemini_429s = 0
+        self.gemini_prompt_tokens = 0
+        self.gemini_output_tokens = 0
+        self.gemini_calls_by_model = {}
+        self.sheets_calls = {}
+        self.sheets_429s = 0
+        self._gemini_request_times = {}
+        self._sheets_write_times = []
+
+    # --- 虛擬時鐘：真實單調時間 + 已記錄的睡眠時間 ---
+    def now(self):
+        return _real_monotonic() + self.slept_seconds
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.sleep_calls += 1
+            self.slept_seconds += max(0.0, seconds)
+
+    def count_sheets_call(self, op):
+        with self.lock:
+            self.sheets_calls[op] = self.sheets_calls.get(op, 0) + 1
+
+    def summary(self):
+        return {
+            'sleep_calls': self.sleep_calls,
+            'slept_seconds': round(self.slept_seconds, 3),
+            'whisper_calls': self.whisper_calls,
+            'whisper_audio_seconds': round(self.whisper_audio_seconds, 1),
+            'whisper_batched_calls': self.whisper_batched_calls,
+            'whisper_clip_calls': self.whisper_clip_calls,
+            'whisper_clip_seconds': round(self.whisper_clip_seconds, 1),
+            'gemini_calls': self.gemini_calls,
+            'gemini_calls_by_model': dict(self.gemini_calls_by_model),
+            'gemini_429s': self.gemini_429s,
+            'gemini_prompt_tokens': self.gemini_prompt_tokens,
+            'gemini_output_tokens': self.gemini_output_tokens,
+            'sheets_calls': sum(self.sheets_calls.values()),
+            'sheets_calls_by_op': dict(self.sheets_calls),
+            'sheets_429s': self.sheets_429s,
+        }
+
+
+_config = FakeConfig()
+
+def get_config():
+    return _config
+
+
+# --- 合成語料 ---
+_CORPUS_CHARS = "佛法僧經律論觀無量壽善導大師疏傳通記念阿彌陀往生淨土如來菩薩眾生心性因緣果報修行"
+FAKE_AUDIO_BYTES_PER_SECOND = 4 # 替身音頻檔案以檔案大小編碼時長：每秒 4 位元組 (4 Hz、8 位元單聲道 WAV)
+_WAV_HEADER_BYTES = 44
+
+def write_fake_audio(path, duration_seconds):
+    """寫出替身音頻檔案 (內容無意義，FakeWhisperModel 以大小推算時長)。"""
+    data_size = int(duration_seconds * FAKE_AUDIO_BYTES_PER_SECOND)
+    with open(path, 'wb') as f:
+        # 有效的 WAV 標頭，使 audio_probe 等只讀取標頭的工具也能得到正確時長
+        f.write(b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, FAKE_AUDIO_BYTES_PER_SECOND, FAKE_AUDIO_BYTES_PER_SECOND, 1, 8))
+        f.write(b'data' + struct.pack('<I', data_size))
+        f.write(b'\x80' * data_size)
+
+def fake_audio_duration(path):
+    return max(0, os.path.getsize(path) - _WAV_HEADER_BYTES) / FAKE_AUDIO_BYTES_PER_SECOND
+
+def synthetic_line(rng, min_chars=8, max_chars=24):
+    return "".join(rng.choice(_CORPUS_CHARS) for _ in range(rng.randint(min_chars, max_chars)))
+
+
+# --- faster_whisper 替身 ---
+class FakeWhisperModel:
+    def __init__(self, model_size_or_path="large-v3", device="cpu", compute_type="default", **kwargs):
+        self.model_size = model_size_or_path
+
+    def detect_language(self, audio=None, **kwargs):
+        return "zh", 0.99, [("zh", 0.99)]
+
+    def transcribe(self, audio, language=None, word_timestamps=False, clip_timestamps=None, **kwargs):
+        config = get_config()
+        duration = fake_audio_duration(audio) if isinstance(audio, str) else len(audio) / 16000
+        rng = random.Random(f"{audio}:{clip_timestamps}")
+        # clip_timestamps: [起始, 結束, 起始, 結束, ...]，只解碼這些範圍
+        clips = ([(float(clip_timestamps[k]), float(clip_timestamps[k + 1]) if k + 1 < len(clip_timestamps) else duration)
+                  for k in range(0, len(clip_timestamps), 2)] if clip_timestamps else [(0.0, duration)])
+        decoded_seconds = sum(end - start for start, end in clips)
+        with config.lock:
+            config.whisper_calls += 1
+            config.whisper_audio_seconds += decoded_seconds
+            if clip_timestamps:
+                config.whisper_clip_calls += 1
+                config.whisper_clip_seconds += decoded_seconds
+        if config.whisper_rtf:
+            _real_sleep(decoded_seconds * config.whisper_rtf)
+
+        def segments():
+            segment_id = 0
+            for start, end_limit in clips:
+                while start < end_limit:
+                    text = synthetic_line(rng)
+                    avg_logprob, compression_ratio, no_speech_prob = -0.2, 1.3, 0.01
+                    if not clip_timestamps and rng.random() < config.whisper_hallucination_rate:
+                        if rng.random() < 0.5: # 重複循環
+                            text = text[:3] * 8
+                            compression_ratio = 3.2
+                        else: # 靜音段落中的幻覺署名
+                            text = "字幕由 Amara.org 社群提供"
+                            avg_logprob, no_speech_prob = -1.3, 0.8
+                    length = min(len(text) / 4.0, end_limit - start)
+                    words = None
+                    if word_timestamps:
+                        step = length / len(text)
+                        words = [SimpleNamespace(word=char, start=start + k * step, end=start + (k + 1) * step, probability=0.9)
+                                 for k, char in enumerate(text)]
+                    yield SimpleNamespace(id=segment_id, start=start, end=start + length, text=text, words=words,
+                                          avg_logprob=avg_logprob, compression_ratio=compression_ratio,
+                                          no_speech_prob=no_speech_prob, temperature=0.0)
+                    segment_id += 1
+                    start += length + 0.5
+
+        info = SimpleNamespace(language=language or "zh", language_probability=1.0 if language else 0.99, duration=duration)
+        return segments(), info
+
+
+class FakeAudio:
+    """decode_audio 替身的返回值：只記錄採樣數，支持 len() 與切片，不佔用實際記憶體。"""
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __len__(self):
+        return self.samples
+
+    def __getitem__(self, index):
+        return FakeAudio(len(range(self.samples)[index]))
+
+def fake_decode_audio(path, sampling_rate=16000, **kwargs):
+    return FakeAudio(int(fake_audio_duration(path) * sampling_rate))
+
+class FakeBatchedInferencePipeline:
+    """批次推理替身：輸出與逐窗口解碼相同 (CER 為 0)，只記錄批次大小。"""
+
+    def __init__(self, model, **kwargs):
+        self.model = model
+
+    def transcribe(self, audio, batch_size=16, **kwargs):
+        config = get_config()
+        with config.lock:
+            config.whisper_batched_calls += 1
+        return self.model.transcribe(audio, **kwargs)
+
+
+# --- google.generativeai 替身 ---
+class FakeResourceExhausted(Exception):
+    pass
+
+_FINISH_REASON_STOP = 1
+_FINISH_REASON_MAX_TOKENS = 2
+
+def _estimate_tokens(text):
+    return max(1, len(text))
+
+class FakeGenerativeModel:
+    """
+    替身 Gemini 模型：從提示詞中取出待校對的行，以 gemini_edit_rate 隨機修改字元後返回。
+    支持延遲、429 注入、每金鑰 RPM 配額與 max_output_tokens 截斷。
+    名稱含 "flash" 的模型作為級聯模式的初稿模型，使用 FakeConfig 中 gemini_draft_* 的設定，並可能標記不確定的行。
+    """
+
+    def __init__(self, model_name="gemini-1.5-pro-latest", generation_config=None, **kwargs):
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+        self.api_key = _genai_state['api_key']
+        self.is_draft = 'flash' in model_name
+
+    def _check_quota(self, config):
+        if config.gemini_rpm_quota is None:
+            return True
+        now = config.now()
+        window = config._gemini_request_times.setdefault(self.api_key, [])
+        while window and now - window[0] >= 60:
+            window.pop(0)
+        if len(window) >= config.gemini_rpm_quota:
+            return False
+        window.append(now)
+        return True
+
+    def generate_content(self, prompt, **kwargs):
+        config = get_config()
+        with config.lock:
+            config.gemini_calls += 1
+            config.gemini_calls_by_model[self.model_name] = config.gemini_calls_by_model.get(self.model_name, 0) + 1
+            over_quota = not self._check_quota(config)
+            injected = config.rng.random() < config.gemini_429_rate
+            if over_quota or injected:
+                config.gemini_429s += 1
+        latency = config.gemini_latency_seconds
+        edit_rate = config.gemini_edit_rate
+        if self.is_draft:
+            latency = config.gemini_draft_latency_seconds if config.gemini_draft_latency_seconds is not None else latency
+            edit_rate = config.gemini_draft_edit_rate if config.gemini_draft_edit_rate is not None else edit_rate
+        if latency:
+            _real_sleep(latency)
+        if over_quota or injected:
+            raise FakeResourceExhausted("429 Resource has been exhausted (e.g. check quota).")
+
+        lines = _extract_batch_lines(prompt)
+        corrected = []
+        with config.lock:
+            for line in lines:
+                line = "".join(config.rng.choice(_CORPUS_CHARS) if config.rng.random() < edit_rate else char for char in line)
+                if self.is_draft and config.rng.random() < config.gemini_uncertain_rate:
+                    line = config.gemini_uncertain_marker + line
+                corrected.append(line)
+        text = "\n".join(corrected)
+        finish_reason = _FINISH_REASON_STOP
+        max_output_tokens = self.generation_config.get('max_output_tokens')
+        if max_output_tokens and _estimate_tokens(text) > max_output_tokens:
+            text = text[:max_output_tokens]
+            finish_reason = _FINISH_REASON_MAX_TOKENS
+        prompt_tokens = _estimate_tokens(prompt)
+        output_tokens = _estimate_tokens(text)
+        with config.lock:
+            config.gemini_prompt_tokens += prompt_tokens
+            config.gemini_output_tokens += output_tokens
+        return SimpleNamespace(
+            text=text,
+            candidates=[SimpleNamespace(finish_reason=finish_reason)],
+            usage_metadata=SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+                                           total_token_count=prompt_tokens + output_tokens),
+        )
+
+_BATCH_TEXT_PATTERN = re.compile(r"以下是需要校對的字幕文本[^\n]*\n---\n(.*?)\n---", re.S)
+
+def _extract_batch_lines(prompt):
+    match = _BATCH_TEXT_PATTERN.search(prompt)
+    return match.group(1).split('\n') if match else []
+
+_genai_state = {'api_key': None, 'configure_calls': 0}
+
+def _genai_configure(api_key=None, **kwargs):
+    _genai_state['api_key'] = api_key
+    _genai_state['configure_calls'] += 1
+
+
+# --- gspread 替身 ---
+class FakeAPIError(Exception):
+    def __init__(self, status_code, message=""):
+        super().__init__(f"{status_code} {message}")
+        self.response = SimpleNamespace(status_code=status_code)
+
+class FakeSpreadsheetNotFound(Exception):
+    pass
+
+class FakeWorksheetNotFound(Exception):
+    pass
+
+def _sheets_call(op, is_write=False):
+    config = get_config()
+    config.count_sheets_call(op)
+    if config.sheets_latency_seconds:
+        _real_sleep(config.sheets_latency_seconds)
+    with config.lock:
+        over_quota = False
+        if is_write and config.sheets_writes_per_minute_quota is not None:
+            now = config.now()
+            window = config._sheets_write_times
+            while window and now - window[0] >= 60:
+                window.pop(0)
+            over_quota = len(window) >= config.sheets_writes_per_minute_quota
+            if not over_quota:
+                window.append(now)
+        if over_quota or config.rng.random() < config.sheets_429_rate:
+            config.sheets_429s += 1
+            raise FakeAPIError(429, "Quota exceeded")
+
+class FakeWorksheet:
+    def __init__(self, title):
+        self.title = title
+        self.cells = {} # (行, 列) -> 值，從 1 開始
+
+    def clear(self):
+        _sheets_call('clear', is_write=True)
+        self.cells.clear()
+
+    def _write(self, range_name, values):
+        col_letters, row = re.match(r"([A-Z]+)(\d+)", range_name).groups()
+        col = 0
+        for letter in col_letters:
+            col = col * 26 + (ord(letter) - 64)
+        for row_offset, row_values in enumerate(values or []):
+            for col_offset, value in enumerate(row_values):
+                self.cells[(int(row) + row_offset, col + col_offset)] = value
+
+    def update(self, range_name='A1', values=None, **kwargs):
+        _sheets_call('update', is_write=True)
+        self._write(range_name, values)
+
+    def batch_update(self, data, **kwargs):
+        _sheets_call('batch_update', is_write=True)
+        for entry in data:
+            self._write(entry['range'], entry['values'])
+
+    def get_all_values(self):
+        _sheets_call('get_all_values')
+        if not self.cells:
+            return []
+        max_row = max(r for r, _ in self.cells)
+        max_col = max(c for _, c in self.cells)
+        return [[str(self.cells.get((r, c), "")) for c in range(1, max_col + 1)] for r in range(1, max_row + 1)]
+
+class FakeSpreadsheet:
+    def __init__(self, title):
+        self.title = title
+        self.id = f"fake-{abs(hash(title))}"
+        self.url = f"https://docs.google.com/spreadsheets/d/{self.id}"
+        self.worksheets = {"工作表1": FakeWorksheet("工作表1")}
+
+    def worksheet(self, title):
+        _sheets_call('worksheet')
+        if title not in self.worksheets:
+            raise FakeWorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def add_worksheet(self, title, rows=100, cols=20, **kwargs):
+        _sheets_call('add_worksheet', is_write=True)
+        self.worksheets[title] = FakeWorksheet(title)
+        return self.worksheets[title]
+
+class FakeGspreadClient:
+    def __init__(self):
+        self.spreadsheets = {}
+
+    def open(self, title):
+        _sheets_call('open')
+        if title not in self.spreadsheets:
+            raise FakeSpreadsheetNotFound(title)
+        return self.spreadsheets[title]
+
+    def create(self, title, **kwargs):
+        _sheets_call('create', is_write=True)
+        self.spreadsheets[title] = FakeSpreadsheet(title)
+        return self.spreadsheets[title]
+
+
+# --- 註冊替身模組 ---
+def _module(name, **attributes):
+    module = ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+def install_fakes(config=None, secrets=None):
+    """
+    註冊全部替身模組並啟用虛擬睡眠。必須在導入 local_transcriber / sheets_gemini_processor 之前調用。
+    secrets: 替身 google.colab.userdata 返回的密鑰 (默認提供 GEMINI_API_KEY)。
+    返回當前的 FakeConfig。
+    """
+    global _config
+    _config = config or FakeConfig()
+    secrets = secrets if secrets is not None else {'GEMINI_API_KEY': 'fake-key-0'}
+
+    _module('faster_whisper', WhisperModel=FakeWhisperModel, BatchedInferencePipeline=FakeBatchedInferencePipeline,
+            decode_audio=fake_decode_audio)
+
+    google = _module('google')
+    colab = _module('google.colab')
+    colab.drive = _module('google.colab.drive', mount=lambda *a, **k: None, flush_and_unmount=lambda *a, **k: None)
+    colab.auth = _module('google.colab.auth', authenticate_user=lambda *a, **k: None)
+    colab.userdata = _module('google.colab.userdata', get=lambda name: secrets.get(name))
+    colab.files = _module('google.colab.files', upload=lambda *a, **k: {})
+    google.colab = colab
+    google.auth = _module('google.auth', default=lambda *a, **k: (SimpleNamespace(), "fake-project"))
+    google.generativeai = _module('google.generativeai', configure=_genai_configure, GenerativeModel=FakeGenerativeModel)
+
+    exceptions = _module('gspread.exceptions', APIError=FakeAPIError, SpreadsheetNotFound=FakeSpreadsheetNotFound,
+                         WorksheetNotFound=FakeWorksheetNotFound)
+    _module('gspread', authorize=lambda creds: FakeGspreadClient(), exceptions=exceptions)
+    _module('pypdf', PdfReader=lambda f: SimpleNamespace(pages=[]))
+    ipython = _module('IPython')
+    ipython.display = _module('IPython.display', HTML=lambda html: html, display=lambda *a, **k: None)
+    _module('requests')
+
+    time.sleep = _config.sleep
+    time.monotonic = _config.now # 速率限制器等以 monotonic 計時的代碼與虛擬睡眠保持一致
+    return _config
+
+def uninstall_fakes():
+    """恢復真實的 time.sleep / time.monotonic (替身模組保留在 sys.modules 中)。"""
+    time.sleep = _real_sleep
+    time.monotonic = _real_monotonic
@@ -0,0 +1,542 @@
+"""
+性能基準測試腳本 (可離線於一般 Linux 上運行，不需要 Colab / GPU / Google API)。
+
+用法:
+    python benchmarks.py                 # 運行全部基準測試
+    python benchmarks.py alignment       # 只運行指定的基準測試
+    python benchmarks.py pipeline --lectures 1 10 100 500 --json results.json
+    python benchmarks.py startup         # 各腳本的導入至第一項工作延遲 (延遲導入前後對比)
+    python benchmarks.py work_queue      # 多個工作者同時接手同一個過期租約
+    python benchmarks.py batched --audio lecture.mp3   # CPU 上批次推理的實時率與 CER/WER (需要 faster-whisper)
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import builtins
+import tempfile
+import tracemalloc
+import contextlib
+from types import SimpleNamespace
+
+# 常用漢字，用於生成合成講座文本
+_SYNTHETIC_CHARS = "佛法僧經律論觀無量壽善導大師疏傳通記念阿彌陀往生淨土如來菩薩眾生心性因緣果報修行"
+
+
+def _synthetic_lecture_words(hours, seed=0, chars_per_second=4.0, words_per_line=12):
+    # 生成合成講座的逐詞時間軸：每個詞 1~2 個字，按固定語速分佈
+    from subtitle_alignment import new_word_timings
+    rng = random.Random(seed)
+    timings = new_word_timings()
+    total_ms = int(hours * 3600 * 1000)
+    current_ms = 0
+    line_index = 0
+    words_in_line = 0
+    while current_ms < total_ms:
+        word = "".join(rng.choice(_SYNTHETIC_CHARS) for _ in range(rng.randint(1, 2)))
+        duration_ms = int(len(word) * 1000 / chars_per_second)
+        timings['words'].append(word)
+        timings['start_ms'].append(current_ms)
+        timings['end_ms'].append(current_ms + duration_ms)
+        timings['line'].append(line_index)
+        current_ms += duration_ms
+        words_in_line += 1
+        if words_in_line >= words_per_line:
+            line_index += 1
+            words_in_line = 0
+            current_ms += 400 # 行間停頓
+    return timings
+
+
+def _lines_from_timings(timings):
+    lines = []
+    for word, line_index in zip(timings['words'], timings['line']):
+        if line_index >= len(lines):
+            lines.append("")
+        lines[line_index] += word
+    return lines
+
+
+def _simulate_corrections(lines, seed=0, substitution_rate=0.05, insertion_rate=0.01):
+    # 模擬 Gemini 校對：少量替換與插入，行數不變
+    rng = random.Random(seed)
+    corrected = []
+    for line in lines:
+        chars = []
+        for char in line:
+            roll = rng.random()
+            if roll < substitution_rate:
+                chars.append(rng.choice(_SYNTHETIC_CHARS))
+            else:
+                chars.append(char)
+            if rng.random() < insertion_rate:
+                chars.append(rng.choice(_SYNTHETIC_CHARS))
+        corrected.append("".join(chars))
+    return corrected
+
+
+def bench_alignment(hours=3.0):
+    """校對後文本對齊原始逐詞時間軸 (逐行模式與全域帶狀模式)。"""
+    from subtitle_alignment import align_corrected_lines, build_srt_content
+
+    timings = _synthetic_lecture_words(hours)
+    original_lines = _lines_from_timings(timings)
+    corrected_lines = _simulate_corrections(original_lines)
+    total_chars = sum(len(line) for line in original_lines)
+    results = []
+
+    started = time.perf_counter()
+    cues = align_corrected_lines(timings, corrected_lines, len(original_lines))
+    build_srt_content(cues)
+    elapsed = time.perf_counter() - started
+    results.append(("逐行對齊", elapsed))
+
+    # 合併相鄰兩行，使行數不一致，強制走全域帶狀對齊路徑
+    merged_lines = [corrected_lines[k] + (corrected_lines[k + 1] if k + 1 < len(corrected_lines) else "")
+                    for k in range(0, len(corrected_lines), 2)]
+    started = time.perf_counter()
+    align_corrected_lines(timings, merged_lines, len(original_lines))
+    elapsed = time.perf_counter() - started
+    results.append(("全域帶狀對齊", elapsed))
+
+    print(f"[alignment] 合成講座 {hours:.1f} 小時：{len(timings['words'])} 個詞，{len(original_lines)} 行，{total_chars} 字元")
+    for label, elapsed in results:
+        print(f"[alignment]   {label}: {elapsed:.3f} 秒 ({total_chars / elapsed / 1000:.1f} k字元/秒)")
+    return results
+
+
+def _synthetic_segments(timings, with_words=True, seed=0):
+    # 將合成逐詞時間軸包裝為 faster-whisper 風格的片段；並隨機插入短碎片段 (模擬 VAD 的 0.3 秒閃現)
+    rng = random.Random(seed)
+    segments = []
+    current_line = -1
+    for word, start_ms, end_ms, line_index in zip(timings['words'], timings['start_ms'], timings['end_ms'], timings['line']):
+        if line_index != current_line or rng.random() < 0.03:
+            segments.append(SimpleNamespace(text="", start=start_ms / 1000, end=end_ms / 1000, words=[]))
+            current_line = line_index
+        segment = segments[-1]
+        segment.text += word
+        segment.end = end_ms / 1000
+        segment.words.append(SimpleNamespace(word=word, start=start_ms / 1000, end=end_ms / 1000))
+    if not with_words:
+        for segment in segments:
+            segment.words = None
+    return segments
+
+
+def bench_resegment(hours=(1.0, 3.0)):
+    """字幕重新切分：檢查單次線性掃描的耗時隨時長線性增長 (有/無逐詞時間軸)。"""
+    from subtitle_resegmenter import resegment_cues, MAX_CHARS_PER_LINE, MIN_CUE_DURATION_MS
+
+    results = []
+    for with_words in (True, False):
+        label = "逐詞" if with_words else "片段插值"
+        per_hour = []
+        for duration_hours in hours:
+            segments = _synthetic_segments(_synthetic_lecture_words(duration_hours), with_words=with_words)
+            started = time.perf_counter()
+            cues, _ = resegment_cues(segments)
+            elapsed = time.perf_counter() - started
+            over_length = sum(1 for _, _, text in cues if len(text) > MAX_CHARS_PER_LINE)
+            too_short = sum(1 for start_ms, end_ms, _ in cues if end_ms - start_ms < MIN_CUE_DURATION_MS)
+            per_hour.append(elapsed / duration_hours)
+            results.append((label, duration_hours, elapsed))
+            print(f"[resegment] {label} {duration_hours:.1f} 小時: {len(segments)} 片段 -> {len(cues)} 條字幕，"
+                  f"{elapsed:.3f} 秒；超長 {over_length} 條，過短 {too_short} 條")
+        print(f"[resegment] {label} 每小時耗時比 (最長/最短): {per_hour[-1] / per_hour[0]:.2f} (約 1.0 表示線性)")
+
+    # 英文片段、無逐詞時間軸 (WORD_TIMESTAMPS 關閉時的默認路徑)：過長的片段只能在空白處斷開
+    sentence = "This is a fairly long English sentence about the Medicine Buddha and his twelve great vows"
+    cues, _ = resegment_cues([SimpleNamespace(text=sentence, start=0.0, end=8.0, words=None)])
+    cue_words = [word for _, _, text in cues for word in text.split()]
+    print(f"[resegment] 英文片段 (無逐詞時間軸): {len(cues)} 條字幕 {[text for _, _, text in cues]}")
+    assert len(cues) > 1 and cue_words == sentence.split(), f"英文片段被切開單詞: {cues}"
+    return results
+
+
+# --- 端到端流程 (使用 bench_fakes 的離線替身) ---
+@contextlib.contextmanager
+def _quiet_run():
+    # 腳本的日誌 handler 寫入 stderr；測量期間將其丟棄，並以空字串回答所有 input() 提示
+    original_input = builtins.input
+    builtins.input = lambda prompt="": ""
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull), contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        builtins.input = original_input
+
+
+def _measure(fake_config, run):
+    # 測量一次運行的牆鐘時間、峰值記憶體、替身統計 (API 調用、睡眠) 與 run_metrics 的分階段耗時
+    import run_metrics
+    fake_config.reset_counters()
+    run_metrics.reset()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with _quiet_run():
+        run()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    metrics = run_metrics.snapshot()
+    stage_seconds = {name: timer['total_seconds'] for name, timer in metrics['timers'].items()}
+    return {'wall_seconds': round(elapsed, 3), 'peak_memory_mb': round(peak / 2**20, 2), **fake_config.summary(),
+            'stage_seconds': stage_seconds, 'derived_metrics': metrics['derived']}
+
+
+def _quiet_logger(name):
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def _prepare_corpus(root, lecture_count, seed=0):
+    # 生成合成語料：每個講座 30~120 分鐘的替身音頻檔案
+    from bench_fakes import write_fake_audio
+    rng = random.Random(seed)
+    input_dir = os.path.join(root, "input_audio")
+    output_dir = os.path.join(root, "output_transcriptions")
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    total_seconds = 0.0
+    for lecture_index in range(lecture_count):
+        duration = rng.uniform(30, 120) * 60
+        write_fake_audio(os.path.join(input_dir, f"T{lecture_index:03d}P001.wav"), duration)
+        total_seconds += duration
+    return input_dir, output_dir, total_seconds
+
+
+def run_transcriber_flow(fake_config, input_dir, output_dir, batched=False):
+    """以替身運行 local_transcriber.main 的完整流程。"""
+    import local_transcriber
+    local_transcriber.BATCHED_INFERENCE = batched
+    local_transcriber.reset_batched_pipeline()
+    local_transcriber.INPUT_AUDIO_DIR = input_dir
+    local_transcriber.OUTPUT_TRANSCRIPTIONS_ROOT_DIR = output_dir
+    local_transcriber.STATE_FILE_PATH = os.path.join(output_dir, ".processed_audio_files.json")
+    local_transcriber.TRANSCRIPTION_SERVER_SOCKET = os.path.join(output_dir, ".no_server.sock")
+    local_transcriber.LOCAL_STAGING_DIR = os.path.join(os.path.dirname(output_dir), "staging")
+    return _measure(fake_config, local_transcriber.main)
+
+
+def run_gemini_flow(fake_config, output_dir, cascade=False, gspread_client=None):
+    """
+    以替身運行 sheets_gemini_processor.process_transcriptions_and_apply_gemini 的完整流程。
+    gspread_client: 沿用先前運行的替身客戶端 (保留已創建的試算表)，None 表示新建。
+    """
+    import sheets_gemini_processor
+    import gemini_pool
+    from bench_fakes import FakeGspreadClient
+    gemini_pool.reset_pools() # 每次運行使用新的端點狀態 (速率限制窗口、冷卻)
+    sheets_gemini_processor.TRANSCRIPTIONS_ROOT_INPUT_DIR = output_dir
+    sheets_gemini_processor.GEMINI_STATE_FILE_PATH = os.path.join(output_dir, ".gemini_processed_state.json")
+    sheets_gemini_processor.gc = gspread_client or FakeGspreadClient()
+    sheets_gemini_processor.GEMINI_CASCADE_ENABLED = cascade
+    logger = _quiet_logger('SheetsGeminiProcessorLogger')
+    return _measure(fake_config, lambda: sheets_gemini_processor.process_transcriptions_and_apply_gemini(
+        logger, sheets_gemini_processor.DEFAULT_GEMINI_MAIN_INSTRUCTION, sheets_gemini_processor.DEFAULT_GEMINI_CORRECTION_RULES))
+
+
+def _simulate_retranscription(output_dir, changed_fraction=0.05, seed=0):
+    # 模擬以新的提示詞重新轉錄：隨機替換每個項目 _normal.txt 中一部分行
+    from bench_fakes import synthetic_line
+    rng = random.Random(seed)
+    for item_name in sorted(os.listdir(output_dir)):
+        normal_text_path = os.path.join(output_dir, item_name, f"{item_name}_normal.txt")
+        if not os.path.exists(normal_text_path):
+            continue
+        with open(normal_text_path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        lines = [synthetic_line(rng) if rng.random() < changed_fraction else line for line in lines]
+        with open(normal_text_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def bench_pipeline(lecture_counts=(1, 10), fake_config=None, gemini_keys=1, cascade=False, batched=False, work_queue_backend=None):
+    """
+    端到端流程：合成語料上運行轉錄與 Gemini/Sheets 處理，報告時間、API 調用、睡眠與峰值記憶體。
+    work_queue_backend: 以單個工作者啟用工作分攤 ("lease_files" 或 "sqlite")，測量認領租約的開銷。
+    """
+    import bench_fakes
+    import run_metrics
+    import runtime_env
+    import local_transcriber
+    import sheets_gemini_processor
+    fake_config = fake_config or bench_fakes.FakeConfig()
+    secrets = {("GEMINI_API_KEY" if index == 0 else f"GEMINI_API_KEY_{index + 1}"): f"fake-key-{index}" for index in range(gemini_keys)}
+    bench_fakes.install_fakes(fake_config, secrets)
+    runtime_env.set_environment(runtime_env.ColabEnvironment()) # 替身註冊了 google.colab 模組
+    results = []
+    try:
+        for lecture_count in lecture_counts:
+            with tempfile.TemporaryDirectory(prefix="autosrt_bench_") as root:
+                input_dir, output_dir, audio_seconds = _prepare_corpus(root, lecture_count)
+                run_metrics.METRICS_DIR = os.path.join(root, "metrics")
+                sheets_client = bench_fakes.FakeGspreadClient()
+                for module, queue_name in ((local_transcriber, "transcriber"), (sheets_gemini_processor, "gemini")):
+                    module.WORK_QUEUE_BACKEND = work_queue_backend
+                    module.WORK_QUEUE_DIR = os.path.join(root, "work_queue", queue_name)
+
+                def rerun_after_retranscription():
+                    _simulate_retranscription(output_dir)
+                    return run_gemini_flow(fake_config, output_dir, cascade, sheets_client)
+
+                for stage, run in (("transcriber", lambda: run_transcriber_flow(fake_config, input_dir, output_dir, batched)),
+                                   ("gemini", lambda: run_gemini_flow(fake_config, output_dir, cascade, sheets_client)),
+                                   ("re-gemini", rerun_after_retranscription)):
+                    result = {'stage': stage, 'lectures': lecture_count, 'audio_hours': round(audio_seconds / 3600, 2), **run()}
+                    results.append(result)
+                    print(f"[pipeline] {stage:<11} {lecture_count:>4} 講座 ({result['audio_hours']} 小時): "
+                          f"{result['wall_seconds']:.2f} 秒，峰值記憶體 {result['peak_memory_mb']} MB，"
+                          f"Whisper {result['whisper_calls']} 次，Gemini {result['gemini_calls']} 次 (429: {result['gemini_429s']})，"
+                          f"Sheets {result['sheets_calls']} 次 (429: {result['sheets_429s']})，"
+                          f"睡眠 {result['sleep_calls']} 次共 {result['slept_seconds']:.0f} 秒")
+                    if stage == 'transcriber' and result['whisper_clip_calls']:
+                        print(f"[pipeline] {'':<11} 幻覺過濾: 重新解碼 {result['whisper_clip_calls']} 次，"
+                              f"共 {result['whisper_clip_seconds']:.0f} 秒音頻 (佔 {result['whisper_clip_seconds'] / audio_seconds:.2%})")
+                    if stage == 'gemini' and len(result['gemini_calls_by_model']) > 1:
+                        tiers = "，".join(f"{tier} {result['stage_seconds'].get('gemini.tier.' + tier, 0.0):.2f} 秒"
+                                         for tier in ('draft', 'pro'))
+                        print(f"[pipeline] {'':<11} 各模型調用: {result['gemini_calls_by_model']}；各層耗時: {tiers}")
+    finally:
+        bench_fakes.uninstall_fakes()
+        runtime_env.set_environment(None)
+    return results
+
+
+# --- 啟動延遲 ---
+# 每個腳本：改為延遲導入前在模組頂部導入的重量級依賴，以及代表 "第一項實際工作" 的調用
+STARTUP_TARGETS = {
+    'local_transcriber': ((), "module.load_processed_files(os.path.join(scratch, 'state.json'), logger)"),
+    'sheets_gemini_processor': (
+        ('google.colab', 'google.generativeai', 'gspread', 'google.auth', 'pypdf', 'requests', 'IPython.display'),
+        "module.load_gemini_processed_state(logger, os.path.join(scratch, 'state.json'))"),
+    'text_segmenter_colab': (('gspread', 'google.auth', 'google.colab'), "module.srt_time_to_seconds('01:00:00,000')"),
+    'transcriber_daemon': ((), "module.file_priority('urgent_a.mp3')"),
+}
+
+_STARTUP_PROBE = """
+import os, sys, json, time, logging, tempfile, importlib
+started = time.perf_counter()
+for name in {eager!r}:
+    importlib.import_module(name)
+module = importlib.import_module({script!r})
+imported = time.perf_counter()
+import runtime_env
+runtime_env.get_environment()
+logger = logging.getLogger('startup_probe')
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+with tempfile.TemporaryDirectory() as scratch:
+    {first_work}
+finished = time.perf_counter()
+print(json.dumps({{'import_seconds': imported - started, 'first_work_seconds': finished - started,
+                  'modules_loaded': len(sys.modules)}}))
+"""
+
+
+def _run_startup_probe(script, eager, first_work, repeats):
+    import subprocess
+    import statistics
+    code = _STARTUP_PROBE.format(eager=tuple(eager), script=script, first_work=first_work)
+    env = {**os.environ, 'AUTOSRT_ENVIRONMENT': 'local'}
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   env=env, capture_output=True, text=True)
+        process_seconds = time.perf_counter() - started
+        if completed.returncode != 0:
+            error_lines = completed.stderr.strip().splitlines()
+            return {'error': error_lines[-1] if error_lines else f"退出碼 {completed.returncode}"}
+        samples.append({**json.loads(completed.stdout.strip().splitlines()[-1]), 'process_seconds': process_seconds})
+    return {key: round(statistics.median(sample[key] for sample in samples), 4) for key in samples[0]}
+
+
+def bench_work_queue(rounds=100, workers=4):
+    """工作分攤：多個工作者同時接手同一個過期租約時，每輪恰好一個工作者認領成功，且不引發異常。"""
+    import threading
+    import work_queue
+
+    logger = _quiet_logger('WorkQueueBenchLogger')
+    original_settle = work_queue.LEASE_CLAIM_SETTLE_SECONDS
+    work_queue.LEASE_CLAIM_SETTLE_SECONDS = 0.05
+    results = []
+    try:
+        for backend in ("lease_files", "sqlite"):
+            with tempfile.TemporaryDirectory() as directory:
+                dead = work_queue.open_work_queue(backend, directory, logger, worker_id="dead", lease_seconds=0.01)
+                keys = [f"lecture_{index:03d}.mp3" for index in range(rounds)]
+                for key in keys:
+                    dead.claim(key) # 不續期、不釋放：模擬已崩潰的工作者
+                dead.stop_event.set()
+                time.sleep(0.05) # 等待租約過期
+                queues = [work_queue.open_work_queue(backend, directory, logger, worker_id=f"w{index}") for index in range(workers)]
+                winners, errors = {key: [] for key in keys}, []
+                for key in keys:
+                    barrier = threading.Barrier(workers)
+                    def take_over(queue):
+                        try:
+                            barrier.wait()
+                            lease = queue.claim(key)
+                            if lease is not None:
+                                winners[key].append(queue.worker_id)
+                                queue.release(lease, done=True)
+                        except Exception as e:
+                            errors.append(e)
+                    threads = [threading.Thread(target=take_over, args=(queue,)) for queue in queues]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                for queue in queues:
+                    queue.close()
+                duplicated = sum(1 for owners in winners.values() if len(owners) > 1)
+                unclaimed = sum(1 for owners in winners.values() if not owners)
+                print(f"[work_queue] {backend:<11} {workers} 個工作者同時接手 {rounds} 個過期租約: "
+                      f"重複認領 {duplicated} 個，無人認領 {unclaimed} 個，異常 {len(errors)} 個")
+                assert not errors, f"接手過期租約時引發異常: {errors[0]!r}"
+                assert duplicated == 0, f"{backend} 後端重複認領了 {duplicated} 個租約"
+                results.append({'backend': backend, 'duplicated': duplicated, 'unclaimed': unclaimed})
+    finally:
+        work_queue.LEASE_CLAIM_SETTLE_SECONDS = original_settle
+    return results
+
+
+def bench_startup(repeats=5):
+    """各腳本從進程啟動到第一項實際工作的延遲：延遲導入 (當前) 與頂部導入重量級依賴 (之前) 對比。"""
+    results = []
+    for script, (eager, first_work) in STARTUP_TARGETS.items():
+        for variant, modules in (("lazy", ()), ("eager", eager)):
+            if variant == "eager" and not modules:
+                continue
+            result = {'script': script, 'variant': variant, **_run_startup_probe(script, modules, first_work, repeats)}
+            results.append(result)
+            if 'error' in result:
+                print(f"[startup] {script:<24} {variant:<5}: 無法啟動 ({result['error']})")
+            else:
+                print(f"[startup] {script:<24} {variant:<5}: 導入 {result['import_seconds'] * 1000:.1f} 毫秒，"
+                      f"至第一項工作 {result['first_work_seconds'] * 1000:.1f} 毫秒，進程總計 {result['process_seconds'] * 1000:.0f} 毫秒，"
+                      f"已載入模組 {result['modules_loaded']:.0f} 個")
+    return results
+
+
+def bench_batched(audio_path=None, model_size="tiny", batch_sizes=(1, 4, 8, 16), beam_sizes=(1, 5), audio_seconds=300, language="zh"):
+    """
+    CPU 上逐窗口解碼與 BatchedInferencePipeline 的對比：按束搜索寬度與批次大小報告實時率 (RTF)，
+    以及批次輸出相對於同一束寬逐窗口輸出的 CER / WER。需要真實的 faster-whisper 與一個語音檔案。
+    """
+    try:
+        import faster_whisper
+    except ImportError:
+        faster_whisper = None
+    if faster_whisper is None or not getattr(faster_whisper, '__file__', None): # pipeline 基準測試註冊的替身沒有 __file__
+        print("[batched] 跳過: 需要安裝 faster-whisper。")
+        return []
+    if not audio_path:
+        print("[batched] 跳過: 請以 --audio 指定一個語音檔案。")
+        return []
+    from transcript_quality import compare_transcripts
+    model = faster_whisper.WhisperModel(model_size, device="cpu", compute_type="int8")
+    pipeline = faster_whisper.BatchedInferencePipeline(model=model)
+    audio = faster_whisper.decode_audio(audio_path, sampling_rate=16000)[:int(audio_seconds * 16000)]
+    duration = len(audio) / 16000
+    results = []
+    for beam_size in beam_sizes:
+        runs = [(None, model, {})] + [(batch_size, pipeline, {'batch_size': batch_size}) for batch_size in batch_sizes]
+        reference_text = None
+        for batch_size, transcriber, options in runs:
+            started = time.perf_counter()
+            segments, _ = transcriber.transcribe(audio, language=language, beam_size=beam_size, vad_filter=True, **options)
+            text = "".join(segment.text for segment in segments)
+            elapsed = time.perf_counter() - started
+            if reference_text is None:
+                reference_text = text
+            quality = compare_transcripts(reference_text, text)
+            result = {'beam_size': beam_size, 'batch_size': batch_size, 'model': model_size, 'audio_seconds': round(duration, 1),
+                      'seconds': round(elapsed, 2), 'rtf': round(elapsed / duration, 4),
+                      'cer': round(quality['cer'], 4), 'wer': round(quality['wer'], 4)}
+            results.append(result)
+            mode = "逐窗口" if batch_size is None else f"批次 {batch_size:>3}"
+            print(f"[batched] beam={beam_size} {mode:<8} {model_size} {duration:.0f} 秒音頻: {elapsed:.2f} 秒，"
+                  f"RTF {result['rtf']:.3f}，CER {result['cer']:.2%}，WER {result['wer']:.2%}")
+    return results
+
+
+BENCHMARKS = {
+    'alignment': bench_alignment,
+    'resegment': bench_resegment,
+    'pipeline': bench_pipeline,
+    'work_queue': bench_work_queue,
+    'startup': bench_startup,
+    'batched': bench_batched,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="autosrt 性能基準測試")
+    parser.add_argument('names', nargs='*', help=f"要運行的基準測試 (可選: {', '.join(BENCHMARKS)})；預設全部")
+    parser.add_argument('--lectures', type=int, nargs='+', default=[1, 10], help="pipeline 基準測試的講座數量 (例如 1 10 100 500)")
+    parser.add_argument('--whisper-rtf', type=float, default=0.0, help="替身 Whisper 的實時率 (真實等待，默認 0)")
+    parser.add_argument('--whisper-hallucination-rate', type=float, default=0.0,
+                        help="替身 Whisper 每個片段變為重複循環或幻覺字句的機率 (默認 0)")
+    parser.add_argument('--gemini-latency', type=float, default=0.0, help="替身 Gemini 每次請求的延遲秒數")
+    parser.add_argument('--gemini-429-rate', type=float, default=0.0, help="替身 Gemini 隨機返回 429 的機率")
+    parser.add_argument('--gemini-rpm', type=int, default=None, help="替身 Gemini 每個金鑰每分鐘請求數配額 (虛擬時鐘)")
+    parser.add_argument('--gemini-keys', type=int, default=1, help="替身 Gemini 金鑰數量 (客戶端池的端點數)")
+    parser.add_argument('--cascade', action='store_true', help="啟用級聯模式 (初稿模型 + Pro 模型)")
+    parser.add_argument('--gemini-draft-edit-rate', type=float, default=None, help="替身初稿模型修改每個字元的機率 (默認與 Pro 相同)")
+    parser.add_argument('--gemini-draft-latency', type=float, default=None, help="替身初稿模型每次請求的延遲秒數 (默認與 Pro 相同)")
+    parser.add_argument('--gemini-uncertain-rate', type=float, default=0.0, help="替身初稿模型將一行標記為不確定的機率")
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help="替身 Sheets 每次調用的延遲秒數")
+    parser.add_argument('--sheets-429-rate', type=float, default=0.0, help="替身 Sheets 隨機返回 429 的機率")
+    parser.add_argument('--sheets-wpm', type=int, default=None, help="替身 Sheets 每分鐘寫入配額 (虛擬時鐘)")
+    parser.add_argument('--batched', action='store_true', help="pipeline 基準測試中啟用批次推理")
+    parser.add_argument('--work-queue', choices=("lease_files", "sqlite"), help="pipeline 基準測試中以單個工作者啟用工作分攤")
+    parser.add_argument('--audio', help="batched 基準測試使用的語音檔案")
+    parser.add_argument('--whisper-model', default="tiny", help="batched 基準測試使用的 Whisper 模型 (CPU，int8)")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16], help="batched 基準測試的批次大小")
+    parser.add_argument('--beam-sizes', type=int, nargs='+', default=[1, 5], help="batched 基準測試的束搜索寬度")
+    parser.add_argument('--audio-seconds', type=float, default=300, help="batched 基準測試截取的音頻長度 (秒)")
+    parser.add_argument('--json', help="將所有結果寫入指定的 JSON 檔案")
+    args = parser.parse_args(argv)
+
+    names = args.names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基準測試: {', '.join(unknown)}")
+    all_results = {}
+    for name in names:
+        kwargs = {}
+        if name == 'pipeline':
+            from bench_fakes import FakeConfig
+            kwargs = {'lecture_counts': args.lectures, 'fake_config': FakeConfig(
+                whisper_rtf=args.whisper_rtf, whisper_hallucination_rate=args.whisper_hallucination_rate,
+                gemini_latency_seconds=args.gemini_latency,
+                gemini_429_rate=args.gemini_429_rate, gemini_rpm_quota=args.gemini_rpm,
+                sheets_latency_seconds=args.sheets_latency, sheets_429_rate=args.sheets_429_rate,
+                sheets_writes_per_minute_quota=args.sheets_wpm, gemini_draft_edit_rate=args.gemini_draft_edit_rate,
+                gemini_draft_latency_seconds=args.gemini_draft_latency, gemini_uncertain_rate=args.gemini_uncertain_rate),
+                'gemini_keys': args.gemini_keys, 'cascade': args.cascade, 'batched': args.batched,
+                'work_queue_backend': args.work_queue}
+        elif name == 'batched':
+            kwargs = {'audio_path': args.audio, 'model_size': args.whisper_model, 'batch_sizes': args.batch_sizes,
+                      'beam_sizes': args.beam_sizes, 'audio_seconds': args.audio_seconds}
+        all_results[name] = BENCHMARKS[name](**kwargs)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(all_results, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Drive 目錄清單緩存：減少在 Google Drive FUSE 掛載點上的元數據操作 (每次 stat 可能耗時數百毫秒)。
+
+scan_entries() 以單次 os.scandir 取得目錄中的名稱與類型，再在線程池中並行 stat 取得大小與 mtime。
+DirectoryManifest 記錄根目錄下每個子目錄 (項目) 的檔案清單並持久化：重新整理時只重新掃描 mtime 變化
+或新出現的子目錄，其餘沿用緩存。之後的存在性檢查直接查詢清單，不再逐個調用 os.path.exists。
+prefetch() 在線程池中按順序預讀後續項目的檔案，使讀取延遲與處理重疊。
+
+注意：原地覆寫檔案通常不會改變目錄的 mtime，因此緩存中的檔案大小與 mtime 可能過時；
+清單只用於判斷檔案是否存在，檔案內容總是實際讀取。
+"""
+import os
+import json
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import run_metrics
+
+MANIFEST_FILE_NAME = ".directory_manifest.json" # 保存在被掃描的根目錄中
+MANIFEST_FORMAT_VERSION = 1
+MANIFEST_SCAN_WORKERS = 16 # 並行 stat / 掃描子目錄的線程數
+PREFETCH_WORKERS = 8 # 預讀檔案的線程數
+PREFETCH_AHEAD_ITEMS = 16 # 最多提前讀取的項目數 (限制記憶體用量)
+
+
+def _stat_entry(entry):
+    try:
+        stat_result = entry.stat()
+    except FileNotFoundError: # 掃描期間被刪除
+        return entry.name, None
+    return entry.name, {'is_dir': entry.is_dir(), 'size': stat_result.st_size, 'mtime': stat_result.st_mtime}
+
+def scan_entries(path, max_workers=MANIFEST_SCAN_WORKERS):
+    """
+    單次 os.scandir 掃描 path，返回 {名稱: {'is_dir', 'size', 'mtime'}} (保持 scandir 的順序)。
+    max_workers > 1 時在線程池中並行 stat。
+    """
+    with os.scandir(path) as iterator:
+        dir_entries = list(iterator)
+    if max_workers > 1 and len(dir_entries) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_stat_entry, dir_entries))
+    else:
+        results = [_stat_entry(entry) for entry in dir_entries]
+    run_metrics.increment('manifest.stats', len(dir_entries))
+    return {name: info for name, info in results if info is not None}
+
+
+class DirectoryManifest:
+    """根目錄下各子目錄的檔案清單 ({子目錄: {'mtime', 'files': {名稱: {'size', 'mtime'}}}})。"""
+
+    def __init__(self, root, manifest_path=None):
+        self.root = root
+        self.manifest_path = manifest_path or os.path.join(root, MANIFEST_FILE_NAME)
+        self.directories = {}
+
+    def load(self, logger):
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_FORMAT_VERSION and isinstance(data.get('directories'), dict):
+                self.directories = data['directories']
+            else:
+                logger.info(f"目錄清單緩存 '{self.manifest_path}' 的格式不符，將重新掃描全部子目錄。")
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"讀取目錄清單緩存 '{self.manifest_path}' 時發生錯誤: {e}。將重新掃描全部子目錄。")
+
+    def save(self, logger):
+        temp_manifest_path = self.manifest_path + ".tmp"
+        try:
+            with open(temp_manifest_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': MANIFEST_FORMAT_VERSION, 'directories': self.directories}, f, ensure_ascii=False)
+            os.replace(temp_manifest_path, self.manifest_path)
+        except Exception as e:
+            logger.warning(f"儲存目錄清單緩存至 '{self.manifest_path}' 時發生錯誤: {e}")
+
+    def refresh(self, logger):
+        """
+        載入緩存並與根目錄的當前內容比較：mtime 變化或新出現的子目錄在線程池中重新掃描，
+        已消失的子目錄從清單中移除。完成後保存緩存。
+        """
+        self.load(logger)
+        with run_metrics.stage('manifest.refresh'):
+            root_entries = scan_entries(self.root)
+            subdirectories = {name: info for name, info in root_entries.items() if info['is_dir']}
+            stale = [name for name, info in subdirectories.items()
+                     if self.directories.get(name, {}).get('mtime') != info['mtime']]
+
+            def scan_subdirectory(name):
+                try:
+                    entries = scan_entries(os.path.join(self.root, name), max_workers=1)
+                except OSError as e:
+                    logger.warning(f"掃描子目錄 '{name}' 時發生錯誤: {e}")
+                    return name, None
+                return name, {'mtime': subdirectories[name]['mtime'],
+                              'files': {file_name: {'size': info['size'], 'mtime': info['mtime']}
+                                        for file_name, info in entries.items() if not info['is_dir']}}
+
+            with ThreadPoolExecutor(max_workers=MANIFEST_SCAN_WORKERS) as executor:
+                scanned = dict(executor.map(scan_subdirectory, stale))
+            self.directories = {name: scanned.get(name) or self.directories.get(name) for name in subdirectories}
+            self.directories = {name: listing for name, listing in self.directories.items() if listing is not None}
+        run_metrics.increment('manifest.directories_rescanned', len(stale))
+        run_metrics.increment('manifest.directories_reused', len(subdirectories) - len(stale))
+        logger.info(f"目錄清單已更新: {len(subdirectories)} 個子目錄，其中 {len(stale)} 個重新掃描，"
+                    f"{len(subdirectories) - len(stale)} 個沿用緩存。")
+        self.save(logger)
+        return self
+
+    def subdirectories(self):
+        return sorted(self.directories)
+
+    def files(self, subdirectory):
+        return self.directories.get(subdirectory, {}).get('files', {})
+
+    def has_file(self, subdirectory, file_name):
+        return file_name in self.files(subdirectory)
+
+
+def read_text_file(path):
+    """讀取 UTF-8 文字檔案，返回 (內容, None)；失敗時返回 (None, 異常)。"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read(), None
+    except Exception as e:
+        return None, e
+
+def prefetch(keys, load, max_workers=PREFETCH_WORKERS, ahead=PREFETCH_AHEAD_ITEMS):
+    """
+    按 keys 的順序產生 (key, load(key))，並在線程池中提前執行其後最多 ahead 個 load。
+    load 中引發的異常會在產生對應 key 時重新引發。
+    """
+    keys = list(keys)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = collections.deque()
+        next_index = 0
+        while pending or next_index < len(keys):
+            while next_index < len(keys) and len(pending) < ahead:
+                pending.append((keys[next_index], executor.submit(load, keys[next_index])))
+                next_index += 1
+            key, future = pending.popleft()
+            with run_metrics.stage('prefetch.wait'):
+                result = future.result()
+            yield key, result
@@ -0,0 +1,185 @@
+"""
+本地暫存 + 背景同步到 Google Drive。
+
+轉錄輸出先寫入本地磁碟的暫存目錄 (快速)，再由背景線程複製到 Drive 上的輸出目錄，失敗時以指數退避重試。
+只有在一個音頻檔案的全部輸出都複製完成後，才將它加入已處理集合並保存狀態檔案，
+因此中斷時不會出現「已標記完成但 Drive 上缺少輸出」的情況；轉錄速度也不再受 Drive 寫入延遲影響。
+
+每個暫存項目目錄中的 STAGED_MARKER_FILE_NAME 記錄其對應的音頻檔案；上傳成功後刪除整個暫存項目目錄。
+程式在上傳完成前退出時，下次啟動可調用 recover() 將遺留的暫存項目重新加入上傳佇列，無需重新轉錄。
+"""
+import os
+import json
+import queue
+import shutil
+import threading
+
+import run_metrics
+from work_queue import worker_temp_path
+
+STAGED_MARKER_FILE_NAME = ".staged.json" # 暫存項目的全部輸出寫完後才寫入此標記
+UPLOAD_MAX_RETRIES = 5
+UPLOAD_BASE_DELAY_SECONDS = 5 # 重試等待: 5、10、20、40 秒...
+
+
+def write_staged_marker(staging_dir, audio_file_name):
+    """在暫存項目目錄寫入完成標記 (先寫臨時檔案再重命名)。"""
+    marker_path = os.path.join(staging_dir, STAGED_MARKER_FILE_NAME)
+    temp_marker_path = worker_temp_path(marker_path)
+    with open(temp_marker_path, 'w', encoding='utf-8') as f:
+        json.dump({'audio_file_name': audio_file_name}, f, ensure_ascii=False)
+    os.replace(temp_marker_path, marker_path)
+
+def _copy_directory_files(staging_dir, destination_dir):
+    # 逐個複製暫存檔案 (先寫臨時檔案再重命名，避免 Drive 上出現寫了一半的檔案)
+    # 臨時檔案名包含主機名/進程號/線程號：常駐服務與手動運行同時上傳同一個輸出時不會爭用同一個臨時檔案
+    os.makedirs(destination_dir, exist_ok=True)
+    copied = 0
+    for file_name in sorted(os.listdir(staging_dir)):
+        source_path = os.path.join(staging_dir, file_name)
+        if file_name == STAGED_MARKER_FILE_NAME or file_name.endswith(".tmp") or not os.path.isfile(source_path):
+            continue # 標記檔案及中斷時遺留的臨時檔案不上傳
+        destination_path = os.path.join(destination_dir, file_name)
+        temp_destination_path = worker_temp_path(destination_path)
+        try:
+            shutil.copyfile(source_path, temp_destination_path)
+            os.replace(temp_destination_path, destination_path)
+        except OSError:
+            # 各進程的臨時檔案名不同，失敗時自行清理，避免重試後在 Drive 上遺留
+            if os.path.exists(temp_destination_path):
+                os.remove(temp_destination_path)
+            raise
+        copied += 1
+    return copied
+
+
+class DriveUploader:
+    """
+    單一背景線程依序上傳暫存項目。
+    save_state(processed_files): 將已處理集合保存到狀態檔案的函數 (在上傳線程中調用)。
+    state_lock: 與調用方共用的鎖；上傳線程在持有此鎖時修改 processed_files 並保存狀態，
+    調用方 (主線程/守護進程) 修改或遍歷同一個集合時也應持有此鎖。
+    """
+
+    def __init__(self, logger, save_state, state_lock=None):
+        self.logger = logger
+        self.save_state = save_state
+        self.state_lock = state_lock if state_lock is not None else threading.RLock()
+        self.jobs = queue.Queue()
+        self.pending = set() # 已轉錄、尚未上傳完成的音頻檔案名
+        self.failed = set() # 重試後仍上傳失敗的音頻檔案名 (暫存檔案保留，下次啟動時可恢復)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="drive-uploader", daemon=True)
+        self.thread.start()
+
+    def submit(self, audio_file_name, staging_dir, destination_dir, processed_files, on_complete=None):
+        """
+        將一個暫存項目加入上傳佇列；上傳完成後把 audio_file_name 加入 processed_files 並保存狀態。
+        on_complete(success): 上傳完成或最終失敗後在上傳線程中調用 (例如釋放工作佇列的租約)。
+        """
+        with self.lock:
+            self.pending.add(audio_file_name)
+            self.failed.discard(audio_file_name)
+        self.jobs.put((audio_file_name, staging_dir, destination_dir, processed_files, on_complete))
+        self.logger.info(f"'{audio_file_name}' 的輸出已暫存於 '{staging_dir}'，已加入背景上傳佇列 (佇列長度 {self.jobs.qsize()})。")
+
+    def is_pending(self, audio_file_name):
+        with self.lock:
+            return audio_file_name in self.pending
+
+    def recover(self, staging_root, output_root, processed_files, on_complete=None):
+        """
+        將上次運行遺留、已寫完的暫存項目重新加入上傳佇列；返回加入的數量。
+        on_complete(audio_file_name, success): 每個恢復項目上傳完成或最終失敗後在上傳線程中調用 (例如記錄工作佇列的完成記錄)。
+        """
+        if not os.path.isdir(staging_root):
+            return 0
+        recovered = 0
+        for item_name in sorted(os.listdir(staging_root)):
+            staging_dir = os.path.join(staging_root, item_name)
+            marker_path = os.path.join(staging_dir, STAGED_MARKER_FILE_NAME)
+            if not os.path.exists(marker_path):
+                continue # 寫入未完成的暫存項目，對應的音頻會被重新轉錄
+            try:
+                with open(marker_path, 'r', encoding='utf-8') as f:
+                    audio_file_name = json.load(f)['audio_file_name']
+            except (OSError, ValueError, KeyError) as e:
+                self.logger.warning(f"讀取暫存標記 '{marker_path}' 時發生錯誤: {e}，跳過該暫存項目。")
+                continue
+            callback = None
+            if on_complete is not None:
+                callback = lambda success, audio_file_name=audio_file_name: on_complete(audio_file_name, success)
+            self.submit(audio_file_name, staging_dir, os.path.join(output_root, item_name), processed_files, callback)
+            recovered += 1
+        if recovered:
+            self.logger.info(f"已將 {recovered} 個上次未完成上傳的暫存項目重新加入上傳佇列。")
+        return recovered
+
+    def _upload(self, audio_file_name, staging_dir, destination_dir, processed_files):
+        for attempt in range(UPLOAD_MAX_RETRIES):
+            try:
+                with run_metrics.stage('drive_upload'):
+                    copied = _copy_directory_files(staging_dir, destination_dir)
+                break
+            except OSError as e:
+                if attempt == UPLOAD_MAX_RETRIES - 1:
+                    run_metrics.increment('drive_upload.failures')
+                    self.logger.error(f"上傳 '{staging_dir}' 至 '{destination_dir}' 在 {UPLOAD_MAX_RETRIES} 次嘗試後仍失敗: {e}。"
+                                      f"暫存檔案已保留，'{audio_file_name}' 不會被標記為已處理。", exc_info=True)
+                    return False
+                delay = UPLOAD_BASE_DELAY_SECONDS * (2 ** attempt)
+                run_metrics.increment('drive_upload.retries')
+                self.logger.warning(f"上傳 '{staging_dir}' 時發生錯誤: {e}。將在 {delay} 秒後重試 (嘗試 {attempt + 1}/{UPLOAD_MAX_RETRIES})...")
+                run_metrics.sleep(delay, 'drive_upload_retry')
+
+        # 全部輸出已在 Drive 上，才標記為已處理
+        with self.state_lock, run_metrics.stage('drive_write'):
+            processed_files.add(audio_file_name)
+            self.save_state(processed_files)
+        run_metrics.increment('drive_upload.items')
+        run_metrics.increment('drive_upload.files', copied)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        self.logger.info(f"已將 '{audio_file_name}' 的 {copied} 個輸出檔案上傳至 '{destination_dir}'，並標記為已處理。")
+        return True
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            success = False
+            try:
+                if job is None:
+                    return
+                success = self._upload(*job[:4])
+                if not success:
+                    with self.lock:
+                        self.failed.add(job[0])
+            except Exception as e:
+                self.logger.error(f"背景上傳 '{job[0]}' 時發生未預期的錯誤: {e}", exc_info=True)
+                with self.lock:
+                    self.failed.add(job[0])
+            finally:
+                if job is not None:
+                    with self.lock:
+                        self.pending.discard(job[0])
+                    if job[4] is not None:
+                        try:
+                            job[4](success)
+                        except Exception as e:
+                            self.logger.error(f"'{job[0]}' 上傳完成後的回調發生錯誤: {e}", exc_info=True)
+                self.jobs.task_done()
+
+    def wait(self):
+        """等待佇列中的全部項目上傳完成 (或失敗)。"""
+        if self.jobs.unfinished_tasks:
+            self.logger.info(f"等待背景上傳完成 (剩餘 {self.jobs.unfinished_tasks} 個項目)...")
+        with run_metrics.stage('drive_upload_drain'):
+            self.jobs.join()
+        with self.lock:
+            failed = sorted(self.failed)
+        if failed:
+            self.logger.warning(f"{len(failed)} 個項目上傳失敗，暫存檔案已保留，將在下次 recover() 時重新上傳: {', '.join(failed)}")
+
+    def close(self):
+        self.wait()
+        self.jobs.put(None)
+        self.thread.join()
@@ -0,0 +1,242 @@
+"""
+多金鑰 / 多模型的 Gemini 客戶端池。
+
+每個端點 (一個 API 金鑰 + 一個模型) 各有一個滑動窗口速率限制器 (每分鐘請求數與 token 數) 與健康狀態。
+請求路由到當前負載最低、可立即發送的健康端點；某個端點返回 429 時將其冷卻，並立即改用其他端點，
+只有在所有端點都不可用時才等待。模型物件在端點首次使用時創建，之後在所有項目之間重用。
+SDK 的模型在首次請求時取得當前 genai.configure 配置的客戶端，之後一直使用它。因此每個端點只配置一次：
+創建模型時以該端點的金鑰調用 genai.configure，並在同一次 _GENAI_CONFIGURE_LOCK 內完成首次請求 (綁定客戶端)；
+之後的請求不再配置、也不持有該鎖，不同端點的請求可以同時進行。
+
+金鑰來自運行環境的密鑰 (Colab Secrets 或環境變數，見 runtime_env.py)，按 GEMINI_API_KEY_SECRETS 的順序讀取，
+未設定的名稱會被跳過。
+"""
+import math
+import time
+import threading
+from collections import deque
+
+import run_metrics
+import runtime_env
+
+GEMINI_API_KEY_SECRETS = ("GEMINI_API_KEY", "GEMINI_API_KEY_2", "GEMINI_API_KEY_3", "GEMINI_API_KEY_4")
+GEMINI_POOL_MODELS = ("gemini-1.5-pro-latest",) # 每個金鑰為每個模型各建立一個端點
+GEMINI_REQUESTS_PER_MINUTE_PER_ENDPOINT = 2 # 每個端點的本地速率限制 (Gemini 1.5 Pro 免費層)；None 表示不限制
+GEMINI_TOKENS_PER_MINUTE_PER_ENDPOINT = 32000
+GEMINI_POOL_MAX_ATTEMPTS = 8 # 每個請求最多嘗試次數 (含改用其他端點)
+ENDPOINT_THROTTLE_COOLDOWN_SECONDS = 60 # 端點返回 429 後的冷卻時間，連續 429 時加倍
+ENDPOINT_MAX_COOLDOWN_SECONDS = 600
+ENDPOINT_ERROR_COOLDOWN_SECONDS = 30 # 暫時性錯誤 (5xx、超時) 後的冷卻時間
+TOKENS_PER_CJK_CHAR = 1.0
+CHARS_PER_NON_CJK_TOKEN = 4.0
+
+_RATE_LIMIT_WINDOW_SECONDS = 60.0
+_TRANSIENT_ERROR_MARKERS = ("500", "503", "unavailable", "deadline", "internal error", "timed out")
+_GENAI_CONFIGURE_LOCK = threading.Lock() # genai.configure 修改全局狀態；持有至模型綁定客戶端為止
+
+
+def estimate_tokens(text):
+    """粗略的 Gemini token 估計：每個中日韓字元約 1 個 token，其他字元約每 4 個 1 個 token。"""
+    cjk_chars = sum(1 for char in text if '\u3400' <= char <= '\u9fff' or '\uf900' <= char <= '\ufaff')
+    return int(cjk_chars * TOKENS_PER_CJK_CHAR + math.ceil((len(text) - cjk_chars) / CHARS_PER_NON_CJK_TOKEN))
+
+def is_rate_limit_error(error):
+    error_message = str(error)
+    return "429" in error_message or "ResourceExhausted" in str(type(error)) or "rate limit" in error_message.lower()
+
+def is_transient_error(error):
+    error_message = str(error).lower()
+    return any(marker in error_message for marker in _TRANSIENT_ERROR_MARKERS)
+
+
+class GeminiPoolExhausted(Exception):
+    """所有端點在允許的嘗試次數內都未能完成請求。"""
+
+
+class RateLimiter:
+    """滑動窗口限制器：記錄最近 60 秒內的請求時間與 token 數。"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = deque() # (時間, token 數)，按時間先後
+
+    def _trim(self, now):
+        while self.window and now - self.window[0][0] >= _RATE_LIMIT_WINDOW_SECONDS:
+            self.window.popleft()
+
+    def available_at(self, tokens, now):
+        """最早可以發送一個 tokens 大小的請求的時間。"""
+        self._trim(now)
+        ready_at = now
+        if self.requests_per_minute and len(self.window) >= self.requests_per_minute:
+            ready_at = max(ready_at, self.window[len(self.window) - self.requests_per_minute][0] + _RATE_LIMIT_WINDOW_SECONDS)
+        if self.tokens_per_minute:
+            excess = sum(used for _, used in self.window) + min(tokens, self.tokens_per_minute) - self.tokens_per_minute
+            for sent_at, used in self.window:
+                if excess <= 0:
+                    break
+                ready_at = max(ready_at, sent_at + _RATE_LIMIT_WINDOW_SECONDS)
+                excess -= used
+        return ready_at
+
+    def load(self, now):
+        """窗口內已用配額的比例 (請求數與 token 數取較大者)。"""
+        self._trim(now)
+        request_load = len(self.window) / self.requests_per_minute if self.requests_per_minute else 0.0
+        token_load = sum(used for _, used in self.window) / self.tokens_per_minute if self.tokens_per_minute else 0.0
+        return max(request_load, token_load)
+
+    def record(self, tokens, now):
+        self.window.append((now, tokens))
+
+
+class GeminiEndpoint:
+    def __init__(self, name, api_key, model_name, requests_per_minute, tokens_per_minute):
+        self.name = name # 密鑰名稱/模型名稱，日誌中不出現金鑰本身
+        self.api_key = api_key
+        self.model_name = model_name
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.model = None
+        self.client_bound = False # 模型是否已完成首次請求 (已綁定該端點金鑰的客戶端)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_throttles = 0
+        self.requests = 0
+        self.throttles = 0
+
+
+class GeminiClientPool:
+    def __init__(self, endpoints, generation_config, logger):
+        self.endpoints = endpoints
+        self.generation_config = generation_config
+        self.logger = logger
+        self.lock = threading.Lock()
+
+    def _create_model(self, endpoint):
+        import google.generativeai as genai
+        with _GENAI_CONFIGURE_LOCK:
+            genai.configure(api_key=endpoint.api_key)
+            model = genai.GenerativeModel(model_name=endpoint.model_name, generation_config=self.generation_config)
+        self.logger.info(f"已為 Gemini 端點 '{endpoint.name}' 創建模型物件。")
+        return model
+
+    def _send(self, endpoint, prompt):
+        if endpoint.client_bound:
+            return endpoint.model.generate_content(prompt)
+        # 首次請求時模型才取得客戶端：與該端點的 configure 一起在鎖內進行 (見模組說明)
+        import google.generativeai as genai
+        with _GENAI_CONFIGURE_LOCK:
+            genai.configure(api_key=endpoint.api_key)
+            try:
+                return endpoint.model.generate_content(prompt)
+            finally:
+                endpoint.client_bound = True
+
+    def _select(self, tokens):
+        """返回 (端點, 需要等待的秒數)：優先選擇可立即發送且負載最低的健康端點。"""
+        now = time.monotonic()
+        best, best_key = None, None
+        for endpoint in self.endpoints:
+            ready_at = max(endpoint.cooldown_until, endpoint.limiter.available_at(tokens, now))
+            key = (ready_at, endpoint.in_flight, endpoint.limiter.load(now), endpoint.requests)
+            if best_key is None or key < best_key:
+                best, best_key = endpoint, key
+        return best, max(0.0, best_key[0] - now)
+
+    def generate_content(self, prompt, expected_output_tokens=0):
+        """發送一個請求並返回響應；429 與暫時性錯誤自動改用其他端點，其他錯誤直接引發。"""
+        tokens = estimate_tokens(prompt) + expected_output_tokens
+        last_error = None
+        for attempt in range(GEMINI_POOL_MAX_ATTEMPTS):
+            with self.lock:
+                endpoint, wait_seconds = self._select(tokens)
+            if wait_seconds > 0:
+                self.logger.info(f"所有 Gemini 端點暫時不可用 (速率限制或冷卻中)，等待 {wait_seconds:.1f} 秒後使用 '{endpoint.name}'...")
+                run_metrics.sleep(wait_seconds, 'gemini_pool_wait')
+            with self.lock:
+                if endpoint.model is None:
+                    endpoint.model = self._create_model(endpoint)
+                endpoint.limiter.record(tokens, time.monotonic())
+                endpoint.in_flight += 1
+                endpoint.requests += 1
+            run_metrics.increment('gemini.calls')
+            run_metrics.increment(f"gemini.endpoint.{endpoint.name}.calls")
+            try:
+                with run_metrics.stage('gemini.request'):
+                    response = self._send(endpoint, prompt)
+            except Exception as e:
+                last_error = e
+                with self.lock:
+                    endpoint.in_flight -= 1
+                    if is_rate_limit_error(e):
+                        endpoint.throttles += 1
+                        endpoint.consecutive_throttles += 1
+                        cooldown = min(ENDPOINT_MAX_COOLDOWN_SECONDS, ENDPOINT_THROTTLE_COOLDOWN_SECONDS * 2 ** (endpoint.consecutive_throttles - 1))
+                    elif is_transient_error(e):
+                        cooldown = ENDPOINT_ERROR_COOLDOWN_SECONDS
+                    else:
+                        raise
+                    endpoint.cooldown_until = time.monotonic() + cooldown
+                run_metrics.increment('gemini.429' if is_rate_limit_error(e) else 'gemini.transient_errors')
+                self.logger.warning(f"Gemini 端點 '{endpoint.name}' 請求失敗 ({e})，冷卻 {cooldown} 秒並改用其他端點 (嘗試 {attempt + 1}/{GEMINI_POOL_MAX_ATTEMPTS})。")
+                continue
+            with self.lock:
+                endpoint.in_flight -= 1
+                endpoint.consecutive_throttles = 0
+            usage = getattr(response, 'usage_metadata', None)
+            if usage is not None:
+                run_metrics.increment('gemini.prompt_tokens', getattr(usage, 'prompt_token_count', 0) or 0)
+                run_metrics.increment('gemini.output_tokens', getattr(usage, 'candidates_token_count', 0) or 0)
+            return response
+        raise GeminiPoolExhausted(f"Gemini 請求在 {GEMINI_POOL_MAX_ATTEMPTS} 次嘗試後仍未成功: {last_error}")
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return {endpoint.name: {'requests': endpoint.requests, 'throttles': endpoint.throttles,
+                                    'cooling_seconds': round(max(0.0, endpoint.cooldown_until - now), 1),
+                                    'load': round(endpoint.limiter.load(now), 2)} for endpoint in self.endpoints}
+
+
+def load_api_keys(logger):
+    """按 GEMINI_API_KEY_SECRETS 順序讀取已設定的金鑰，返回 [(密鑰名稱, 金鑰)] (重複的金鑰只保留一個)。"""
+    environment = runtime_env.get_environment(logger)
+    keys, seen = [], set()
+    for secret_name in GEMINI_API_KEY_SECRETS:
+        api_key = environment.get_secret(secret_name)
+        if api_key and api_key not in seen:
+            seen.add(api_key)
+            keys.append((secret_name, api_key))
+    return keys
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(logger, generation_config, model_names=GEMINI_POOL_MODELS,
+             requests_per_minute=GEMINI_REQUESTS_PER_MINUTE_PER_ENDPOINT, tokens_per_minute=GEMINI_TOKENS_PER_MINUTE_PER_ENDPOINT):
+    """
+    返回 (並緩存) 指定模型與生成參數的客戶端池，使模型物件在所有項目之間重用。
+    requests_per_minute / tokens_per_minute: 每個端點的本地速率限制 (不同模型的免費層配額不同)。
+    沒有設定任何金鑰時返回 None。
+    """
+    cache_key = (tuple(model_names), tuple(sorted(generation_config.items())), requests_per_minute, tokens_per_minute)
+    with _pools_lock:
+        pool = _pools.get(cache_key)
+        if pool is not None:
+            return pool
+        keys = load_api_keys(logger)
+        if not keys:
+            return None
+        endpoints = [GeminiEndpoint(f"{secret_name}/{model_name}", api_key, model_name,
+                                    requests_per_minute, tokens_per_minute)
+                     for secret_name, api_key in keys for model_name in model_names]
+        logger.info(f"Gemini 客戶端池: {len(keys)} 個金鑰 × {len(model_names)} 個模型 = {len(endpoints)} 個端點 "
+                    f"({', '.join(endpoint.name for endpoint in endpoints)})。")
+        pool = _pools[cache_key] = GeminiClientPool(endpoints, generation_config, logger)
+        return pool
+
+def reset_pools():
+    """丟棄已緩存的客戶端池 (金鑰變更後或測試時使用)。"""
+    with _pools_lock:
+        _pools.clear()
@@ -0,0 +1,231 @@
+"""
+Whisper 幻覺與重複循環檢測，以及只針對可疑時間範圍的重新解碼。
+
+flag_segments() 是逐片段的串流過濾 (只保留前一個片段的文本，總耗時與片段數成正比)，檢查以下原因：
+    repeat       片段內有連續重複的 n-gram (例如「南無南無南無…」)，或與前一個片段的文本完全相同
+    compression  文本的壓縮比過高 (重複內容壓縮率高；Whisper 默認以 2.4 為界)
+    logprob      平均對數概率過低
+    no_speech    Whisper 判斷為無語音 (no_speech_prob 高) 卻輸出了文本
+    phrase       包含已知的幻覺字句 (例如字幕署名)
+redecode_flagged() 將被標記的連續片段合併為時間範圍，以 clip_timestamps 只重新解碼這些範圍
+(不以前文為條件、啟用溫度回退)；重新解碼後仍被標記的片段由 clean_segment() 清理：
+移除幻覺字句、將重複循環壓縮為一次、丟棄無語音片段。
+"""
+import os
+import re
+import zlib
+from types import SimpleNamespace
+
+import run_metrics
+from transcript_quality import word_spans
+
+DEFAULT_HALLUCINATION_PHRASES = ( # 常見於靜音或音樂段落的幻覺字句 (比較時忽略空白與大小寫)
+    "字幕由 Amara.org 社群提供",
+    "字幕由Amara.org社区提供",
+    "請不吝點贊 訂閱 轉發 打賞支持明鏡與點點欄目",
+    "请不吝点赞 订阅 转发 打赏支持明镜与点点栏目",
+    "優優獨播劇場——YoYo Television Series Exclusive",
+    "中文字幕提供",
+    "本字幕由志願者提供",
+)
+REPEAT_MAX_UNIT_TOKENS = 8 # 檢查的重複單位最長詞數 (中日韓文字每字一詞)
+REPEAT_MIN_REPEATS = 4 # 同一單位連續出現至少此次數...
+REPEAT_MIN_SPAN_TOKENS = 12 # ...且重複部分至少此詞數，才視為重複循環 (避免誤判「嗯嗯嗯」之類的短重複)
+SEGMENT_REPEAT_MIN_CHARS = 4 # 與前一片段文本相同時，至少此字數才視為重複
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_PROB_THRESHOLD = 0.6
+REDECODE_MERGE_GAP_SECONDS = 1.0 # 間隔不超過此值的被標記片段合併為一個重新解碼範圍
+REDECODE_MIN_RANGE_SECONDS = 0.5 # 過短的範圍向兩側擴展至此長度
+REDECODE_MAX_FRACTION = 0.3 # 被標記的總時長超過音頻時長的此比例時不重新解碼 (只清理)，避免重新解碼整個檔案
+REDECODE_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0) # 溫度回退：壓縮比或對數概率不達標時以更高溫度重試
+
+
+def load_phrases(path, logger):
+    """返回默認幻覺字句加上 path (每行一個字句，# 開頭為註釋) 中的字句；檔案不存在時只返回默認值。"""
+    phrases = list(DEFAULT_HALLUCINATION_PHRASES)
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                extra = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+            phrases.extend(extra)
+            logger.info(f"已從 '{path}' 載入 {len(extra)} 個自定義幻覺字句。")
+        except OSError as e:
+            logger.warning(f"讀取幻覺字句檔案 '{path}' 時發生錯誤: {e}。只使用默認字句。")
+    return phrases
+
+def _normalize(text):
+    return "".join(text.split()).lower()
+
+def _phrase_pattern(phrase):
+    # 字元之間允許任意空白，忽略大小寫
+    return re.compile(r"\s*".join(re.escape(char) for char in "".join(phrase.split())), re.IGNORECASE)
+
+def compression_ratio(text):
+    """UTF-8 文本與其 zlib 壓縮結果的長度比 (與 Whisper 的計算方式相同)。"""
+    text_bytes = text.encode('utf-8')
+    return len(text_bytes) / len(zlib.compress(text_bytes)) if text_bytes else 0.0
+
+def find_repeat(text):
+    """
+    返回片段中最長的連續重複 (起始字元位置, 結束字元位置, 單位結束字元位置, 重複次數)；
+    未達 REPEAT_MIN_REPEATS / REPEAT_MIN_SPAN_TOKENS 時返回 None。
+    """
+    spans = word_spans(text)
+    tokens = [token for token, _, _ in spans]
+    best = None
+    for unit in range(1, min(REPEAT_MAX_UNIT_TOKENS, len(tokens) // REPEAT_MIN_REPEATS) + 1):
+        run_start, run_length = 0, 0 # 連續滿足 tokens[i] == tokens[i + unit] 的位置
+        for i in range(len(tokens) - unit + 1):
+            if i + unit < len(tokens) and tokens[i] == tokens[i + unit]:
+                if run_length == 0:
+                    run_start = i
+                run_length += 1
+                continue
+            repeats = run_length // unit + 1
+            span_tokens = repeats * unit
+            if repeats >= REPEAT_MIN_REPEATS and span_tokens >= REPEAT_MIN_SPAN_TOKENS and (best is None or span_tokens > best[0]):
+                best = (span_tokens, run_start, unit, repeats)
+            run_length = 0
+    if best is None:
+        return None
+    span_tokens, run_start, unit, repeats = best
+    return spans[run_start][1], spans[run_start + span_tokens - 1][2], spans[run_start + unit - 1][2], repeats
+
+def segment_flags(segment, phrases, previous_text=None):
+    """返回片段被標記的原因列表 (空列表表示正常)。"""
+    text = segment.text.strip()
+    normalized = _normalize(text)
+    if not normalized:
+        return []
+    reasons = []
+    if find_repeat(text) or (len(normalized) >= SEGMENT_REPEAT_MIN_CHARS and normalized == previous_text):
+        reasons.append('repeat')
+    ratio = getattr(segment, 'compression_ratio', None)
+    if (ratio if ratio is not None else compression_ratio(text)) > COMPRESSION_RATIO_THRESHOLD:
+        reasons.append('compression')
+    logprob = getattr(segment, 'avg_logprob', None)
+    if logprob is not None and logprob < LOGPROB_THRESHOLD:
+        reasons.append('logprob')
+    no_speech_prob = getattr(segment, 'no_speech_prob', None)
+    if no_speech_prob is not None and no_speech_prob > NO_SPEECH_PROB_THRESHOLD:
+        reasons.append('no_speech')
+    if any(_normalize(phrase) in normalized for phrase in phrases):
+        reasons.append('phrase')
+    return reasons
+
+def flag_segments(segments, phrases):
+    """串流過濾：對每個片段產生 (片段, 原因列表)，可直接包裝 transcribe() 返回的片段生成器。"""
+    previous_text = None
+    for segment in segments:
+        reasons = segment_flags(segment, phrases, previous_text)
+        previous_text = _normalize(segment.text)
+        yield segment, reasons
+
+def _with_text(segment, text):
+    # 文本被修改後逐詞時間軸不再對應，改以整段時間表示
+    return SimpleNamespace(start=segment.start, end=segment.end, text=text, words=None,
+                           avg_logprob=getattr(segment, 'avg_logprob', None),
+                           compression_ratio=getattr(segment, 'compression_ratio', None),
+                           no_speech_prob=getattr(segment, 'no_speech_prob', None))
+
+def clean_segment(segment, reasons, phrases):
+    """按原因清理仍被標記的片段；返回清理後的片段，整段應被丟棄時返回 None。"""
+    if 'no_speech' in reasons and 'logprob' in reasons:
+        return None # 與 Whisper 的靜音判斷一致：無語音且低置信度
+    text = segment.text
+    if 'phrase' in reasons:
+        for phrase in phrases:
+            text = _phrase_pattern(phrase).sub("", text)
+        if 'no_speech' in reasons:
+            return None # 無語音段落中的幻覺字句，其餘文本也不可信
+    if 'repeat' in reasons or 'compression' in reasons:
+        repeat = find_repeat(text)
+        while repeat:
+            start, end, unit_end, _ = repeat
+            text = text[:unit_end] + text[end:] # 只保留一次重複單位
+            repeat = find_repeat(text)
+    if not text.strip():
+        return None
+    return segment if text == segment.text else _with_text(segment, text.strip())
+
+def flagged_ranges(segments, flags):
+    """將被標記的連續片段合併為 [(起始秒, 結束秒, [片段索引])]。"""
+    ranges = []
+    for index, (segment, reasons) in enumerate(zip(segments, flags)):
+        if not reasons:
+            continue
+        if ranges and ranges[-1][2][-1] == index - 1 and segment.start - ranges[-1][1] <= REDECODE_MERGE_GAP_SECONDS:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], segment.end), ranges[-1][2] + [index])
+        else:
+            ranges.append((segment.start, segment.end, [index]))
+    padded = []
+    for start, end, indices in ranges:
+        if end - start < REDECODE_MIN_RANGE_SECONDS:
+            middle = (start + end) / 2
+            start, end = max(0.0, middle - REDECODE_MIN_RANGE_SECONDS / 2), middle + REDECODE_MIN_RANGE_SECONDS / 2
+        padded.append((start, end, indices))
+    return padded
+
+def redecode_flagged(model, audio_path, segments, phrases, options, logger, audio_duration=None):
+    """
+    檢測 segments 中的幻覺與重複循環，只重新解碼被標記的時間範圍並清理結果，返回新的片段列表。
+    model: WhisperModel 或常駐模型服務的客戶端 (不使用批次推理管線，clip_timestamps 需要逐窗口解碼)；
+           None 時不重新解碼，只清理被標記的片段。
+    options: 原轉錄的 language / beam_size / initial_prompt / word_timestamps 等參數。
+    """
+    flags = [reasons for _, reasons in flag_segments(segments, phrases)]
+    flagged_count = sum(1 for reasons in flags if reasons)
+    if not flagged_count:
+        return segments
+    run_metrics.increment('hallucination.flagged_segments', flagged_count)
+    for reasons in flags:
+        for reason in reasons:
+            run_metrics.increment(f"hallucination.flag.{reason}")
+    ranges = flagged_ranges(segments, flags)
+    flagged_seconds = sum(end - start for start, end, _ in ranges)
+    logger.info(f"檢測到 {flagged_count} 個疑似幻覺或重複循環的片段 ({len(ranges)} 個範圍，共 {flagged_seconds:.1f} 秒)。")
+
+    replacements = {} # 範圍內第一個片段的索引 -> 重新解碼的片段
+    if model is not None and audio_duration and flagged_seconds > audio_duration * REDECODE_MAX_FRACTION:
+        logger.warning(f"被標記的時長超過音頻的 {REDECODE_MAX_FRACTION:.0%}，不重新解碼，只清理被標記的片段。")
+    elif model is not None:
+        clip_timestamps = [timestamp for start, end, _ in ranges for timestamp in (start, end)]
+        redecode_options = dict(options, vad_filter=False, clip_timestamps=clip_timestamps,
+                                condition_on_previous_text=False, temperature=list(REDECODE_TEMPERATURES),
+                                compression_ratio_threshold=COMPRESSION_RATIO_THRESHOLD,
+                                log_prob_threshold=LOGPROB_THRESHOLD, no_speech_threshold=NO_SPEECH_PROB_THRESHOLD)
+        try:
+            with run_metrics.stage('transcribe.redecode'):
+                segments_generator, _ = model.transcribe(audio_path, **redecode_options)
+                redecoded = list(segments_generator)
+            run_metrics.increment('hallucination.redecoded_seconds', flagged_seconds)
+            for start, end, indices in ranges:
+                replacements[indices[0]] = [segment for segment in redecoded if start <= (segment.start + segment.end) / 2 <= end]
+        except Exception as e:
+            logger.warning(f"重新解碼被標記的範圍時發生錯誤 ({e})，只清理被標記的片段。", exc_info=True)
+            replacements = {}
+
+    if replacements:
+        replaced_indices = {index for _, _, indices in ranges for index in indices}
+        rebuilt = []
+        for index, segment in enumerate(segments):
+            if index in replacements:
+                rebuilt.extend(replacements[index])
+            elif index not in replaced_indices:
+                rebuilt.append(segment)
+        segments = rebuilt
+        flags = [reasons for _, reasons in flag_segments(segments, phrases)]
+
+    cleaned = []
+    for segment, reasons in zip(segments, flags):
+        if reasons:
+            segment = clean_segment(segment, reasons, phrases)
+            if segment is None:
+                run_metrics.increment('hallucination.dropped_segments')
+                continue
+        cleaned.append(segment)
+    remaining = sum(1 for reasons in flags if reasons)
+    logger.info(f"幻覺過濾完成: {'重新解碼後' if replacements else ''}仍有 {remaining} 個片段被標記並已清理，"
+                f"共丟棄 {len(segments) - len(cleaned)} 個片段。")
+    return cleaned
@@ -0,0 +1,118 @@
+"""
+每個音頻檔案的轉錄任務設定 (語言、初始提示詞、beam_size、VAD 參數)。
+
+設定來源 (後者覆蓋前者)：
+    1. 程式默認值 (DEFAULT_JOB_SPEC，提示詞來自運行時輸入)
+    2. 輸入目錄中的清單檔案 jobs_manifest.json 的 "defaults"
+    3. 清單檔案 "files" 中以音頻檔名為鍵的條目
+    4. 與音頻同名的側檔案 [音頻檔名].job.json (例如 lecture01.mp3.job.json)
+
+清單檔案格式:
+    {
+        "defaults": {"language": "zh", "beam_size": 5},
+        "files": {"lecture01.mp3": {"initial_prompt": "這是關於觀無量壽經的講座"}}
+    }
+"""
+import os
+import json
+import time
+
+JOB_MANIFEST_FILENAME = "jobs_manifest.json"
+JOB_SIDECAR_SUFFIX = ".job.json"
+JOB_SPEC_KEYS = ('language', 'initial_prompt', 'beam_size', 'vad_parameters')
+LANGUAGE_DETECTION_SAMPLE_SECONDS = 30 # Whisper 語言檢測使用的音頻窗口長度
+
+DEFAULT_JOB_SPEC = {
+    'language': None, # 默認自動檢測；在清單或側檔案中指定語言 (例如 "zh") 即可跳過 Whisper 的語言檢測
+    'initial_prompt': None,
+    'beam_size': 5,
+    # VAD 參數來自原始腳本
+    'vad_parameters': {
+        "min_speech_duration_ms": 50,
+        "min_silence_duration_ms": 500,
+        "speech_pad_ms": 500,
+    },
+}
+
+
+def _read_json(path, logger):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return data
+        logger.warning(f"任務設定檔案 '{path}' 的內容不是 JSON 物件，將忽略。")
+    except json.JSONDecodeError as e:
+        logger.warning(f"解碼任務設定檔案 '{path}' 時發生錯誤: {e}。將忽略。")
+    except OSError as e:
+        logger.error(f"讀取任務設定檔案 '{path}' 時發生錯誤: {e}", exc_info=True)
+    return {}
+
+def _merge_spec(spec, overrides, source, logger):
+    for key, value in overrides.items():
+        if key not in JOB_SPEC_KEYS:
+            logger.warning(f"任務設定 '{source}' 中的未知欄位 '{key}' 將被忽略。")
+            continue
+        if key == 'vad_parameters' and isinstance(value, dict):
+            spec[key] = {**(spec.get(key) or {}), **value}
+        else:
+            spec[key] = value
+    return spec
+
+def load_job_manifest(input_dir, logger):
+    # 載入輸入目錄中的清單檔案；不存在時返回空清單
+    manifest_path = os.path.join(input_dir, JOB_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {'defaults': {}, 'files': {}}
+    manifest = _read_json(manifest_path, logger)
+    logger.info(f"已載入任務清單 '{manifest_path}' ({len(manifest.get('files') or {})} 個檔案條目)。")
+    return {'defaults': manifest.get('defaults') or {}, 'files': manifest.get('files') or {}}
+
+def resolve_job_spec(audio_file_name, input_dir, manifest, default_prompt, logger):
+    """合併各層設定，返回該音頻檔案的任務設定字典。"""
+    spec = json.loads(json.dumps(DEFAULT_JOB_SPEC)) # 深拷貝
+    spec['initial_prompt'] = default_prompt
+    _merge_spec(spec, manifest['defaults'], JOB_MANIFEST_FILENAME, logger)
+    _merge_spec(spec, manifest['files'].get(audio_file_name) or {}, f"{JOB_MANIFEST_FILENAME}:{audio_file_name}", logger)
+    sidecar_path = os.path.join(input_dir, audio_file_name + JOB_SIDECAR_SUFFIX)
+    if os.path.exists(sidecar_path):
+        _merge_spec(spec, _read_json(sidecar_path, logger), sidecar_path, logger)
+    return spec
+
+def job_spec_group_key(spec):
+    """設定完全相同的任務具有相同的分組鍵，用於將它們排在一起連續處理。"""
+    return json.dumps(spec, ensure_ascii=False, sort_keys=True)
+
+def group_files_by_spec(audio_file_names, input_dir, default_prompt, logger):
+    """
+    為每個檔案解析任務設定，並按設定分組排序。
+    返回 [(spec, [檔案名, ...]), ...]，組內保持原始順序。
+    """
+    manifest = load_job_manifest(input_dir, logger)
+    groups = {}
+    for audio_file_name in audio_file_names:
+        spec = resolve_job_spec(audio_file_name, input_dir, manifest, default_prompt, logger)
+        groups.setdefault(job_spec_group_key(spec), (spec, []))[1].append(audio_file_name)
+    return list(groups.values())
+
+def measure_language_detection_seconds(model, logger):
+    """
+    測量模型執行一次語言檢測的耗時 (一次 30 秒窗口的編碼器前向 + 一步解碼，與音頻內容無關)，
+    用於估計指定語言後每個檔案節省的時間。會在模型上額外執行兩次檢測，因此只在調用方選擇啟用時調用
+    (見 local_transcriber.LANGUAGE_DETECTION_CALIBRATION)。模型不支持 detect_language (如舊版或遠端模型) 時返回 None。
+    """
+    detect_language = getattr(model, 'detect_language', None)
+    if detect_language is None:
+        return None
+    try:
+        import numpy as np
+        silence = np.zeros(16000 * LANGUAGE_DETECTION_SAMPLE_SECONDS, dtype=np.float32)
+        detect_language(silence) # 預熱
+        started = time.perf_counter()
+        detect_language(silence)
+        elapsed = time.perf_counter() - started
+        logger.info(f"語言檢測耗時校準: 每次 {elapsed:.3f} 秒。")
+        return elapsed
+    except Exception as e:
+        logger.warning(f"語言檢測耗時校準失敗: {e}")
+        return None
@@ -1,10 +1,19 @@
 import os
 import datetime
-from faster_whisper import WhisperModel # 已修正導入
 import logging
 import json
 import time # Added time import
-# google.colab.drive 將在主函數中有條件地導入，用於掛載
+import threading
+from subtitle_alignment import collect_word_timings, save_word_timings, build_srt_content, WORD_TIMINGS_FILE_SUFFIX
+from subtitle_resegmenter import resegment_cues
+from job_specs import group_files_by_spec, measure_language_detection_seconds
+import run_metrics
+import runtime_env
+from drive_sync import DriveUploader, write_staged_marker
+from hallucination_filter import load_phrases, redecode_flagged
+from work_queue import open_work_queue, worker_temp_path
+# google.colab.drive 只在 Colab 運行環境中由 runtime_env 導入，用於掛載
+# faster_whisper 只在本進程需要載入模型時才導入 (使用常駐模型服務時無需導入)
 
 # --- 配置變數 ---
 MODEL_SIZE = "large-v3"
@@ -12,6 +21,25 @@ DEFAULT_INITIAL_PROMPT = "這是佛教關於密教真言宗藥師佛" # 初始
 INPUT_AUDIO_DIR = "/content/drive/MyDrive/input_audio"
 OUTPUT_TRANSCRIPTIONS_ROOT_DIR = "/content/drive/MyDrive/output_transcriptions" # 新子目錄的根目錄
 STATE_FILE_PATH = os.path.join(OUTPUT_TRANSCRIPTIONS_ROOT_DIR, ".processed_audio_files.json") # 狀態檔案路徑
+WORD_TIMESTAMPS = False # 啟用後保留逐詞時間軸並輸出 [文件名]_words.json 側檔案 (供校對後重新對齊 SRT)
+AUDIO_FILE_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.mp4')
+UNWANTED_PHRASE = "字幕由 Amara.org 社群提供" # 根據原始腳本，從轉錄文本中移除的幻覺字句
+DRIVE_MOUNT_POINT = '/content/drive'
+TRANSCRIPTION_SERVER_SOCKET = "/tmp/autosrt_transcription.sock" # 常駐模型服務 (transcription_server.py) 的 Unix socket
+DRIVE_SYNC_TIMEOUT_SECONDS = 10 # 掛載後等待輸入目錄可見的最長時間
+LOCAL_STAGING_DIR = "/content/autosrt_staging" # 輸出先寫入本地磁碟的暫存目錄，再由背景線程上傳到 OUTPUT_TRANSCRIPTIONS_ROOT_DIR
+ASYNC_DRIVE_UPLOAD = True # False 時直接同步寫入 Drive (舊行為)
+WORK_QUEUE_BACKEND = None # 多個運行環境分攤同一個 INPUT_AUDIO_DIR 時設為 "lease_files" (共享 Drive) 或 "sqlite" (同一台機器)；None 為單機處理全部檔案
+WORK_QUEUE_DIR = "/content/drive/MyDrive/autosrt_work_queue/transcriber" # 租約目錄，所有工作者必須指向同一位置
+BATCHED_INFERENCE = False # 使用 faster-whisper 的 BatchedInferencePipeline，將 VAD 語音區段分批並行解碼 (只適用於本進程加載的模型)
+BATCHED_INFERENCE_BATCH_SIZE = 16
+BATCHED_QUALITY_CHECK_SECONDS = 300 # 每個模型首次批次解碼前，以音頻前 N 秒比較批次與逐窗口解碼的輸出；0 表示不檢查
+BATCHED_MAX_CER = 0.05 # 字元錯誤率 (以逐窗口輸出為參考) 超過此值時停用批次模式，改回逐窗口解碼
+HALLUCINATION_FILTER = True # 檢測重複循環、壓縮比過高、低置信度、無語音段落中的文本及幻覺字句 (見 hallucination_filter.py)
+HALLUCINATION_REDECODE = True # 只以 clip_timestamps 重新解碼被標記的時間範圍；False 時只清理被標記的片段
+HALLUCINATION_PHRASES_FILE = os.path.join(INPUT_AUDIO_DIR, "hallucination_phrases.txt") # 自定義幻覺字句 (每行一個)，與默認字句合併
+LANGUAGE_DETECTION_CALIBRATION = False # 啟動時 (及常駐服務每日維護時) 校準一次語言檢測耗時，用於在日誌中報告指定語言節省的時間
+RESEGMENT_SUBTITLES = True # 轉錄後按字數、閱讀速度 (CPS) 與最短時長重新切分字幕 (參數見 subtitle_resegmenter.py)
 
 
 # --- 輔助函數 ---
@@ -32,7 +60,16 @@ def load_processed_files(state_file_path, logger): # logger 實例傳入，用
 
 def save_processed_files(state_file_path, processed_files_set, logger): # logger 實例傳入
     # 將已處理的檔案名稱集合儲存到狀態檔案
-    temp_state_file_path = state_file_path + ".tmp" # 使用臨時檔案以確保原子性寫入
+    # 啟用工作分攤 (WORK_QUEUE_BACKEND) 時此檔案只是參考：多個工作者的讀取-合併-寫入之間沒有鎖，
+    # 仍可能遺失其他工作者的記錄；是否已完成以工作佇列的完成記錄 (work_queue.is_done) 為準
+    with processed_files_lock: # 持鎖寫入，避免較舊的快照覆蓋較新的狀態
+        _save_processed_files(state_file_path, processed_files_set, logger)
+
+def _save_processed_files(state_file_path, processed_files_set, logger):
+    temp_state_file_path = worker_temp_path(state_file_path) # 使用臨時檔案以確保原子性寫入 (每個工作者/線程各自的臨時檔案)
+    if WORK_QUEUE_BACKEND and os.path.exists(state_file_path):
+        # 先合併其他工作者已寫入的記錄，盡量減少互相覆蓋
+        processed_files_set = processed_files_set | load_processed_files(state_file_path, logger)
     try:
         # 確保父目錄存在
         os.makedirs(os.path.dirname(state_file_path), exist_ok=True)
@@ -50,6 +87,45 @@ def save_processed_files(state_file_path, processed_files_set, logger): # logger
             except OSError as oe:
                 logger.error(f"移除臨時狀態檔案 '{temp_state_file_path}' 時發生錯誤: {oe}", exc_info=True)
 
+# 保護 processed_files 集合與狀態檔案寫入：背景上傳線程與主線程/守護進程共用同一個集合
+# (可重入，save_processed_files 在已持有鎖的調用方中也會再次獲取)
+processed_files_lock = threading.RLock()
+
+_output_uploader = None
+
+def get_output_uploader(logger):
+    """返回 (並在首次調用時啟動) 背景 Drive 上傳器；ASYNC_DRIVE_UPLOAD 關閉時返回 None。"""
+    global _output_uploader
+    if not ASYNC_DRIVE_UPLOAD:
+        return None
+    if _output_uploader is None:
+        _output_uploader = DriveUploader(logger, lambda processed_files: save_processed_files(STATE_FILE_PATH, processed_files, logger),
+                                         processed_files_lock)
+    return _output_uploader
+
+_work_queue = None
+
+def get_work_queue(logger):
+    """返回 (並在首次調用時打開) 工作分攤佇列；WORK_QUEUE_BACKEND 未設定時返回 None。"""
+    global _work_queue
+    if _work_queue is None and WORK_QUEUE_BACKEND:
+        _work_queue = open_work_queue(WORK_QUEUE_BACKEND, WORK_QUEUE_DIR, logger)
+    return _work_queue
+
+def close_work_queue():
+    """停止續期並釋放仍持有的租約。"""
+    global _work_queue
+    if _work_queue is not None:
+        _work_queue.close()
+        _work_queue = None
+
+def close_output_uploader():
+    """等待背景上傳完成並停止上傳線程。"""
+    global _output_uploader
+    if _output_uploader is not None:
+        _output_uploader.close()
+        _output_uploader = None
+
 def format_srt_time(seconds):
     """將秒數格式化為 SRT 格式的時間字串 (HH:MM:SS,ms)"""
     hours = int(seconds // 3600)
@@ -58,7 +134,7 @@ def format_srt_time(seconds):
     milliseconds = int((secs - int(secs)) * 1000)
     return f"{hours:02d}:{minutes:02d}:{int(secs):02d},{milliseconds:03d}"
 
-def main():
+def setup_logger():
     # --- 日誌配置 (使用具名 logger) ---
     logger = logging.getLogger('LocalTranscriberLogger')
     logger.setLevel(logging.INFO)
@@ -77,119 +153,236 @@ def main():
     # 將 handler 添加到 logger
     logger.addHandler(ch)
     logger.propagate = False # 阻止日誌消息傳播到 root logger
+    return logger
 
-    logger.info("local_transcriber.py 腳本已啟動。")
-
-    # --- 獲取用戶輸入的初始提示詞 ---
-    user_prompt_input = input(f"請輸入 Whisper 轉錄時使用的初始提示詞 (默認值: '{DEFAULT_INITIAL_PROMPT}'): ")
-    current_initial_prompt = user_prompt_input if user_prompt_input else DEFAULT_INITIAL_PROMPT
-    logger.info(f"將使用以下初始提示詞進行轉錄: '{current_initial_prompt}'")
-
-    # --- 載入狀態 ---
-    processed_files = load_processed_files(STATE_FILE_PATH, logger) # 傳入 logger
-    logger.info(f"從狀態檔案 '{STATE_FILE_PATH}' 載入了 {len(processed_files)} 個已處理檔案的記錄。")
-
-    # --- 掛載 Google Drive ---
+def mount_google_drive(logger):
+    """
+    (重新) 掛載 Google Drive。成功或運行環境無需掛載 (見 runtime_env.py) 時返回 True，掛載失敗返回 False。
+    """
     logger.info("嘗試掛載 Google Drive...")
     try:
-        from google.colab import drive
-
-        try:
-            logger.info("嘗試刷新並卸載 Google Drive (如果已掛載，最多等待20秒)...")
-            drive.flush_and_unmount(timeout_ms=20000)
-            logger.info("Google Drive 刷新並卸載操作完成。")
-        except Exception as e_unmount:
-            logger.warning(f"嘗試刷新並卸載 Drive 時發生錯誤（可能是因為 Drive 未曾掛載或卸載超時）: {e_unmount}")
-
-        logger.info("在嘗試掛載前，等待 5 秒...")
-        time.sleep(5)
-
-        drive.mount('/content/drive', force_remount=True)
+        if not runtime_env.get_environment(logger).mount_drive(DRIVE_MOUNT_POINT, logger, remount=True):
+            return True # 本地磁碟或服務帳戶環境，INPUT_AUDIO_DIR 需要是本地路徑
         logger.info("Google Drive 掛載成功。")
 
-        logger.info("等待 10 秒以確保 Google Drive 文件系統同步...")
-        time.sleep(10)
+        # 輪詢等待輸入目錄可見，而非固定等待
+        logger.info(f"等待 Google Drive 文件系統同步 (最多 {DRIVE_SYNC_TIMEOUT_SECONDS} 秒)...")
+        deadline = time.monotonic() + DRIVE_SYNC_TIMEOUT_SECONDS
+        while not os.path.exists(INPUT_AUDIO_DIR) and time.monotonic() < deadline:
+            run_metrics.sleep(0.5, 'drive_sync')
         logger.info("Drive 同步等待完成。")
-
-    except ImportError:
-        logger.warning("跳過 Drive 掛載，因為不在 Colab 環境或 google.colab 不可用。")
-        # 取決於 Drive 是否絕對必要，您可能需要在此處退出
-        # 對於沒有 Colab 的本地執行，INPUT_AUDIO_DIR 需要是本地路徑
     except Exception as e:
         logger.error(f"掛載 Google Drive 時發生錯誤: {e}", exc_info=True)
-        # 如果 Drive 至關重要且掛載失敗，則可能需要退出
-        return # 如果 Drive 掛載失敗且被認為是關鍵操作，則退出
+        return False
+    return True
 
-    # --- 加載 Faster Whisper 模型 ---
-    logger.info(f"正在加載 Faster Whisper 模型: {MODEL_SIZE}...")
+def load_local_whisper_model(logger, model_size=MODEL_SIZE):
+    # --- 在本進程中加載 Faster Whisper 模型 ---
+    logger.info(f"正在加載 Faster Whisper 模型: {model_size}...")
     try:
-        model = WhisperModel(MODEL_SIZE, device="cuda", compute_type="float16")
+        from faster_whisper import WhisperModel
+        model = WhisperModel(model_size, device="cuda", compute_type="float16")
         logger.info("Faster Whisper 模型加載成功。")
+        return model
     except Exception as e:
         logger.error(f"加載 Faster Whisper 模型時發生錯誤: {e}", exc_info=True)
         logger.error("此腳本需要支持 CUDA 的 GPU 和相應的庫。")
         logger.error("請確保已正確安裝 PyTorch 和支持 CUDA 的 CTranslate2。")
-        return
-
-    # --- 檢查輸入目錄 ---
-    if not os.path.exists(INPUT_AUDIO_DIR):
-        logger.error(f"輸入音頻目錄 '{INPUT_AUDIO_DIR}' 未找到。正在退出。")
-        return
-
-    logger.info(f"輸入音頻目錄: {INPUT_AUDIO_DIR}")
-    logger.info(f"輸出根目錄: {OUTPUT_TRANSCRIPTIONS_ROOT_DIR}")
-    logger.info(f"狀態檔案路徑: {STATE_FILE_PATH}")
-
-    # --- 遍歷音頻檔案 ---
-    audio_files_to_process = [f for f in os.listdir(INPUT_AUDIO_DIR) if f.lower().endswith(('.mp3', '.wav', '.flac', '.m4a', '.mp4'))]
-
-    if not audio_files_to_process:
-        logger.info(f"在 '{INPUT_AUDIO_DIR}' 中未找到任何音頻檔案。")
-        return
-
-    logger.info(f"找到 {len(audio_files_to_process)} 個音頻檔案待處理。")
-
-    unwanted_phrase = "字幕由 Amara.org 社群提供" # 根據原始腳本
-
-    for audio_file_name in audio_files_to_process:
-        # 使用 audio_file_name 作為已處理狀態的唯一標識符
-        if audio_file_name in processed_files:
-            logger.info(f"跳過 '{audio_file_name}'，因為它先前已被處理。")
-            continue
-
-        base_name = os.path.splitext(audio_file_name)[0]
-        audio_path = os.path.join(INPUT_AUDIO_DIR, audio_file_name)
-
-        logger.info(f"--- 正在處理檔案: {audio_path} ---")
-
-        # --- 轉錄 ---
+        return None
+
+def load_whisper_model(logger):
+    """
+    優先連接常駐模型服務 (免去每次運行載入 large-v3 的時間)；服務不可用時在本進程中加載模型。
+    兩者都提供相同的 model.transcribe(...) 介面。
+    """
+    from transcription_server import connect_remote_model
+    remote_model = connect_remote_model(TRANSCRIPTION_SERVER_SOCKET, MODEL_SIZE, logger)
+    if remote_model is not None:
+        return remote_model
+    return load_local_whisper_model(logger)
+
+_batched_state = {'model': None, 'pipeline': None, 'verified': False, 'disabled': False}
+
+def get_batched_pipeline(model, logger):
+    """返回包裝 model 的 BatchedInferencePipeline；批次模式未啟用、已被停用或模型不支持時返回 None。"""
+    if not BATCHED_INFERENCE or _batched_state['disabled']:
+        return None
+    if _batched_state['model'] is not model:
+        try:
+            from faster_whisper import BatchedInferencePipeline, WhisperModel
+        except ImportError:
+            logger.warning("當前的 faster-whisper 版本不提供 BatchedInferencePipeline，使用逐窗口解碼。")
+            _batched_state['disabled'] = True
+            return None
+        if not isinstance(model, WhisperModel):
+            logger.info("常駐模型服務的模型不支持批次推理，使用逐窗口解碼。")
+            _batched_state['disabled'] = True
+            return None
+        _batched_state.update(model=model, pipeline=BatchedInferencePipeline(model=model), verified=False)
+        logger.info(f"已啟用批次推理 (batch_size={BATCHED_INFERENCE_BATCH_SIZE})。")
+    return _batched_state['pipeline']
+
+def reset_batched_pipeline():
+    """丟棄批次推理的狀態 (包括品質檢查結果與停用標記)。"""
+    _batched_state.update(model=None, pipeline=None, verified=False, disabled=False)
+
+def verify_batched_quality(model, pipeline, audio_path, job_spec, logger):
+    """
+    以音頻前 BATCHED_QUALITY_CHECK_SECONDS 秒分別進行逐窗口與批次解碼，比較 CER / WER。
+    CER 超過 BATCHED_MAX_CER 時停用本進程的批次模式。返回是否可以使用批次模式。
+    """
+    from faster_whisper import decode_audio
+    from transcript_quality import compare_transcripts
+    options = dict(language=job_spec['language'], beam_size=job_spec['beam_size'], initial_prompt=job_spec['initial_prompt'],
+                   vad_filter=True, vad_parameters=job_spec['vad_parameters'])
+    with run_metrics.stage('batched_quality_check'):
+        sample = decode_audio(audio_path, sampling_rate=16000)[:BATCHED_QUALITY_CHECK_SECONDS * 16000]
+        sequential_segments, _ = model.transcribe(sample, **options)
+        sequential_text = "".join(segment.text for segment in sequential_segments)
+        batched_segments, _ = pipeline.transcribe(sample, batch_size=BATCHED_INFERENCE_BATCH_SIZE, **options)
+        batched_text = "".join(segment.text for segment in batched_segments)
+    result = compare_transcripts(sequential_text, batched_text)
+    _batched_state['verified'] = True
+    logger.info(f"批次推理品質檢查 (前 {BATCHED_QUALITY_CHECK_SECONDS} 秒，{result['reference_chars']} 字): "
+                f"CER {result['cer']:.2%}，WER {result['wer']:.2%} (以逐窗口解碼為參考)。")
+    if result['cer'] > BATCHED_MAX_CER:
+        logger.warning(f"批次推理的 CER ({result['cer']:.2%}) 超過上限 {BATCHED_MAX_CER:.2%}，本次運行改回逐窗口解碼。")
+        _batched_state['disabled'] = True
+        return False
+    return True
+
+def select_transcriber(model, audio_path, job_spec, logger):
+    """返回 (用於 transcribe 的物件, 額外參數)：批次模式可用時為 BatchedInferencePipeline 與 batch_size。"""
+    pipeline = get_batched_pipeline(model, logger)
+    if pipeline is None:
+        return model, {}
+    if BATCHED_QUALITY_CHECK_SECONDS > 0 and not _batched_state['verified']:
         try:
-            logger.info(f"開始轉錄檔案: {audio_file_name}...")
-            # VAD 參數來自原始腳本 (可以設為可配置)
-            vad_parameters = {
-                "min_speech_duration_ms": 50,
-                "min_silence_duration_ms": 500,
-                "speech_pad_ms": 500,
-            }
-            segments_generator, info = model.transcribe(
+            if not verify_batched_quality(model, pipeline, audio_path, job_spec, logger):
+                return model, {}
+        except Exception as e:
+            logger.warning(f"批次推理品質檢查失敗 ({e})，本次運行改回逐窗口解碼。", exc_info=True)
+            _batched_state['disabled'] = True
+            return model, {}
+    run_metrics.increment('transcribe.batched_files')
+    return pipeline, {'batch_size': BATCHED_INFERENCE_BATCH_SIZE}
+
+def is_audio_file(file_name):
+    return file_name.lower().endswith(AUDIO_FILE_EXTENSIONS)
+
+def record_recovered_upload(audio_file_name, uploaded, logger):
+    """DriveUploader.recover 的完成回調：啟用工作分攤時為已上傳的恢復項目寫入完成記錄。"""
+    work_queue = get_work_queue(logger)
+    if work_queue is None or not uploaded:
+        return
+    lease = work_queue.claim(audio_file_name)
+    if lease is not None:
+        work_queue.release(lease, done=True)
+
+def transcribe_audio_file(model, audio_file_name, job_spec, processed_files, logger, language_detection_seconds=None,
+                          hallucination_phrases=None):
+    """
+    按任務設定 (見 job_specs.py) 轉錄單個音頻檔案並寫出 _normal.txt / .srt (及可選的 _words.json)。
+    ASYNC_DRIVE_UPLOAD 開啟時輸出寫入 LOCAL_STAGING_DIR，並在背景上傳完成後才將檔案加入 processed_files 並保存狀態檔案；
+    否則直接寫入 Drive 並立即標記。返回轉錄與寫出是否成功。
+    language_detection_seconds: 已校準的單次語言檢測耗時，用於報告指定語言時節省的時間。
+    hallucination_phrases: 調用方預先以 load_phrases 載入的幻覺字句 (None 時在此載入)。
+    啟用工作分攤 (WORK_QUEUE_BACKEND) 時先認領該檔案的租約；已被其他工作者認領或完成時跳過並返回 False。
+    """
+    work_queue = get_work_queue(logger)
+    if work_queue is None:
+        return _transcribe_audio_file(model, audio_file_name, job_spec, processed_files, logger, language_detection_seconds,
+                                      hallucination_phrases)
+    lease = work_queue.claim(audio_file_name)
+    if lease is None:
+        if work_queue.is_done(audio_file_name):
+            with processed_files_lock:
+                processed_files.add(audio_file_name) # 其他工作者已完成，之後不再嘗試
+            logger.info(f"跳過 '{audio_file_name}'，它已由其他工作者處理完成。")
+        else:
+            logger.info(f"跳過 '{audio_file_name}'，它正由其他工作者處理。")
+        return False
+    logger.info(f"已認領 '{audio_file_name}' 的租約 (工作者 {work_queue.worker_id})。")
+    # 背景上傳時由上傳器在上傳完成後釋放租約並記錄完成；其餘情況在返回時釋放
+    try:
+        success = _transcribe_audio_file(model, audio_file_name, job_spec, processed_files, logger, language_detection_seconds,
+                                         hallucination_phrases, on_complete=lambda uploaded: work_queue.release(lease, done=uploaded))
+    except BaseException:
+        work_queue.release(lease)
+        raise
+    if not success:
+        work_queue.release(lease)
+    elif get_output_uploader(logger) is None:
+        work_queue.release(lease, done=True)
+    return success
+
+def _transcribe_audio_file(model, audio_file_name, job_spec, processed_files, logger, language_detection_seconds=None,
+                           hallucination_phrases=None, on_complete=None):
+    """transcribe_audio_file 的轉錄與寫出部分；on_complete(success) 傳給背景上傳器，在上傳完成後調用。"""
+    base_name = os.path.splitext(audio_file_name)[0]
+    audio_path = os.path.join(INPUT_AUDIO_DIR, audio_file_name)
+
+    logger.info(f"--- 正在處理檔案: {audio_path} ---")
+
+    # --- 轉錄 ---
+    try:
+        logger.info(f"開始轉錄檔案: {audio_file_name}...")
+        transcriber, batch_options = select_transcriber(model, audio_path, job_spec, logger)
+        started = time.perf_counter()
+        # faster-whisper 在 transcribe() 返回前完成音頻解碼與 VAD；推理在迭代生成器時進行
+        with run_metrics.stage('transcribe.decode_vad'):
+            segments_generator, info = transcriber.transcribe(
                 audio_path,
-                beam_size=5,
-                initial_prompt=current_initial_prompt, # 使用用戶定義或默認的提示詞
+                language=job_spec['language'], # 指定語言時跳過語言檢測
+                beam_size=job_spec['beam_size'],
+                initial_prompt=job_spec['initial_prompt'], # 使用任務設定、用戶定義或默認的提示詞
                 vad_filter=True,
-                vad_parameters=vad_parameters
+                vad_parameters=job_spec['vad_parameters'],
+                word_timestamps=WORD_TIMESTAMPS,
+                **batch_options
             )
+        with run_metrics.stage('transcribe.inference'):
             segments_list = list(segments_generator) # 使用生成器獲取列表
-            logger.info(f"檔案 '{audio_file_name}' 轉錄完成。語言: {info.language}，概率: {info.language_probability:.2f}")
-            logger.info(f"為 '{audio_file_name}'檢測到 {len(segments_list)} 個片段。")
-
-        except Exception as e:
-            logger.error(f"檔案 '{audio_file_name}' 轉錄過程中發生錯誤: {e}", exc_info=True)
-            continue # 跳到下一個檔案
+        elapsed = time.perf_counter() - started
+        logger.info(f"檔案 '{audio_file_name}' 轉錄完成。語言: {info.language}，概率: {info.language_probability:.2f}")
+        logger.info(f"為 '{audio_file_name}'檢測到 {len(segments_list)} 個片段。")
+        audio_duration = getattr(info, 'duration', None)
+        if audio_duration:
+            run_metrics.increment('audio_seconds', audio_duration)
+            logger.info(f"轉錄耗時 {elapsed:.1f} 秒，音頻時長 {audio_duration:.1f} 秒，實時率 (RTF) {elapsed / audio_duration:.3f}。")
+        if job_spec['language'] and language_detection_seconds:
+            logger.info(f"已指定語言 '{job_spec['language']}'，跳過語言檢測，估計節省 {language_detection_seconds:.2f} 秒 "
+                        f"(佔本檔轉錄時間 {language_detection_seconds / (elapsed + language_detection_seconds):.1%})。")
+        elif job_spec['language']:
+            logger.info(f"已指定語言 '{job_spec['language']}'，跳過語言檢測。")
+
+        if HALLUCINATION_FILTER:
+            with run_metrics.stage('hallucination_filter'):
+                segments_list = redecode_flagged(
+                    model if HALLUCINATION_REDECODE else None, audio_path, segments_list,
+                    hallucination_phrases if hallucination_phrases is not None else load_phrases(HALLUCINATION_PHRASES_FILE, logger),
+                    # 以本次檢測 (或指定) 的語言重新解碼，避免自動檢測語言時被標記範圍再次被誤判為其他語言
+                    dict(language=info.language, beam_size=job_spec['beam_size'],
+                         initial_prompt=job_spec['initial_prompt'], word_timestamps=WORD_TIMESTAMPS),
+                    logger, audio_duration)
 
+    except Exception as e:
+        logger.error(f"檔案 '{audio_file_name}' 轉錄過程中發生錯誤: {e}", exc_info=True)
+        return False # 由調用方繼續處理下一個檔案
+
+    srt_build_started = time.perf_counter()
+    if RESEGMENT_SUBTITLES:
+        # --- 重新切分字幕，"一般文本" 與 SRT 的行保持一一對應 ---
+        cues, word_timings = resegment_cues(segments_list, UNWANTED_PHRASE)
+        logger.info(f"已將 {len(segments_list)} 個片段重新切分為 {len(cues)} 條字幕。")
+        normal_text_content = "\n".join(text for _, _, text in cues)
+        srt_content = build_srt_content(cues)
+    else:
+        word_timings = None
         # --- 生成 "一般文本" ---
         whisper_transcription_lines = []
         for segment in segments_list:
-            cleaned_text = segment.text.strip().replace(unwanted_phrase, "").strip()
+            cleaned_text = segment.text.strip().replace(UNWANTED_PHRASE, "").strip()
             if cleaned_text: # 清理後有實際文本才添加
                 whisper_transcription_lines.append(cleaned_text)
 
@@ -201,50 +394,159 @@ def main():
         for segment in segments_list:
             start_time_srt = format_srt_time(segment.start)
             end_time_srt = format_srt_time(segment.end)
-            cleaned_segment_text = segment.text.strip().replace(unwanted_phrase, "").strip()
+            cleaned_segment_text = segment.text.strip().replace(UNWANTED_PHRASE, "").strip()
 
             if cleaned_segment_text: # SRT 中僅包含有實際文本的片段
                 srt_content += f"{srt_sequence_number}\n"
                 srt_content += f"{start_time_srt} --> {end_time_srt}\n"
                 srt_content += f"{cleaned_segment_text}\n\n"
                 srt_sequence_number += 1
+    run_metrics.observe('srt_build', time.perf_counter() - srt_build_started)
 
+    # --- 輸出到檔案 ---
+    uploader = get_output_uploader(logger)
+    output_root = LOCAL_STAGING_DIR if uploader is not None else OUTPUT_TRANSCRIPTIONS_ROOT_DIR
+    write_stage = 'staging_write' if uploader is not None else 'drive_write'
+    output_dir_for_file = os.path.join(output_root, base_name)
+    try:
+        os.makedirs(output_dir_for_file, exist_ok=True)
+    except OSError as e:
+        logger.error(f"創建輸出目錄 {output_dir_for_file} 時發生錯誤: {e}", exc_info=True)
+        return False # 如果目錄創建失敗，不標記為已處理
 
-        # --- 輸出到檔案 ---
-        output_dir_for_file = os.path.join(OUTPUT_TRANSCRIPTIONS_ROOT_DIR, base_name)
-        try:
-            os.makedirs(output_dir_for_file, exist_ok=True)
-        except OSError as e:
-            logger.error(f"創建輸出目錄 {output_dir_for_file} 時發生錯誤: {e}", exc_info=True)
-            continue # 如果目錄創建失敗，跳到下一個檔案
-
-        normal_text_filename = f"{base_name}_normal.txt"
-        normal_text_path = os.path.join(output_dir_for_file, normal_text_filename)
+    normal_text_filename = f"{base_name}_normal.txt"
+    normal_text_path = os.path.join(output_dir_for_file, normal_text_filename)
 
-        srt_filename = f"{base_name}.srt"
-        srt_path = os.path.join(output_dir_for_file, srt_filename)
+    srt_filename = f"{base_name}.srt"
+    srt_path = os.path.join(output_dir_for_file, srt_filename)
 
-        try:
-            with open(normal_text_path, "w", encoding="utf-8") as f:
-                f.write(normal_text_content)
-            logger.info(f"一般文本已成功寫入: {normal_text_path}")
-        except IOError as e:
-            logger.error(f"寫入一般文本至 {normal_text_path} 時發生錯誤: {e}", exc_info=True)
+    try:
+        with run_metrics.stage(write_stage), open(normal_text_path, "w", encoding="utf-8") as f:
+            f.write(normal_text_content)
+        logger.info(f"一般文本已成功寫入: {normal_text_path}")
+    except IOError as e:
+        logger.error(f"寫入一般文本至 {normal_text_path} 時發生錯誤: {e}", exc_info=True)
 
+    try:
+        with run_metrics.stage(write_stage), open(srt_path, "w", encoding="utf-8") as f:
+            f.write(srt_content)
+        logger.info(f"SRT 字幕已成功寫入: {srt_path}")
+    except IOError as e:
+        logger.error(f"寫入 SRT 字幕至 {srt_path} 時發生錯誤: {e}", exc_info=True)
+        return False # 如果檔案寫入失敗，則不標記為已處理
+
+    if WORD_TIMESTAMPS:
+        words_path = os.path.join(output_dir_for_file, f"{base_name}{WORD_TIMINGS_FILE_SUFFIX}")
+        if word_timings is None:
+            word_timings = collect_word_timings(segments_list, UNWANTED_PHRASE)
+        with run_metrics.stage(write_stage):
+            words_saved = save_word_timings(words_path, word_timings, logger)
+        if not words_saved:
+            return False # 逐詞時間軸為啟用時的必要輸出，寫入失敗則不標記為已處理
+
+    run_metrics.increment('files_transcribed')
+    if uploader is not None:
+        # 暫存完成；由背景上傳器複製到 Drive 後再標記為已處理
         try:
-            with open(srt_path, "w", encoding="utf-8") as f:
-                f.write(srt_content)
-            logger.info(f"SRT 字幕已成功寫入: {srt_path}")
-        except IOError as e:
-            logger.error(f"寫入 SRT 字幕至 {srt_path} 時發生錯誤: {e}", exc_info=True)
-            continue # 如果檔案寫入失敗，則不標記為已處理
-
-        # 如果此檔案的所有輸出都已成功保存，則標記為已處理
+            write_staged_marker(output_dir_for_file, audio_file_name)
+        except OSError as e:
+            logger.error(f"寫入暫存標記至 {output_dir_for_file} 時發生錯誤: {e}", exc_info=True)
+            return False
+        uploader.submit(audio_file_name, output_dir_for_file, os.path.join(OUTPUT_TRANSCRIPTIONS_ROOT_DIR, base_name), processed_files,
+                        on_complete)
+        return True
+
+    # 如果此檔案的所有輸出都已成功保存，則標記為已處理
+    with processed_files_lock, run_metrics.stage('drive_write'):
         processed_files.add(audio_file_name)
         save_processed_files(STATE_FILE_PATH, processed_files, logger) # 傳入 logger
-        logger.info(f"已將 '{audio_file_name}' 標記為已處理並更新狀態檔案。")
+    logger.info(f"已將 '{audio_file_name}' 標記為已處理並更新狀態檔案。")
+    return True
+
+def run_transcription(logger):
+    # --- 獲取用戶輸入的初始提示詞 ---
+    user_prompt_input = input(f"請輸入 Whisper 轉錄時使用的初始提示詞 (默認值: '{DEFAULT_INITIAL_PROMPT}'): ")
+    current_initial_prompt = user_prompt_input if user_prompt_input else DEFAULT_INITIAL_PROMPT
+    logger.info(f"將使用以下初始提示詞進行轉錄: '{current_initial_prompt}'")
+
+    # --- 載入狀態 ---
+    processed_files = load_processed_files(STATE_FILE_PATH, logger) # 傳入 logger
+    logger.info(f"從狀態檔案 '{STATE_FILE_PATH}' 載入了 {len(processed_files)} 個已處理檔案的記錄。")
+
+    # --- 掛載 Google Drive ---
+    with run_metrics.stage('drive_mount'):
+        drive_mounted = mount_google_drive(logger)
+    if not drive_mounted:
+        return # 如果 Drive 掛載失敗且被認為是關鍵操作，則退出
+
+    uploader = get_output_uploader(logger)
+    if uploader is not None:
+        uploader.recover(LOCAL_STAGING_DIR, OUTPUT_TRANSCRIPTIONS_ROOT_DIR, processed_files,
+                         lambda audio_file_name, uploaded: record_recovered_upload(audio_file_name, uploaded, logger))
+
+    with run_metrics.stage('model_load'):
+        model = load_whisper_model(logger)
+    if model is None:
+        return
+
+    # --- 檢查輸入目錄 ---
+    if not os.path.exists(INPUT_AUDIO_DIR):
+        logger.error(f"輸入音頻目錄 '{INPUT_AUDIO_DIR}' 未找到。正在退出。")
+        return
+
+    logger.info(f"輸入音頻目錄: {INPUT_AUDIO_DIR}")
+    logger.info(f"輸出根目錄: {OUTPUT_TRANSCRIPTIONS_ROOT_DIR}")
+    logger.info(f"狀態檔案路徑: {STATE_FILE_PATH}")
+
+    # --- 遍歷音頻檔案 ---
+    # 單次 scandir 掃描；entry.is_file() 使用目錄項中的類型 (d_type)，這裡只需要檔案名，不對每個檔案調用 stat()
+    with run_metrics.stage('input_scan'):
+        with os.scandir(INPUT_AUDIO_DIR) as entries:
+            audio_files_to_process = [entry.name for entry in entries if is_audio_file(entry.name) and entry.is_file()]
+
+    if not audio_files_to_process:
+        logger.info(f"在 '{INPUT_AUDIO_DIR}' 中未找到任何音頻檔案。")
+        return
+
+    logger.info(f"找到 {len(audio_files_to_process)} 個音頻檔案待處理。")
+
+    # --- 按任務設定分組，設定相同的檔案連續處理 ---
+    pending_files = []
+    for audio_file_name in audio_files_to_process:
+        # 使用 audio_file_name 作為已處理狀態的唯一標識符
+        if audio_file_name in processed_files:
+            logger.info(f"跳過 '{audio_file_name}'，因為它先前已被處理。")
+            continue
+        if uploader is not None and uploader.is_pending(audio_file_name):
+            logger.info(f"跳過 '{audio_file_name}'，它的暫存輸出正在上傳。")
+            continue
+        pending_files.append(audio_file_name)
+
+    spec_groups = group_files_by_spec(pending_files, INPUT_AUDIO_DIR, current_initial_prompt, logger)
+    language_detection_seconds = None
+    if LANGUAGE_DETECTION_CALIBRATION and any(spec['language'] for spec, _ in spec_groups):
+        language_detection_seconds = measure_language_detection_seconds(model, logger)
+    hallucination_phrases = load_phrases(HALLUCINATION_PHRASES_FILE, logger) if HALLUCINATION_FILTER else None
+
+    for group_index, (job_spec, group_files) in enumerate(spec_groups, start=1):
+        logger.info(f"任務設定組 {group_index}/{len(spec_groups)} ({len(group_files)} 個檔案): 語言={job_spec['language'] or '自動檢測'}，"
+                    f"beam_size={job_spec['beam_size']}，提示詞='{job_spec['initial_prompt']}'")
+        for audio_file_name in group_files:
+            transcribe_audio_file(model, audio_file_name, job_spec, processed_files, logger, language_detection_seconds,
+                                  hallucination_phrases)
 
     logger.info("所有音頻檔案處理完畢。")
+
+def main():
+    logger = setup_logger()
+    logger.info("local_transcriber.py 腳本已啟動。")
+    run_metrics.reset()
+    try:
+        run_transcription(logger)
+    finally:
+        close_output_uploader() # 等待暫存輸出全部上傳並標記後才退出
+        close_work_queue()
+        run_metrics.export('local_transcriber', logger)
     logger.info("local_transcriber.py 腳本已完成。")
 
 if __name__ == "__main__":
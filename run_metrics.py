@@ -0,0 +1,158 @@
+"""
+輕量的運行指標：分階段計時器 (context manager) 與計數器，運行結束時匯出 JSON 摘要與
+Prometheus textfile (供 node_exporter 的 textfile collector 讀取)。
+
+用法:
+    import run_metrics
+    with run_metrics.stage('transcribe.inference'):
+        ...
+    run_metrics.increment('audio_seconds', info.duration)
+    run_metrics.export('local_transcriber', logger)
+
+熱路徑上的開銷只有兩次 perf_counter() 調用與一次加鎖的字典更新。
+"""
+import os
+import glob
+import json
+import time
+import threading
+
+METRICS_DIR = os.environ.get('AUTOSRT_METRICS_DIR', "/content/autosrt_metrics") # 指標輸出目錄 (本地磁碟)
+
+_lock = threading.Lock()
+_timers = {} # 名稱 -> [次數, 總秒數, 最大秒數]
+_counters = {} # 名稱 -> 數值
+_run_started_at = time.time()
+
+
+def reset():
+    """清空所有指標 (新一次運行開始時調用)。"""
+    global _run_started_at
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _run_started_at = time.time()
+
+def observe(name, seconds):
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class stage:
+    """計時一個階段：with run_metrics.stage('名稱'): ...；異常時同樣記錄耗時。"""
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def sleep(seconds, reason):
+    """刻意的等待 (速率限制、批次間延遲等)；記錄為 'sleep.<reason>' 階段以便與實際工作區分。"""
+    with stage(f"sleep.{reason}"):
+        time.sleep(seconds)
+
+
+def _timer_total(prefix):
+    return sum(timer[1] for name, timer in _timers.items() if name == prefix or name.startswith(prefix + "."))
+
+def snapshot():
+    """返回當前所有指標及衍生指標 (實時率、每項目 token 數、刻意等待總時間)。"""
+    with _lock:
+        timers = {name: {'count': t[0], 'total_seconds': round(t[1], 6), 'max_seconds': round(t[2], 6)} for name, t in _timers.items()}
+        counters = dict(_counters)
+        derived = {}
+        audio_seconds = counters.get('audio_seconds')
+        transcribe_seconds = _timer_total('transcribe')
+        if audio_seconds and transcribe_seconds:
+            derived['real_time_factor'] = round(transcribe_seconds / audio_seconds, 6)
+        items = counters.get('gemini.items')
+        tokens = counters.get('gemini.prompt_tokens', 0) + counters.get('gemini.output_tokens', 0)
+        if items and tokens:
+            derived['gemini_tokens_per_item'] = round(tokens / items, 1)
+        derived['sleep_seconds'] = round(_timer_total('sleep'), 3)
+    return {
+        'run_started_at': _run_started_at,
+        'run_seconds': round(time.time() - _run_started_at, 3),
+        'timers': timers,
+        'counters': counters,
+        'derived': derived,
+    }
+
+def _prometheus_name(name):
+    return "autosrt_" + "".join(char if char.isalnum() else "_" for char in name)
+
+def format_prometheus(script_name, data):
+    lines = []
+    label = f'{{script="{script_name}"}}'
+    for name, timer in sorted(data['timers'].items()):
+        metric = _prometheus_name(name)
+        lines.append(f"{metric}_seconds_total{label} {timer['total_seconds']}")
+        lines.append(f"{metric}_count{label} {timer['count']}")
+        lines.append(f"{metric}_seconds_max{label} {timer['max_seconds']}")
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f"{_prometheus_name(name)}{label} {value}")
+    for name, value in sorted(data['derived'].items()):
+        lines.append(f"{_prometheus_name(name)}{label} {value}")
+    lines.append(f"autosrt_run_seconds{label} {data['run_seconds']}")
+    return "\n".join(lines) + "\n"
+
+def export(script_name, logger=None, metrics_dir=None):
+    """
+    將指標寫入 metrics_dir：
+        [script_name]_[時間戳].json — 本次運行 (自上次 reset() 起) 的完整摘要，時間戳為 reset() 的時間
+        [script_name].prom          — Prometheus textfile (每次覆蓋)
+    返回 JSON 檔案路徑；寫入失敗時只記錄錯誤，不影響主流程。
+    """
+    metrics_dir = metrics_dir or METRICS_DIR
+    data = snapshot()
+    timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(data['run_started_at']))
+    json_path = os.path.join(metrics_dir, f"{script_name}_{timestamp}.json")
+    prom_path = os.path.join(metrics_dir, f"{script_name}.prom")
+    try:
+        os.makedirs(metrics_dir, exist_ok=True)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'script': script_name, **data}, f, ensure_ascii=False, indent=2)
+        with open(prom_path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(format_prometheus(script_name, data))
+        os.replace(prom_path + ".tmp", prom_path) # 原子替換，避免 collector 讀到半個檔案
+    except OSError as e:
+        if logger:
+            logger.error(f"寫入運行指標至 '{metrics_dir}' 時發生錯誤: {e}")
+        else:
+            print(f"寫入運行指標至 '{metrics_dir}' 時發生錯誤: {e}")
+        return None
+    if logger:
+        logger.info(f"運行指標已寫入: {json_path} (實時率: {data['derived'].get('real_time_factor', '-')}，刻意等待: {data['derived']['sleep_seconds']} 秒)")
+    else:
+        print(f"運行指標已寫入: {json_path}")
+    return json_path
+
+def load_latest(script_name, metrics_dir=None):
+    """讀取指定腳本最近一次運行的 JSON 摘要 (用於以實測吞吐量做預估)；沒有記錄時返回 None。"""
+    paths = sorted(glob.glob(os.path.join(metrics_dir or METRICS_DIR, f"{glob.escape(script_name)}_*.json")))
+    for path in reversed(paths):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            continue
+    return None
@@ -0,0 +1,154 @@
+"""
+運行環境提供者：將身份驗證、Drive 掛載、密鑰讀取、HTML 顯示與檔案上傳從各腳本中抽離，
+使腳本可在 Colab 之外 (服務帳戶或本地磁碟) 啟動，且相關的重量級依賴只在實際需要時才導入。
+
+環境選擇 (環境變數 AUTOSRT_ENVIRONMENT 可強制指定):
+    colab            — google.colab 可用時的默認值：Colab 互動式驗證、drive.mount、Colab Secrets
+    service_account  — 設定了 GOOGLE_APPLICATION_CREDENTIALS 時的默認值：以服務帳戶 JSON 授權 gspread
+    local            — 其他情況：使用應用默認憑證 (gcloud auth application-default login)；
+                       Drive 路徑視為本地目錄 (例如 Google Drive 桌面版的同步資料夾)，不進行掛載
+
+非 Colab 環境中，密鑰 (如 GEMINI_API_KEY) 從同名環境變數讀取。
+"""
+import os
+import sys
+import importlib.util
+
+ENVIRONMENT_VARIABLE = "AUTOSRT_ENVIRONMENT"
+SERVICE_ACCOUNT_FILE_VARIABLE = "GOOGLE_APPLICATION_CREDENTIALS"
+GOOGLE_API_SCOPES = (
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+)
+
+_environment = None
+
+
+class LocalEnvironment:
+    """本地磁碟：不掛載 Drive，使用應用默認憑證，密鑰來自環境變數。"""
+    name = 'local'
+    supports_upload = False
+
+    def authorize_gspread(self, logger):
+        import gspread
+        from google.auth import default
+        creds, _ = default(scopes=list(GOOGLE_API_SCOPES))
+        return gspread.authorize(creds)
+
+    def mount_drive(self, mount_point, logger, remount=False):
+        """掛載 Drive；返回是否實際進行了掛載 (本地環境不掛載)。失敗時引發異常。"""
+        logger.info(f"運行環境為 '{self.name}'，跳過 Drive 掛載；'{mount_point}' 將作為本地目錄使用。")
+        return False
+
+    def get_secret(self, name):
+        return os.environ.get(name)
+
+    def display_html(self, html):
+        pass # 非 Notebook 環境沒有可顯示 HTML 的前端，相關信息已寫入日誌
+
+    def upload_files(self):
+        """互動式上傳檔案，返回 {檔案名: 內容}；環境不支持時返回 None。"""
+        return None
+
+
+class ServiceAccountEnvironment(LocalEnvironment):
+    """服務帳戶：以 JSON 金鑰授權 gspread (需將試算表或 Drive 資料夾共享給該服務帳戶)。"""
+    name = 'service_account'
+
+    def __init__(self, credentials_path):
+        self.credentials_path = credentials_path
+
+    def authorize_gspread(self, logger):
+        import gspread
+        logger.info(f"使用服務帳戶憑證 '{self.credentials_path}' 授權 Google Sheets。")
+        return gspread.service_account(filename=self.credentials_path, scopes=list(GOOGLE_API_SCOPES))
+
+
+class ColabEnvironment(LocalEnvironment):
+    """Google Colab：互動式驗證、drive.mount、Colab Secrets (找不到時退回環境變數)。"""
+    name = 'colab'
+    supports_upload = True
+
+    def authorize_gspread(self, logger):
+        import gspread
+        from google.colab import auth
+        from google.auth import default
+        auth.authenticate_user()
+        creds, _ = default()
+        return gspread.authorize(creds)
+
+    def mount_drive(self, mount_point, logger, remount=False):
+        from google.colab import drive
+        if remount:
+            import run_metrics
+            try:
+                logger.info("嘗試刷新並卸載 Google Drive (如果已掛載，最多等待20秒)...")
+                drive.flush_and_unmount(timeout_ms=20000)
+                logger.info("Google Drive 刷新並卸載操作完成。")
+            except Exception as e_unmount:
+                logger.warning(f"嘗試刷新並卸載 Drive 時發生錯誤（可能是因為 Drive 未曾掛載或卸載超時）: {e_unmount}")
+            logger.info("在嘗試掛載前，等待 5 秒...")
+            run_metrics.sleep(5, 'drive_remount')
+        drive.mount(mount_point, force_remount=True)
+        return True
+
+    def get_secret(self, name):
+        from google.colab import userdata
+        try:
+            value = userdata.get(name)
+        except Exception: # 未設定的 Colab Secret 會引發 SecretNotFoundError
+            value = None
+        return value or os.environ.get(name)
+
+    def display_html(self, html):
+        from IPython.display import HTML, display
+        display(HTML(html))
+
+    def upload_files(self):
+        from google.colab import files
+        return files.upload()
+
+
+def _colab_available():
+    if 'google.colab' in sys.modules:
+        return True
+    try:
+        return importlib.util.find_spec('google.colab') is not None
+    except (ImportError, ValueError):
+        return False
+
+def detect_environment_name():
+    configured = os.environ.get(ENVIRONMENT_VARIABLE, "").strip().lower()
+    if configured:
+        return configured
+    if _colab_available():
+        return 'colab'
+    if os.environ.get(SERVICE_ACCOUNT_FILE_VARIABLE):
+        return 'service_account'
+    return 'local'
+
+def create_environment(name):
+    if name == 'colab':
+        return ColabEnvironment()
+    if name == 'service_account':
+        credentials_path = os.environ.get(SERVICE_ACCOUNT_FILE_VARIABLE)
+        if not credentials_path:
+            raise ValueError(f"服務帳戶環境需要設定環境變數 {SERVICE_ACCOUNT_FILE_VARIABLE} (服務帳戶 JSON 金鑰路徑)")
+        return ServiceAccountEnvironment(credentials_path)
+    if name == 'local':
+        return LocalEnvironment()
+    raise ValueError(f"未知的運行環境 '{name}' (可選: colab、service_account、local)")
+
+def get_environment(logger=None):
+    """返回當前進程的運行環境 (首次調用時檢測並緩存)。"""
+    global _environment
+    if _environment is None:
+        _environment = create_environment(detect_environment_name())
+        if logger:
+            logger.info(f"運行環境: {_environment.name}")
+    return _environment
+
+def set_environment(environment):
+    """替換當前運行環境 (傳入 None 則在下次調用 get_environment 時重新檢測)。"""
+    global _environment
+    _environment = environment
@@ -1,19 +1,25 @@
 import os
-from google.colab import drive, auth, userdata
-import google.generativeai as genai # Added for Gemini SDK
 import datetime # 保留，用於 PDF 日期邏輯 (如果有的話) 或通用工具
-import gspread
-from google.auth import default
 import logging # 為日誌記錄添加
 import textwrap
-import pypdf
-import requests # Kept for now, though direct Gemini calls via requests are replaced
 import json
 import time
 import re # 為 SRT 解析添加
+import difflib # 級聯模式中計算初稿改動比例；增量模式中比較新舊文本
+import hashlib # 增量模式中判斷 SRT 是否變更；工作分攤中標識輸入版本
 import glob # 用於 PDF 清理
-from IPython.display import HTML # <-- 修正：導入 HTML
 import warnings # 導入 warnings 模듈
+import run_metrics
+import runtime_env
+from drive_manifest import DirectoryManifest, read_text_file, prefetch
+from gemini_pool import get_pool, estimate_tokens, GeminiPoolExhausted, GEMINI_API_KEY_SECRETS
+from work_queue import open_work_queue, worker_temp_path
+# 重量級依賴 (gspread、google.generativeai、pypdf) 在需要它們的函數內導入；
+# Colab 專用功能 (驗證、Drive 掛載、Secrets、HTML 顯示、檔案上傳) 經由 runtime_env 提供
+from subtitle_alignment import (
+    load_word_timings, word_timings_from_srt_segments, align_corrected_lines, build_srt_content,
+    WORD_TIMINGS_FILE_SUFFIX, CORRECTED_SRT_FILE_SUFFIX,
+)
 
 # 抑制 gspread 的 DeprecationWarning
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -24,6 +30,28 @@ pdf_handout_dir = "/content/drive/MyDrive/lecture_handouts" # 保留，用於 Ge
 GEMINI_STATE_FILE_PATH = os.path.join(TRANSCRIPTIONS_ROOT_INPUT_DIR, ".gemini_processed_state.json") # Gemini 處理狀態檔案路徑
 INTER_SPREADSHEET_DELAY_SECONDS = 15 # 秒，處理不同表格間的延遲
 GEMINI_API_BATCH_MAX_LINES = 100  # 每批次發送給 Gemini API 的最大行數 (Pro模型無上下文測試值)
+GEMINI_INTER_BATCH_DELAY_SECONDS = 0 # 同一項目相鄰批次之間的額外等待秒數 (速率由 gemini_pool 的每端點限制器控制)
+GEMINI_CASCADE_ENABLED = False # 級聯模式：先由快速的低成本模型校對，只將改動較大或被標記為不確定的行升級至 Pro 模型
+GEMINI_CASCADE_DRAFT_MODELS = ("gemini-1.5-flash-latest",) # 初稿模型 (Pro 模型見 gemini_pool.GEMINI_POOL_MODELS)
+GEMINI_CASCADE_ESCALATION_THRESHOLD = 0.3 # 初稿對某行的改動比例 (0~1，基於 difflib 相似度) 超過此值時升級
+GEMINI_CASCADE_UNCERTAIN_MARKER = "[?]" # 要求初稿模型在沒有把握的行首加上的標記
+GEMINI_CASCADE_DRAFT_REQUESTS_PER_MINUTE = 15 # 初稿模型每個端點的速率限制 (Gemini 1.5 Flash 免費層)
+GEMINI_CASCADE_DRAFT_TOKENS_PER_MINUTE = 1000000
+GEMINI_INCREMENTAL_ENABLED = True # 增量模式：已校對項目的 Whisper 文本變更時，只重新校對改動的區域並只改寫有變化的行
+GEMINI_INCREMENTAL_CONTEXT_LINES = 2 # 每個改動區域前後一併重新校對的上下文行數
+GEMINI_SNAPSHOT_FILE_SUFFIX = "_gemini_snapshot.json" # 上次校對時的 Whisper 文本與校對結果 (與 _normal.txt 同目錄)
+GEMINI_SNAPSHOT_FORMAT_VERSION = 1
+GEMINI_CONTINUATION_MAX_ROUNDS = 3 # 響應被截斷時，為同一批次剩餘行發送續寫請求的最大次數
+GEMINI_FINISH_REASON_MAX_TOKENS = 2 # finish_reason: 達到 max_output_tokens
+WORK_QUEUE_BACKEND = None # 多個運行環境分攤校對工作時設為 "lease_files" (共享 Drive) 或 "sqlite" (同一台機器)；None 為單機處理全部項目
+WORK_QUEUE_DIR = "/content/drive/MyDrive/autosrt_work_queue/gemini" # 租約目錄 (不可位於 TRANSCRIPTIONS_ROOT_INPUT_DIR 內，否則會被當作項目)
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "text/plain"
+}
 
 # --- 默認 Gemini API 提示詞常量 ---
 DEFAULT_GEMINI_MAIN_INSTRUCTION = (
@@ -50,16 +78,20 @@ def execute_gspread_write(logger, gspread_operation_func, *args, max_retries=5,
     gspread_operation_func: 要調用的 gspread 方法 (例如 worksheet.clear, worksheet.update)。
     *args, **kwargs: 傳遞給 gspread_operation_func 的參數。
     """
+    import gspread
     for attempt in range(max_retries):
         try:
-            return gspread_operation_func(*args, **kwargs) # 執行操作
+            run_metrics.increment('sheets.calls')
+            with run_metrics.stage('sheets.call'):
+                return gspread_operation_func(*args, **kwargs) # 執行操作
         except gspread.exceptions.APIError as e:
             # 檢查錯誤響應和狀態碼是否存在
             if hasattr(e, 'response') and hasattr(e.response, 'status_code') and e.response.status_code == 429: # HTTP 429: Too Many Requests (請求過多)
+                run_metrics.increment('sheets.429')
                 if attempt < max_retries - 1:
                     delay = base_delay_seconds * (2 ** attempt)
                     logger.warning(f"Google Sheets API 速率限制 (429)。將在 {delay} 秒後重試... (嘗試 {attempt + 1}/{max_retries}) 操作: {gspread_operation_func.__name__}")
-                    time.sleep(delay)
+                    run_metrics.sleep(delay, 'sheets_backoff')
                 else:
                     logger.error(f"Google Sheets API 達到最大重試次數 (429) 操作: {gspread_operation_func.__name__}。錯誤: {e}", exc_info=True)
                     raise # 如果達到最大重試次數，則重新引發異常
@@ -88,6 +120,7 @@ def extract_text_from_pdf_dir(logger, pdf_dir):
     for pdf_file_name in pdf_files:
         pdf_path = os.path.join(pdf_dir, pdf_file_name)
         try:
+            import pypdf
             with open(pdf_path, 'rb') as file:
                 reader = pypdf.PdfReader(file)
                 for page_num in range(len(reader.pages)):
@@ -118,7 +151,12 @@ def load_gemini_processed_state(logger, state_file_path):
     return set()
 
 def save_gemini_processed_state(logger, state_file_path, processed_items_set):
-    temp_state_file_path = state_file_path + ".tmp"
+    # 啟用工作分攤 (WORK_QUEUE_BACKEND) 時此檔案只是參考 (用於判斷能否走增量模式)：多個工作者的讀取-合併-寫入之間沒有鎖，
+    # 仍可能遺失其他工作者的記錄；某個輸入版本是否已完成以工作佇列的完成記錄 (work_queue.is_done) 為準
+    temp_state_file_path = worker_temp_path(state_file_path) # 每個工作者/線程各自的臨時檔案
+    if WORK_QUEUE_BACKEND and os.path.exists(state_file_path):
+        # 先合併其他工作者已寫入的記錄，盡量減少互相覆蓋
+        processed_items_set = processed_items_set | load_gemini_processed_state(logger, state_file_path)
     try:
         os.makedirs(os.path.dirname(state_file_path), exist_ok=True)
         with open(temp_state_file_path, 'w', encoding='utf-8') as f:
@@ -133,6 +171,22 @@ def save_gemini_processed_state(logger, state_file_path, processed_items_set):
             except OSError as oe:
                 logger.error(f"移除臨時 Gemini 狀態檔案 '{temp_state_file_path}' 時發生錯誤: {oe}", exc_info=True)
 
+_work_queue = None
+
+def get_work_queue(logger):
+    """返回 (並在首次調用時打開) 工作分攤佇列；WORK_QUEUE_BACKEND 未設定時返回 None。"""
+    global _work_queue
+    if _work_queue is None and WORK_QUEUE_BACKEND:
+        _work_queue = open_work_queue(WORK_QUEUE_BACKEND, WORK_QUEUE_DIR, logger)
+    return _work_queue
+
+def close_work_queue():
+    """停止續期並釋放仍持有的租約。"""
+    global _work_queue
+    if _work_queue is not None:
+        _work_queue.close()
+        _work_queue = None
+
 # --- 輔助函數：解析 SRT 內容 ---
 def parse_srt_content(srt_content_str):
     segments = []
@@ -151,32 +205,207 @@ def parse_srt_content(srt_content_str):
         })
     return segments
 
+# --- 輔助函數：以校對後文本重新對齊時間軸並輸出 SRT ---
+def write_corrected_srt(logger, item_path, base_name, whisper_line_count, gemini_lines, parsed_srt_segments):
+    """
+    將 Gemini 校對後的每一行映射回原始時間軸，輸出 [base_name]_corrected.srt。
+    優先使用 local_transcriber 的逐詞時間軸側檔案；若不存在，退回以 SRT 片段逐字插值。
+    """
+    words_path = os.path.join(item_path, f"{base_name}{WORD_TIMINGS_FILE_SUFFIX}")
+    word_timings = load_word_timings(words_path, logger)
+    if word_timings is not None:
+        logger.info(f"使用逐詞時間軸 '{words_path}' 對齊校對後文本。")
+    else:
+        logger.info(f"未找到逐詞時間軸，將使用 SRT 片段時間插值對齊校對後文本 ({base_name})。")
+        word_timings = word_timings_from_srt_segments(parsed_srt_segments)
+        whisper_line_count = len(parsed_srt_segments)
+
+    if not word_timings['words']:
+        logger.warning(f"'{base_name}' 沒有可用的時間軸資料，跳過校對後 SRT 輸出。")
+        return None
+
+    cues = align_corrected_lines(word_timings, gemini_lines, whisper_line_count)
+    corrected_srt_path = os.path.join(item_path, f"{base_name}{CORRECTED_SRT_FILE_SUFFIX}")
+    try:
+        with open(corrected_srt_path, 'w', encoding='utf-8') as f:
+            f.write(build_srt_content(cues))
+        logger.info(f"校對後 SRT 字幕已成功寫入: {corrected_srt_path} ({len(cues)} 條)")
+        return corrected_srt_path
+    except IOError as e:
+        logger.error(f"寫入校對後 SRT 字幕至 {corrected_srt_path} 時發生錯誤: {e}", exc_info=True)
+        return None
+
 # --- 輔助函式：調用 Gemini API 進行校對 (使用 SDK 並含分批處理邏輯) ---
-def get_gemini_correction(logger, transcribed_text_lines, pdf_context, main_instruction, correction_rules):
+def _record_tier_usage(tier_stats, tier, elapsed_seconds, response):
+    # 累計某一層 (draft / pro) 的請求數、延遲與 token 數，並寫入 run_metrics
+    stats = tier_stats.setdefault(tier, {'requests': 0, 'seconds': 0.0, 'prompt_tokens': 0, 'output_tokens': 0})
+    stats['requests'] += 1
+    stats['seconds'] += elapsed_seconds
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = (getattr(usage, 'prompt_token_count', 0) or 0) if usage is not None else 0
+    output_tokens = (getattr(usage, 'candidates_token_count', 0) or 0) if usage is not None else 0
+    stats['prompt_tokens'] += prompt_tokens
+    stats['output_tokens'] += output_tokens
+    run_metrics.observe(f"gemini.tier.{tier}", elapsed_seconds)
+    run_metrics.increment(f"gemini.tier.{tier}.prompt_tokens", prompt_tokens)
+    run_metrics.increment(f"gemini.tier.{tier}.output_tokens", output_tokens)
+    return prompt_tokens, output_tokens
+
+def _response_truncated(response):
+    # finish_reason 在 SDK 中為 IntEnum (MAX_TOKENS == 2)，亦兼容只有名稱的實現
+    candidates = getattr(response, 'candidates', None) or []
+    if not candidates:
+        return False
+    finish_reason = getattr(candidates[0], 'finish_reason', None)
+    return finish_reason == GEMINI_FINISH_REASON_MAX_TOKENS or getattr(finish_reason, 'name', None) == 'MAX_TOKENS'
+
+def _send_batch_prompt(logger, pool, batch_lines, pdf_context, main_instruction, correction_rules,
+                       batch_label, tier, tier_stats, extra_rules):
+    """發送一個批次的提示詞，返回 (返回的行列表, 是否因 max_output_tokens 被截斷)；出錯時返回 None。"""
+    batch_transcribed_text_single_string = "\n".join(batch_lines)
     try:
-        api_key = userdata.get('GEMINI_API_KEY')
-        if not api_key:
-            print("錯誤: GEMINI_API_KEY 未設定。請在 Colab Secrets 中設定您的 Gemini API 金鑰。")
-            logger.critical("GEMINI_API_KEY 未設定。")
+        batch_specific_correction_rules = correction_rules.format(batch_line_count=len(batch_lines))
+    except KeyError as ke:
+        logger.error(f"格式化校對規則 (批次 {batch_label}) 時，佔位符不正確或缺失。期望的佔位符是 '{{batch_line_count}}'。規則模板: '{correction_rules}' 錯誤: {ke}", exc_info=True)
+        return None
+
+    full_prompt_for_batch = (
+        f"{main_instruction}\n\n"
+        f"上課講義內容（作為校對參考，請仔細閱讀）：\n---\n{pdf_context}\n---\n\n"
+        f"以下是需要校對的字幕文本 (共 {len(batch_lines)} 行):\n---\n{batch_transcribed_text_single_string}\n---\n\n"
+        f"{batch_specific_correction_rules}{extra_rules}"
+    )
+
+    try:
+        logger.debug(f"Gemini API (批次 {batch_label}，{tier}) - 發送請求...")
+        # 速率限制 (429) 與暫時性錯誤由客戶端池改用其他端點處理，無需在此睡眠重試
+        request_started = time.perf_counter()
+        response = pool.generate_content(full_prompt_for_batch, expected_output_tokens=estimate_tokens(batch_transcribed_text_single_string))
+        elapsed_seconds = time.perf_counter() - request_started
+        corrected_text_from_api_batch = response.text
+    except GeminiPoolExhausted as e:
+        logger.error(f"Gemini API (批次 {batch_label}，{tier}) 已達最大重試次數。失敗。錯誤: {e}", exc_info=True)
+        return None
+    except Exception as e:
+        logger.error(f"調用 Gemini API (批次 {batch_label}，{tier}) 時發生嚴重錯誤: {e}", exc_info=True)
+        return None
+    prompt_tokens, output_tokens = _record_tier_usage(tier_stats, tier, elapsed_seconds, response)
+    logger.info(f"Gemini API (批次 {batch_label}，{tier}) 耗時 {elapsed_seconds:.1f} 秒，輸入 {prompt_tokens} / 輸出 {output_tokens} token。")
+    return corrected_text_from_api_batch.strip().split('\n'), _response_truncated(response)
+
+def _request_batch_correction(logger, pool, batch_lines, pdf_context, main_instruction, correction_rules,
+                              batch_label, tier, tier_stats, extra_rules=""):
+    """
+    將一個批次發送給指定的客戶端池，並將返回的行數校準為與輸入一致。
+    響應因 finish_reason 為 MAX_TOKENS 被截斷時，返回的行是批次的前綴：保留其中的完整行，只將其後尚未校對的行
+    作為續寫批次重新發送 (最多 GEMINI_CONTINUATION_MAX_ROUNDS 次)。
+    未被截斷但返回行數不足時，模型可能在中間合併或遺漏了行，返回的行無法與原始行對應：
+    將尚未校對的行整批重新發送一次，仍不足時這些行使用原始行。
+    返回 (校對後的行列表, 返回行數是否與輸入一致)；出錯時返回 None。
+    """
+    corrected_lines = []
+    line_count_matched = True
+    resent_short_reply = False
+    resending = False
+    for round_idx in range(GEMINI_CONTINUATION_MAX_ROUNDS + 1):
+        remaining_lines = batch_lines[len(corrected_lines):]
+        if not remaining_lines:
+            break # 沒有尚未校對的行，不發送空的續寫批次
+        if resending:
+            round_label = f"{batch_label} 重新發送"
+        else:
+            round_label = batch_label if round_idx == 0 else f"{batch_label} 續寫 {round_idx}"
+            if round_idx > 0:
+                run_metrics.increment('gemini.continuation_requests')
+        resending = False
+        result = _send_batch_prompt(logger, pool, remaining_lines, pdf_context, main_instruction, correction_rules,
+                                    round_label, tier, tier_stats, extra_rules)
+        if result is None:
             return None
-        genai.configure(api_key=api_key)
+        returned_lines, truncated = result
+
+        if truncated:
+            # 最後一行可能在中途被截斷，只保留其前的完整行
+            run_metrics.increment('gemini.truncated_responses')
+            kept_lines = returned_lines[:min(len(returned_lines) - 1, len(remaining_lines))]
+            logger.warning(f"Gemini API (批次 {round_label}，{tier}) 的響應因達到 max_output_tokens 被截斷，"
+                           f"保留前 {len(kept_lines)}/{len(remaining_lines)} 行，其餘行將作為續寫批次重新發送。")
+        elif len(returned_lines) < len(remaining_lines):
+            # 未被截斷卻缺少行：無法判斷哪些行被合併或遺漏，不能把返回的行當作前綴保留
+            run_metrics.increment('gemini.short_responses')
+            if not resent_short_reply and round_idx < GEMINI_CONTINUATION_MAX_ROUNDS:
+                resent_short_reply = resending = True
+                logger.warning(f"Gemini API (批次 {round_label}，{tier}) 返回的行數 ({len(returned_lines)}) 少於原始批次文本行數 ({len(remaining_lines)})，"
+                               f"且響應未被截斷。無法對應各行，將這 {len(remaining_lines)} 行整批重新發送一次。")
+                continue
+            logger.warning(f"Gemini API (批次 {round_label}，{tier}) 返回的行數 ({len(returned_lines)}) 仍少於原始批次文本行數 ({len(remaining_lines)})。"
+                           f"捨棄此響應，這 {len(remaining_lines)} 行使用原始行。")
+            break
+        else:
+            if len(returned_lines) > len(remaining_lines):
+                line_count_matched = False
+                logger.warning(f"Gemini API (批次 {round_label}，{tier}) 返回的行數 ({len(returned_lines)}) 多於原始批次文本行數 ({len(remaining_lines)})。將截斷多餘的行。")
+            corrected_lines.extend(returned_lines[:len(remaining_lines)])
+            break
+
+        if not kept_lines:
+            logger.warning(f"Gemini API (批次 {round_label}，{tier}) 沒有返回任何完整行，停止續寫。")
+            break
+        corrected_lines.extend(kept_lines)
+        if len(corrected_lines) >= len(batch_lines):
+            break # 截斷前的完整行已覆蓋整個批次
+
+    if len(corrected_lines) < len(batch_lines):
+        line_count_matched = False
+        logger.warning(f"批次 {batch_label} 續寫後仍缺少 {len(batch_lines) - len(corrected_lines)} 行，使用原始行填充。")
+        corrected_lines.extend(batch_lines[len(corrected_lines):])
+    elif line_count_matched:
+        logger.info(f"Gemini API (批次 {batch_label}，{tier}) 校對完成，行數與原始批次文本一致 ({len(corrected_lines)} 行)。")
+    return corrected_lines, line_count_matched
+
+def line_change_ratio(original_line, corrected_line):
+    """校對前後一行文本的改動比例：0 表示未改動，1 表示完全不同。"""
+    if original_line == corrected_line:
+        return 0.0
+    return 1.0 - difflib.SequenceMatcher(None, original_line, corrected_line, autojunk=False).ratio()
+
+def _select_lines_to_escalate(original_lines, draft_lines, line_count_matched):
+    """
+    返回需要升級到 Pro 模型的行索引，以及移除了不確定標記的初稿行。
+    初稿返回的行數不一致時整批升級 (無法可靠判斷每行對應關係)。
+    """
+    cleaned_lines, escalate_indices = [], []
+    for k_idx, (original_line, draft_line) in enumerate(zip(original_lines, draft_lines)):
+        flagged = draft_line.lstrip().startswith(GEMINI_CASCADE_UNCERTAIN_MARKER)
+        if flagged:
+            draft_line = draft_line.lstrip()[len(GEMINI_CASCADE_UNCERTAIN_MARKER):].lstrip()
+        cleaned_lines.append(draft_line)
+        if not line_count_matched or flagged or line_change_ratio(original_line, draft_line) > GEMINI_CASCADE_ESCALATION_THRESHOLD:
+            escalate_indices.append(k_idx)
+    return cleaned_lines, escalate_indices
+
+def _log_tier_summary(logger, tier_stats, escalated_line_count, total_lines):
+    for tier, stats in tier_stats.items():
+        logger.info(f"Gemini {tier} 層: {stats['requests']} 次請求，共耗時 {stats['seconds']:.1f} 秒，"
+                    f"輸入 {stats['prompt_tokens']} / 輸出 {stats['output_tokens']} token。")
+    if GEMINI_CASCADE_ENABLED:
+        logger.info(f"級聯校對: {escalated_line_count}/{total_lines} 行 ({escalated_line_count / total_lines:.1%}) 升級至 Pro 模型。")
+
+def get_gemini_correction(logger, transcribed_text_lines, pdf_context, main_instruction, correction_rules):
+    # 客戶端池在首次調用時創建並緩存，模型物件在所有項目之間重用 (見 gemini_pool.py)
+    try:
+        pool = get_pool(logger, GEMINI_GENERATION_CONFIG)
+        draft_pool = None
+        if GEMINI_CASCADE_ENABLED:
+            draft_pool = get_pool(logger, GEMINI_GENERATION_CONFIG, GEMINI_CASCADE_DRAFT_MODELS,
+                                  GEMINI_CASCADE_DRAFT_REQUESTS_PER_MINUTE, GEMINI_CASCADE_DRAFT_TOKENS_PER_MINUTE)
     except Exception as e:
         logger.error(f"配置 Gemini SDK 時出錯: {e}", exc_info=True)
         return None
-
-    actual_model_name = "gemini-1.5-pro-latest" # Reverted to Pro model
-    logger.info(f"Gemini API 將使用模型: {actual_model_name} (根據用戶最新指示配置)")
-
-    model = genai.GenerativeModel(
-        model_name=actual_model_name,
-        generation_config={
-            "temperature": 0.2,
-            "top_p": 0.95,
-            "top_k": 64,
-            "max_output_tokens": 8192,
-            "response_mime_type": "text/plain"
-        }
-    )
+    if pool is None:
+        print("錯誤: GEMINI_API_KEY 未設定。請在 Colab Secrets 或環境變數中設定您的 Gemini API 金鑰。")
+        logger.critical(f"GEMINI_API_KEY 未設定 (可設定的密鑰名稱: {', '.join(GEMINI_API_KEY_SECRETS)})。")
+        return None
 
     all_corrected_lines_from_batches = []
     total_lines = len(transcribed_text_lines)
@@ -186,10 +415,11 @@ def get_gemini_correction(logger, transcribed_text_lines, pdf_context, main_inst
         return ""
 
     num_batches = (total_lines + GEMINI_API_BATCH_MAX_LINES - 1) // GEMINI_API_BATCH_MAX_LINES
-    logger.info(f"文本總行數: {total_lines}。按每批次最多 {GEMINI_API_BATCH_MAX_LINES} 行，將分割成 {num_batches} 個批次進行 Gemini API 校對。")
-
-    max_retries_gemini = 5
-    base_delay_gemini = 60
+    logger.info(f"文本總行數: {total_lines}。按每批次最多 {GEMINI_API_BATCH_MAX_LINES} 行，將分割成 {num_batches} 個批次進行 Gemini API 校對"
+                f"{' (級聯模式: 先由 ' + ', '.join(GEMINI_CASCADE_DRAFT_MODELS) + ' 校對)' if draft_pool else ''}。")
+    cascade_rule = f"\n\n附加規則：如果對某一行的修改沒有把握，請在該行開頭加上「{GEMINI_CASCADE_UNCERTAIN_MARKER}」。"
+    tier_stats = {}
+    escalated_indices = [] # 需要 Pro 模型重新校對的行 (全局索引)
 
     for batch_idx in range(num_batches):
         start_index = batch_idx * GEMINI_API_BATCH_MAX_LINES
@@ -201,70 +431,44 @@ def get_gemini_correction(logger, transcribed_text_lines, pdf_context, main_inst
             continue
 
         logger.info(f"正在處理第 {batch_idx+1}/{num_batches} 批次的文本 (行 {start_index+1} 到 {end_index})...")
-
-        batch_transcribed_text_single_string = "\n".join(current_batch_lines)
-        try:
-            batch_specific_correction_rules = correction_rules.format(batch_line_count=len(current_batch_lines))
-        except KeyError as ke:
-            logger.error(f"格式化校對規則 (批次 {batch_idx+1}/{num_batches}) 時，佔位符不正確或缺失。期望的佔位符是 '{{batch_line_count}}'。規則模板: '{correction_rules}' 錯誤: {ke}", exc_info=True)
-            return None
-
-        full_prompt_for_batch = (
-            f"{main_instruction}\n\n"
-            f"上課講義內容（作為校對參考，請仔細閱讀）：\n---\n{pdf_context}\n---\n\n"
-            f"以下是需要校對的字幕文本 (共 {len(current_batch_lines)} 行):\n---\n{batch_transcribed_text_single_string}\n---\n\n"
-            f"{batch_specific_correction_rules}"
-        )
-
-        batch_processed_successfully = False
-        for attempt in range(max_retries_gemini):
-            try:
-                logger.debug(f"Gemini API (批次 {batch_idx+1}/{num_batches}) - 嘗試 {attempt + 1}/{max_retries_gemini}...")
-                response = model.generate_content(full_prompt_for_batch)
-                corrected_text_from_api_batch = response.text
-                raw_corrected_lines_for_this_batch = corrected_text_from_api_batch.strip().split('\n')
-
-                if len(raw_corrected_lines_for_this_batch) != len(current_batch_lines):
-                    logger.warning(f"Gemini API (批次 {batch_idx+1}/{num_batches}) 返回的行數 ({len(raw_corrected_lines_for_this_batch)}) 與原始批次文本行數 ({len(current_batch_lines)}) 不一致。將進行逐行校準。")
-                    adjusted_lines_for_this_batch = []
-                    for k_idx in range(len(current_batch_lines)):
-                        if k_idx < len(raw_corrected_lines_for_this_batch):
-                            adjusted_lines_for_this_batch.append(raw_corrected_lines_for_this_batch[k_idx])
-                        else:
-                            adjusted_lines_for_this_batch.append(current_batch_lines[k_idx])
-                            logger.debug(f"批次 {batch_idx+1}，行 {k_idx + start_index + 1} (原始索引): 使用原始行填充，因 Gemini 在此批次返回行數不足。")
-                    corrected_lines_for_this_batch = adjusted_lines_for_this_batch
-                    logger.info(f"已對批次 {batch_idx+1}/{num_batches} 進行行數校準，確保與原始批次行數 ({len(current_batch_lines)}) 一致。")
-                else:
-                    corrected_lines_for_this_batch = raw_corrected_lines_for_this_batch
-                    logger.info(f"Gemini API (批次 {batch_idx+1}/{num_batches}) 校對完成，行數與原始批次文本一致 ({len(corrected_lines_for_this_batch)} 行)。")
-
-                all_corrected_lines_from_batches.extend(corrected_lines_for_this_batch)
-                batch_processed_successfully = True
-                break
-            except Exception as e:
-                error_message = str(e)
-                if "429" in error_message or "ResourceExhausted" in str(type(e)) or "rate limit" in error_message.lower():
-                    if attempt < max_retries_gemini - 1:
-                        delay = base_delay_gemini * (2 ** attempt)
-                        logger.warning(f"Gemini API (批次 {batch_idx+1}) 速率限制。將在 {delay} 秒後重試... (嘗試 {attempt + 1}/{max_retries_gemini})")
-                        time.sleep(delay)
-                    else:
-                        logger.error(f"Gemini API (批次 {batch_idx+1}) 已達最大重試次數。失敗。錯誤: {e}", exc_info=True)
-                        return None
-                else:
-                    logger.error(f"調用 Gemini API (批次 {batch_idx+1}) 時發生嚴重錯誤: {e}", exc_info=True)
-                    return None
-
-        if not batch_processed_successfully:
-            logger.error(f"Gemini API (批次 {batch_idx+1}) 調用最終失敗 (所有重試均未成功)。")
+        batch_label = f"{batch_idx+1}/{num_batches}"
+
+        if draft_pool is None:
+            result = _request_batch_correction(logger, pool, current_batch_lines, pdf_context, main_instruction, correction_rules,
+                                               batch_label, 'pro', tier_stats)
+            if result is None:
+                return None
+            corrected_lines_for_this_batch, _ = result
+        else:
+            result = _request_batch_correction(logger, draft_pool, current_batch_lines, pdf_context, main_instruction, correction_rules,
+                                               batch_label, 'draft', tier_stats, extra_rules=cascade_rule)
+            if result is None:
+                return None
+            corrected_lines_for_this_batch, escalate_in_batch = _select_lines_to_escalate(current_batch_lines, *result)
+            escalated_indices.extend(start_index + k_idx for k_idx in escalate_in_batch)
+            logger.info(f"批次 {batch_label}: 初稿模型標記 {len(escalate_in_batch)}/{len(current_batch_lines)} 行需升級至 Pro 模型。")
+
+        all_corrected_lines_from_batches.extend(corrected_lines_for_this_batch)
+
+        if batch_idx < num_batches - 1 and GEMINI_INTER_BATCH_DELAY_SECONDS:
+            logger.info(f"批次 {batch_idx+1}/{num_batches} 處理完成，等待 {GEMINI_INTER_BATCH_DELAY_SECONDS} 秒...")
+            run_metrics.sleep(GEMINI_INTER_BATCH_DELAY_SECONDS, 'gemini_batch_delay')
+
+    # 級聯模式：將所有批次中需要升級的原始行合併後重新分批，交給 Pro 模型校對
+    num_escalation_batches = (len(escalated_indices) + GEMINI_API_BATCH_MAX_LINES - 1) // GEMINI_API_BATCH_MAX_LINES
+    for escalation_idx in range(num_escalation_batches):
+        batch_indices = escalated_indices[escalation_idx * GEMINI_API_BATCH_MAX_LINES:(escalation_idx + 1) * GEMINI_API_BATCH_MAX_LINES]
+        result = _request_batch_correction(logger, pool, [transcribed_text_lines[i] for i in batch_indices], pdf_context,
+                                           main_instruction, correction_rules, f"升級 {escalation_idx+1}/{num_escalation_batches}",
+                                           'pro', tier_stats)
+        if result is None:
             return None
-
-        if batch_idx < num_batches - 1:
-            logger.info(f"批次 {batch_idx+1}/{num_batches} 處理完成，等待 30 秒...") # Updated delay
-            time.sleep(30) # Updated delay
+        for line_index, pro_line in zip(batch_indices, result[0]):
+            all_corrected_lines_from_batches[line_index] = pro_line
+    run_metrics.increment('gemini.cascade.escalated_lines', len(escalated_indices))
 
     logger.info("所有批次的 Gemini API 校對請求均已處理完成。")
+    _log_tier_summary(logger, tier_stats, len(escalated_indices), total_lines)
     final_corrected_text_str = "\n".join(all_corrected_lines_from_batches)
     final_corrected_lines_list = final_corrected_text_str.split('\n')
 
@@ -286,6 +490,159 @@ def get_gemini_correction(logger, transcribed_text_lines, pdf_context, main_inst
 
     return final_corrected_text_str
 
+# --- 增量重新校對 ---
+def load_gemini_snapshot(logger, item_path, base_name):
+    """讀取上次 Gemini 校對時的 Whisper 行、校對結果與 SRT 雜湊；不存在或損壞時返回 None。"""
+    snapshot_path = os.path.join(item_path, f"{base_name}{GEMINI_SNAPSHOT_FILE_SUFFIX}")
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != GEMINI_SNAPSHOT_FORMAT_VERSION or len(snapshot['whisper_lines']) != len(snapshot['gemini_lines']):
+            logger.warning(f"校對快照 '{snapshot_path}' 的格式不符，將進行完整處理。")
+            return None
+        return snapshot
+    except (json.JSONDecodeError, KeyError, TypeError, OSError) as e:
+        logger.warning(f"讀取校對快照 '{snapshot_path}' 時發生錯誤: {e}。將進行完整處理。")
+        return None
+
+def save_gemini_snapshot(logger, item_path, base_name, whisper_lines, gemini_lines, srt_content_str):
+    snapshot_path = os.path.join(item_path, f"{base_name}{GEMINI_SNAPSHOT_FILE_SUFFIX}")
+    temp_snapshot_path = snapshot_path + ".tmp"
+    snapshot = {
+        'version': GEMINI_SNAPSHOT_FORMAT_VERSION,
+        'whisper_lines': list(whisper_lines),
+        'gemini_lines': list(gemini_lines),
+        'srt_sha1': hashlib.sha1(srt_content_str.encode('utf-8')).hexdigest(),
+    }
+    try:
+        with open(temp_snapshot_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(temp_snapshot_path, snapshot_path)
+        logger.debug(f"校對快照已儲存至 '{snapshot_path}'。")
+    except Exception as e:
+        logger.error(f"儲存校對快照至 '{snapshot_path}' 時發生錯誤: {e}", exc_info=True)
+        if os.path.exists(temp_snapshot_path):
+            try:
+                os.remove(temp_snapshot_path)
+            except OSError:
+                pass
+
+def changed_line_regions(old_lines, new_lines, context_lines):
+    """
+    以行級 SequenceMatcher 比較新舊文本。返回:
+    regions: 新文本中需要重新校對的 [起始, 結束) 區間 (已加上前後 context_lines 行並合併重疊部分)
+    new_to_old: 未改動的新行索引 -> 舊行索引
+    """
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    regions, new_to_old = [], {}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for offset in range(j2 - j1):
+                new_to_old[j1 + offset] = i1 + offset
+            continue
+        start, end = max(0, j1 - context_lines), min(len(new_lines), j2 + context_lines)
+        if start == end: # 純刪除且沒有上下文：無需重新校對
+            continue
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(end, regions[-1][1]))
+        else:
+            regions.append((start, end))
+    return regions, new_to_old
+
+def changed_row_updates(old_rows, new_rows, first_row_number, blank_row):
+    """
+    比較工作表中的新舊行，返回 gspread batch_update 的數據 (每段連續的變更行一個範圍)。
+    新行數較少時，多出的舊行以 blank_row 覆蓋。first_row_number 為列表第一行對應的工作表行號。
+    """
+    updates, run_start, run_values = [], None, []
+    for index in range(max(len(old_rows), len(new_rows)) + 1):
+        old_row = old_rows[index] if index < len(old_rows) else None
+        new_row = new_rows[index] if index < len(new_rows) else (blank_row if index < len(old_rows) else None)
+        if new_row is not None and new_row != old_row:
+            if run_start is None:
+                run_start = index
+            run_values.append(new_row)
+            continue
+        if run_start is not None:
+            start_row, end_row = first_row_number + run_start, first_row_number + index - 1
+            last_column = chr(ord('A') + len(blank_row) - 1)
+            updates.append({'range': f"A{start_row}:{last_column}{end_row}", 'values': run_values})
+            run_start, run_values = None, []
+    return updates
+
+def process_item_incrementally(logger, base_name, item_path, whisper_lines, srt_content_str, snapshot,
+                               main_instruction, correction_rules):
+    """
+    根據上次校對的快照增量處理一個項目：只重新校對 Whisper 文本中改動的區域 (含前後上下文行)，
+    並只改寫工作表中內容有變化的行。返回:
+        'done'     已處理 (包括無變化)
+        'full'     需要走完整流程 (找不到試算表或工作表)
+        'failed'   Gemini 校對失敗，工作表與快照保持不變，之後應重試
+    """
+    import gspread
+    old_whisper_lines, old_gemini_lines = snapshot['whisper_lines'], snapshot['gemini_lines']
+    srt_changed = hashlib.sha1(srt_content_str.encode('utf-8')).hexdigest() != snapshot.get('srt_sha1')
+    if whisper_lines == old_whisper_lines and not srt_changed:
+        logger.info(f"'{base_name}' 的 Whisper 文本與 SRT 自上次校對後未變更，跳過。")
+        return 'done'
+
+    try:
+        spreadsheet = gc.open(base_name)
+        normal_worksheet = spreadsheet.worksheet("文本校對")
+        subtitle_worksheet = spreadsheet.worksheet("時間軸")
+    except (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound):
+        logger.warning(f"找不到 '{base_name}' 的試算表或工作表，改為完整處理。")
+        return 'full'
+
+    parsed_srt_segments = parse_srt_content(srt_content_str)
+    if srt_changed:
+        logger.info(f"'{base_name}' 的 SRT 已變更，正在重寫工作表 '時間軸'...")
+        execute_gspread_write(logger, subtitle_worksheet.clear)
+        rows_to_upload_subtitle = [[seg['id'], seg['start'], seg['end'], seg['text']] for seg in parsed_srt_segments]
+        execute_gspread_write(logger, subtitle_worksheet.update, range_name='A1',
+                              values=[['序號', '開始時間', '結束時間', '文字']] + rows_to_upload_subtitle)
+
+    gemini_lines = old_gemini_lines
+    if whisper_lines != old_whisper_lines:
+        regions, new_to_old = changed_line_regions(old_whisper_lines, whisper_lines, GEMINI_INCREMENTAL_CONTEXT_LINES)
+        region_lines = [line for start, end in regions for line in whisper_lines[start:end]]
+        logger.info(f"'{base_name}' 的 Whisper 文本已變更: {len(whisper_lines)} 行中有 {len(region_lines)} 行 "
+                    f"(含上下文，共 {len(regions)} 個區域) 需要重新校對。")
+        corrected_region_lines = []
+        if region_lines:
+            # 所有區域合併為一次校對 (按行獨立處理)，減少請求數
+            corrected_text_str = get_gemini_correction(logger, region_lines, "", main_instruction, correction_rules)
+            if not corrected_text_str:
+                logger.warning(f"Gemini API 增量校對失敗或無返回內容 ({base_name})，工作表與快照保持不變，下次運行時重試。")
+                return 'failed'
+            corrected_region_lines = corrected_text_str.split('\n')
+        gemini_lines = [old_gemini_lines[new_to_old[index]] if index in new_to_old else None for index in range(len(whisper_lines))]
+        position = 0
+        for start, end in regions:
+            gemini_lines[start:end] = corrected_region_lines[position:position + end - start]
+            position += end - start
+        gemini_lines = [line if line is not None else "" for line in gemini_lines]
+
+        updates = changed_row_updates([list(row) for row in zip(old_whisper_lines, old_gemini_lines)],
+                                      [list(row) for row in zip(whisper_lines, gemini_lines)], 2, ["", ""])
+        if updates:
+            execute_gspread_write(logger, normal_worksheet.batch_update, updates)
+        rewritten_rows = sum(len(update['values']) for update in updates)
+        run_metrics.increment('gemini.items')
+        run_metrics.increment('gemini.incremental.items')
+        run_metrics.increment('gemini.incremental.lines', len(region_lines))
+        run_metrics.increment('sheets.rows_rewritten', rewritten_rows)
+        logger.info(f"已增量更新工作表 '文本校對' 的 {rewritten_rows} 行 ({len(updates)} 個範圍，{base_name})。")
+
+    save_gemini_snapshot(logger, item_path, base_name, whisper_lines, gemini_lines, srt_content_str)
+    write_corrected_srt(logger, item_path, base_name, len(whisper_lines), gemini_lines, parsed_srt_segments)
+    logger.info(f"項目 {base_name} 的增量處理完成。試算表連結: {spreadsheet.url}")
+    runtime_env.get_environment().display_html(f"<p>項目 {base_name} 增量處理完成。試算表連結: <a href='{spreadsheet.url}' target='_blank'>{spreadsheet.url}</a></p>")
+    run_metrics.sleep(INTER_SPREADSHEET_DELAY_SECONDS, 'inter_spreadsheet')
+    return 'done'
+
 gc = None
 pdf_context_text = ""
 current_main_instruction = DEFAULT_GEMINI_MAIN_INSTRUCTION
@@ -295,10 +652,9 @@ def initial_setup(logger_instance):
     global gc, pdf_context_text, current_main_instruction, current_correction_rules
 
     logger_instance.info("正在進行 Google Drive 和 Sheets 身份驗證...")
+    environment = runtime_env.get_environment(logger_instance)
     try:
-        auth.authenticate_user()
-        creds, _ = default()
-        gc = gspread.authorize(creds)
+        gc = environment.authorize_gspread(logger_instance)
         logger_instance.info("Google Drive 和 Sheets 身份驗證成功。")
     except Exception as e:
         logger_instance.error(f"Google Drive 或 Sheets 身份驗證失敗: {e}", exc_info=True)
@@ -307,8 +663,8 @@ def initial_setup(logger_instance):
     if gc:
         logger_instance.info("正在掛載 Google Drive...")
         try:
-            drive.mount('/content/drive', force_remount=True)
-            logger_instance.info("Google Drive 掛載成功。")
+            if environment.mount_drive('/content/drive', logger_instance):
+                logger_instance.info("Google Drive 掛載成功。")
         except Exception as e:
             logger_instance.error(f"Google Drive 掛載失敗: {e}", exc_info=True)
 
@@ -345,7 +701,10 @@ def initial_setup(logger_instance):
         logger_instance.info(f"  {line}")
 
     logger_instance.info(f"準備清理 PDF 講義文件夾: '{pdf_handout_dir}'...")
-    if os.path.exists(pdf_handout_dir):
+    if not environment.supports_upload:
+        # 無法互動式上傳時，講義只能預先放入資料夾，因此不能清理
+        logger_instance.info(f"運行環境 '{environment.name}' 不支持互動式上傳，保留 '{pdf_handout_dir}' 中現有的 PDF 講義。")
+    elif os.path.exists(pdf_handout_dir):
         pdf_files_to_delete = []
         pdf_files_to_delete.extend(glob.glob(os.path.join(pdf_handout_dir, "*.pdf")))
         pdf_files_to_delete.extend(glob.glob(os.path.join(pdf_handout_dir, "*.PDF")))
@@ -367,16 +726,18 @@ def initial_setup(logger_instance):
 
     logger_instance.info(f"準備 PDF 上傳界面，目標文件夾: '{pdf_handout_dir}'")
     try:
-        from google.colab import files
         if not os.path.exists(pdf_handout_dir):
             logger_instance.info(f"PDF 講義文件夾 '{pdf_handout_dir}' 不存在，正在創建...")
             os.makedirs(pdf_handout_dir, exist_ok=True)
             logger_instance.info(f"PDF 講義文件夾 '{pdf_handout_dir}' 創建成功。")
 
-        print(f"請選擇要上傳到 '{pdf_handout_dir}' 的 PDF 講義文件：")
-        uploaded_files = files.upload()
+        if environment.supports_upload:
+            print(f"請選擇要上傳到 '{pdf_handout_dir}' 的 PDF 講義文件：")
+        uploaded_files = environment.upload_files()
 
-        if not uploaded_files:
+        if uploaded_files is None:
+            logger_instance.warning(f"運行環境 '{environment.name}' 不支持互動式上傳。請直接將 PDF 講義放入 '{pdf_handout_dir}'。")
+        elif not uploaded_files:
             logger_instance.info("沒有選擇任何 PDF 文件進行上傳。")
         else:
             for file_name, file_content in uploaded_files.items():
@@ -389,10 +750,8 @@ def initial_setup(logger_instance):
                     logger_instance.error(f"儲存上傳的 PDF 文件 '{file_name}' 至 '{destination_path}' 時發生錯誤: {e_upload}", exc_info=True)
             logger_instance.info(f"共 {len(uploaded_files)} 個 PDF 文件上傳操作完成。")
 
-    except ImportError:
-        logger_instance.warning("`google.colab.files` 模塊無法導入。PDF 上傳功能僅在 Google Colab 環境中可用。")
     except Exception as e_colab_files:
-        logger_instance.error(f"使用 `google.colab.files.upload()` 進行 PDF 上傳時發生錯誤: {e_colab_files}", exc_info=True)
+        logger_instance.error(f"上傳 PDF 講義時發生錯誤: {e_colab_files}", exc_info=True)
 
     logger_instance.info(f"正在從 '{pdf_handout_dir}' 提取 PDF 講義內容...")
     pdf_context_text_local = extract_text_from_pdf_dir(logger_instance, pdf_handout_dir)
@@ -408,6 +767,7 @@ def initial_setup(logger_instance):
 
 def process_transcriptions_and_apply_gemini(logger, current_main_instruction_param, current_correction_rules_param):
     global gc, pdf_context_text
+    import gspread
     if gc is None:
         logger.error("gspread client (gc) 未初始化。身份驗證可能失敗。")
         return
@@ -420,43 +780,79 @@ def process_transcriptions_and_apply_gemini(logger, current_main_instruction_par
         logger.error(f"轉錄輸入目錄 '{TRANSCRIPTIONS_ROOT_INPUT_DIR}' 未找到。請確保 local_transcriber.py 已運行並生成輸出。")
         return
 
+    # 單次掃描建立 (或增量更新) 目錄清單，存在性檢查直接查詢清單；後續項目的檔案在線程池中預讀
+    manifest = DirectoryManifest(TRANSCRIPTIONS_ROOT_INPUT_DIR).refresh(logger)
+
+    def read_item_files(item_name):
+        item_path = os.path.join(TRANSCRIPTIONS_ROOT_INPUT_DIR, item_name)
+        return {file_name: read_text_file(os.path.join(item_path, file_name)) if manifest.has_file(item_name, file_name) else None
+                for file_name in (f"{item_name}_normal.txt", f"{item_name}.srt")}
+
+    work_queue = get_work_queue(logger)
     processed_item_count = 0
-    for item_name in os.listdir(TRANSCRIPTIONS_ROOT_INPUT_DIR):
+    for item_name, item_files in prefetch(manifest.subdirectories(), read_item_files):
         item_path = os.path.join(TRANSCRIPTIONS_ROOT_INPUT_DIR, item_name)
 
-        if os.path.isdir(item_path):
-            base_name = item_name
-            logger.info(f"--- 開始處理項目: {base_name} ---")
+        base_name = item_name
+        logger.info(f"--- 開始處理項目: {base_name} ---")
 
-            normal_text_path = os.path.join(item_path, f"{base_name}_normal.txt")
-            srt_path = os.path.join(item_path, f"{base_name}.srt")
+        normal_text_path = os.path.join(item_path, f"{base_name}_normal.txt")
+        srt_path = os.path.join(item_path, f"{base_name}.srt")
 
-            normal_text_content = None
-            if os.path.exists(normal_text_path):
-                try:
-                    with open(normal_text_path, 'r', encoding='utf-8') as f:
-                        normal_text_content = f.read()
-                    logger.info(f"成功讀取一般文本檔案: {normal_text_path} ({len(normal_text_content.splitlines())} 行)。")
-                except Exception as e:
-                    logger.error(f"讀取一般文本檔案失敗: {normal_text_path} - {e}", exc_info=True)
-                    continue
-            else:
-                logger.warning(f"一般文本檔案未找到: {normal_text_path}，跳過 {base_name}。")
-                continue
+        normal_text_result = item_files[f"{base_name}_normal.txt"]
+        if normal_text_result is None:
+            logger.warning(f"一般文本檔案未找到: {normal_text_path}，跳過 {base_name}。")
+            continue
+        normal_text_content, read_error = normal_text_result
+        if read_error is not None:
+            logger.error(f"讀取一般文本檔案失敗: {normal_text_path} - {read_error}", exc_info=read_error)
+            continue
+        logger.info(f"成功讀取一般文本檔案: {normal_text_path} ({len(normal_text_content.splitlines())} 行)。")
 
-            srt_content_str = None
-            if os.path.exists(srt_path):
+        srt_result = item_files[f"{base_name}.srt"]
+        if srt_result is None:
+            logger.warning(f"SRT 字幕檔案未找到: {srt_path}，跳過 {base_name} (因需要 SRT 檔案以建立 '時間軸' 工作表)。")
+            continue
+        srt_content_str, read_error = srt_result
+        if read_error is not None:
+            logger.error(f"讀取 SRT 字幕檔案失敗: {srt_path} - {read_error}", exc_info=read_error)
+            logger.warning(f"由於讀取 SRT 字幕檔案失敗，跳過 {base_name}。")
+            continue
+        logger.info(f"成功讀取 SRT 字幕檔案: {srt_path} ({len(srt_content_str.splitlines())} 行)。")
+
+        # 工作分攤：以項目名與輸入內容的雜湊作為鍵，同一版本的轉錄只由一個工作者處理；Whisper 輸出變更後成為新的鍵
+        lease = None
+        if work_queue is not None:
+            content_hash = hashlib.sha1((normal_text_content + "\0" + srt_content_str).encode('utf-8')).hexdigest()[:12]
+            work_key = f"{base_name}@{content_hash}"
+            lease = work_queue.claim(work_key)
+            if lease is None:
+                if work_queue.is_done(work_key):
+                    logger.info(f"跳過 '{base_name}'，當前版本已由其他工作者處理完成。")
+                else:
+                    logger.info(f"跳過 '{base_name}'，它正由其他工作者處理。")
+                continue
+            # 合併其他工作者已完成的記錄，使增量模式能識別它們校對過的項目
+            gemini_processed_items |= load_gemini_processed_state(logger, GEMINI_STATE_FILE_PATH)
+        item_completed = False
+        try:
+            snapshot = None
+            if GEMINI_INCREMENTAL_ENABLED and base_name in gemini_processed_items:
+                snapshot = load_gemini_snapshot(logger, item_path, base_name)
+            if snapshot is not None:
                 try:
-                    with open(srt_path, 'r', encoding='utf-8') as f:
-                        srt_content_str = f.read()
-                    logger.info(f"成功讀取 SRT 字幕檔案: {srt_path} ({len(srt_content_str.splitlines())} 行)。")
-                except Exception as e:
-                    logger.error(f"讀取 SRT 字幕檔案失敗: {srt_path} - {e}", exc_info=True)
-                    logger.warning(f"由於讀取 SRT 字幕檔案失敗，跳過 {base_name}。")
+                    incremental_result = process_item_incrementally(
+                        logger, base_name, item_path, normal_text_content.splitlines(), srt_content_str,
+                        snapshot, current_main_instruction_param, current_correction_rules_param)
+                    if incremental_result == 'done':
+                        processed_item_count += 1
+                        item_completed = True
+                        continue
+                    if incremental_result == 'failed':
+                        continue # 不記錄完成，釋放租約後由下次運行 (或其他工作者) 重試
+                except Exception as e_incremental:
+                    logger.error(f"增量處理 '{base_name}' 時發生錯誤: {e_incremental}", exc_info=True)
                     continue
-            else:
-                logger.warning(f"SRT 字幕檔案未找到: {srt_path}，跳過 {base_name} (因需要 SRT 檔案以建立 '時間軸' 工作表)。")
-                continue
 
             spreadsheet = None
             spreadsheet_name = base_name
@@ -526,6 +922,7 @@ def process_transcriptions_and_apply_gemini(logger, current_main_instruction_par
                     )
 
                     if corrected_text_str:
+                        run_metrics.increment('gemini.items')
                         gemini_lines = corrected_text_str.strip().split('\n')
                         data_for_gemini_column = [["Gemini"]] + [[line] for line in gemini_lines]
                         try:
@@ -535,22 +932,29 @@ def process_transcriptions_and_apply_gemini(logger, current_main_instruction_par
                             gemini_processed_items.add(base_name)
                             save_gemini_processed_state(logger, GEMINI_STATE_FILE_PATH, gemini_processed_items)
                             logger.info(f"已將 '{base_name}' 標記為 Gemini 校對完成並更新狀態檔案。")
+                            save_gemini_snapshot(logger, item_path, base_name, whisper_lines_for_gemini, gemini_lines, srt_content_str)
                         except Exception as e_update:
                             logger.error(f"更新 B欄 Gemini 校對結果時發生錯誤 ({base_name}): {e_update}", exc_info=True)
+
+                        write_corrected_srt(logger, item_path, base_name, len(whisper_lines_for_gemini), gemini_lines, parsed_srt_segments)
                     else:
                         logger.warning(f"Gemini API 校對失敗或無返回內容 ({base_name})，B欄將保持空白。將不會標記為 Gemini 校對完成。")
 
                 processed_item_count += 1
+                item_completed = base_name in gemini_processed_items or not normal_text_content.splitlines()
                 logger.info(f"項目 {base_name} 的表格處理完成。試算表連結: {spreadsheet.url}")
-                display(HTML(f"<p>項目 {base_name} 處理完成。試算表連結: <a href='{spreadsheet.url}' target='_blank'>{spreadsheet.url}</a></p>"))
+                runtime_env.get_environment().display_html(f"<p>項目 {base_name} 處理完成。試算表連結: <a href='{spreadsheet.url}' target='_blank'>{spreadsheet.url}</a></p>")
 
                 logger.info(f"已完成對 '{base_name}' 的所有處理。等待 {INTER_SPREADSHEET_DELAY_SECONDS} 秒後處理下一個項目...")
-                time.sleep(INTER_SPREADSHEET_DELAY_SECONDS)
+                run_metrics.sleep(INTER_SPREADSHEET_DELAY_SECONDS, 'inter_spreadsheet')
 
 
             except Exception as e_sheet_ops:
                 logger.error(f"處理試算表 '{spreadsheet_name}' 時發生錯誤: {e_sheet_ops}", exc_info=True)
                 continue
+        finally:
+            if lease is not None:
+                work_queue.release(lease, done=item_completed)
 
     if processed_item_count == 0:
         logger.info(f"在 '{TRANSCRIPTIONS_ROOT_INPUT_DIR}' 目錄中未找到任何有效的轉錄項目進行處理。")
@@ -573,15 +977,18 @@ if __name__ == '__main__':
     logger.propagate = False # 阻止日誌傳播到 root logger
 
     logger.info("sheets_gemini_processor.py 腳本已啟動。")
+    run_metrics.reset()
 
-    setup_results = initial_setup(logger)
+    try:
+        setup_results = initial_setup(logger)
 
-    if setup_results[0] is None:
-        logger.critical("由於 gspread 客戶端 (gc) 初始化失敗，腳本無法繼續。請檢查認證和授權。")
-    else:
-        _, _, main_instr, correct_rules = setup_results
-        process_transcriptions_and_apply_gemini(logger, main_instr, correct_rules)
+        if setup_results[0] is None:
+            logger.critical("由於 gspread 客戶端 (gc) 初始化失敗，腳本無法繼續。請檢查認證和授權。")
+        else:
+            _, _, main_instr, correct_rules = setup_results
+            process_transcriptions_and_apply_gemini(logger, main_instr, correct_rules)
+    finally:
+        close_work_queue()
+        run_metrics.export('sheets_gemini_processor', logger)
 
     logger.info("sheets_gemini_processor.py 腳本已完成。")
-
-[end of sheets_gemini_processor.py]
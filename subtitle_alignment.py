@@ -0,0 +1,351 @@
+import os
+import json
+from array import array
+
+# --- 配置變數 ---
+WORD_TIMINGS_FILE_SUFFIX = "_words.json" # 逐詞時間軸側檔案後綴 (與 _normal.txt / .srt 同目錄)
+CORRECTED_SRT_FILE_SUFFIX = "_corrected.srt" # 校對後重新對齊時間軸的 SRT 檔案後綴
+WORD_TIMINGS_FORMAT_VERSION = 1
+GLOBAL_ALIGNMENT_BAND = 64 # 行數不一致時，全域對齊所用的對角帶寬 (字元數)
+LINE_ALIGNMENT_BAND = 16 # 逐行對齊時，在兩行長度差之外額外允許的帶寬
+
+
+# --- 逐詞時間軸 (以 array 儲存，避免為每個詞建立物件) ---
+def new_word_timings():
+    """建立空的逐詞時間軸結構：詞文本列表 + 以毫秒為單位的 array('i') 欄位。"""
+    return {
+        'words': [],
+        'start_ms': array('i'),
+        'end_ms': array('i'),
+        'line': array('i'), # 該詞所屬的 _normal.txt 行號 (從 0 開始)
+    }
+
+def collect_word_timings(segments_list, unwanted_phrase=""):
+    """
+    從 faster-whisper 的片段列表收集逐詞時間軸。
+    只收集清理後仍有文本的片段，使 'line' 與 _normal.txt / SRT 的行一一對應。
+    片段需以 word_timestamps=True 轉錄；沒有 words 的片段以整段作為一個詞。
+    """
+    timings = new_word_timings()
+    line_index = 0
+    for segment in segments_list:
+        cleaned_text = segment.text.strip().replace(unwanted_phrase, "").strip() if unwanted_phrase else segment.text.strip()
+        if not cleaned_text:
+            continue
+        segment_words = getattr(segment, 'words', None) or []
+        if segment_words:
+            for word in segment_words:
+                word_text = word.word.strip()
+                if not word_text:
+                    continue
+                timings['words'].append(word_text)
+                timings['start_ms'].append(int(round(word.start * 1000)))
+                timings['end_ms'].append(int(round(word.end * 1000)))
+                timings['line'].append(line_index)
+        else:
+            timings['words'].append(cleaned_text)
+            timings['start_ms'].append(int(round(segment.start * 1000)))
+            timings['end_ms'].append(int(round(segment.end * 1000)))
+            timings['line'].append(line_index)
+        line_index += 1
+    return timings
+
+def word_timings_from_srt_segments(parsed_srt_segments):
+    """
+    當沒有逐詞側檔案時的後備方案：將每個 SRT 片段按字元線性插值為逐字時間軸。
+    parsed_srt_segments: parse_srt_content() 的輸出 (含 'start'/'end'/'text')。
+    """
+    timings = new_word_timings()
+    for line_index, seg in enumerate(parsed_srt_segments):
+        text = "".join(seg['text'].split())
+        if not text:
+            continue
+        start_ms = srt_time_to_ms(seg['start'])
+        end_ms = max(srt_time_to_ms(seg['end']), start_ms)
+        step = (end_ms - start_ms) / len(text)
+        for char_index, char in enumerate(text):
+            timings['words'].append(char)
+            timings['start_ms'].append(start_ms + int(step * char_index))
+            timings['end_ms'].append(start_ms + int(step * (char_index + 1)))
+            timings['line'].append(line_index)
+    return timings
+
+def save_word_timings(path, timings, logger):
+    # 以欄式 (columnar) 緊湊 JSON 寫入，並使用臨時檔案確保原子性
+    temp_path = path + ".tmp"
+    payload = {
+        'version': WORD_TIMINGS_FORMAT_VERSION,
+        'words': timings['words'],
+        'start_ms': timings['start_ms'].tolist(),
+        'end_ms': timings['end_ms'].tolist(),
+        'line': timings['line'].tolist(),
+    }
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, path)
+        logger.info(f"逐詞時間軸已成功寫入: {path} ({len(timings['words'])} 個詞)")
+        return True
+    except Exception as e:
+        logger.error(f"寫入逐詞時間軸至 {path} 時發生錯誤: {e}", exc_info=True)
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        return False
+
+def load_word_timings(path, logger):
+    # 載入逐詞時間軸側檔案；不存在或格式不符時返回 None
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+        if payload.get('version') != WORD_TIMINGS_FORMAT_VERSION:
+            logger.warning(f"逐詞時間軸檔案 '{path}' 版本不符 ({payload.get('version')})，將忽略。")
+            return None
+        timings = {
+            'words': list(payload['words']),
+            'start_ms': array('i', payload['start_ms']),
+            'end_ms': array('i', payload['end_ms']),
+            'line': array('i', payload['line']),
+        }
+        if not (len(timings['words']) == len(timings['start_ms']) == len(timings['end_ms']) == len(timings['line'])):
+            logger.warning(f"逐詞時間軸檔案 '{path}' 欄位長度不一致，將忽略。")
+            return None
+        return timings
+    except Exception as e:
+        logger.error(f"載入逐詞時間軸檔案 '{path}' 時發生錯誤: {e}", exc_info=True)
+        return None
+
+
+# --- 字元級編輯距離對齊 ---
+_OP_DIAG, _OP_UP, _OP_LEFT = 0, 1, 2
+
+def _banded_edit_alignment(a, b, band):
+    """
+    在以 (0,0)→(len(b),len(a)) 對角線為中心的帶狀區域內計算 a 與 b 的 Levenshtein 對齊。
+    返回 array('i')：b 中每個字元對應的 a 索引 (匹配或替換)，插入的字元為 -1。
+    時間與空間複雜度為 O(len(b) * band)。
+    """
+    n, m = len(a), len(b)
+    mapping = array('i', [-1]) * m
+    if n == 0 or m == 0:
+        return mapping
+    # 帶寬至少要覆蓋每行中心的位移量，保證相鄰兩行的帶狀區域相連
+    width = max(band, 2 * (-(-n // m)) + 1)
+    inf = n + m + 1
+
+    row_lo = array('i', [0]) * (m + 1)
+    backtrack = [None] * (m + 1)
+
+    hi = min(n, width)
+    prev = list(range(hi + 1))
+    backtrack[0] = bytes([_OP_LEFT]) * (hi + 1)
+    prev_lo, prev_hi = 0, hi
+
+    for i in range(1, m + 1):
+        center = (i * n) // m
+        lo = max(0, center - width)
+        hi = min(n, center + width)
+        cur = [inf] * (hi - lo + 1)
+        ops = bytearray(hi - lo + 1)
+        b_char = b[i - 1]
+        for j in range(lo, hi + 1):
+            best = inf
+            op = _OP_UP
+            if prev_lo <= j <= prev_hi:
+                best = prev[j - prev_lo] + 1
+            if j >= 1 and prev_lo <= j - 1 <= prev_hi:
+                cost = prev[j - 1 - prev_lo] + (0 if a[j - 1] == b_char else 1)
+                if cost <= best:
+                    best = cost
+                    op = _OP_DIAG
+            if j > lo:
+                cost = cur[j - 1 - lo] + 1
+                if cost < best:
+                    best = cost
+                    op = _OP_LEFT
+            cur[j - lo] = best
+            ops[j - lo] = op
+        row_lo[i] = lo
+        backtrack[i] = ops
+        prev, prev_lo, prev_hi = cur, lo, hi
+
+    i, j = m, n
+    while i > 0 and j > 0:
+        op = backtrack[i][j - row_lo[i]]
+        if op == _OP_DIAG:
+            mapping[i - 1] = j - 1
+            i -= 1
+            j -= 1
+        elif op == _OP_UP:
+            i -= 1
+        else:
+            j -= 1
+    return mapping
+
+def align_characters(a, b, band, absorb_length_gap=False):
+    """
+    對齊兩個字元序列，先剝離共同前綴/後綴 (校對通常只改動少數字)，
+    再對剩餘的中段執行帶狀 DP。返回 b 每個字元對應的 a 索引 (-1 表示插入)。
+    absorb_length_gap: 將兩段長度差加入帶寬 (適用於短序列，如單行)，以得到精確對齊。
+    """
+    n, m = len(a), len(b)
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+
+    mapping = array('i', [-1]) * m
+    for k in range(prefix):
+        mapping[k] = k
+    for k in range(suffix):
+        mapping[m - 1 - k] = n - 1 - k
+    core_a, core_b = a[prefix:n - suffix], b[prefix:m - suffix]
+    if absorb_length_gap:
+        band += abs(len(core_a) - len(core_b))
+    core = _banded_edit_alignment(core_a, core_b, band)
+    for k, j in enumerate(core):
+        if j >= 0:
+            mapping[prefix + k] = prefix + j
+    return mapping
+
+def _char_stream(timings, word_indices):
+    # 將指定的詞展開為字元序列 (去除空白)，並記錄每個字元所屬的詞索引
+    chars = []
+    owners = array('i')
+    words = timings['words']
+    for word_index in word_indices:
+        for char in words[word_index]:
+            if not char.isspace():
+                chars.append(char)
+                owners.append(word_index)
+    return "".join(chars), owners
+
+def _line_word_ranges(timings, line_count):
+    # 計算每行對應的詞索引範圍 [start, end)
+    ranges = [[0, 0] for _ in range(line_count)]
+    seen = [False] * line_count
+    for word_index, line_index in enumerate(timings['line']):
+        if 0 <= line_index < line_count:
+            if not seen[line_index]:
+                ranges[line_index][0] = word_index
+                seen[line_index] = True
+            ranges[line_index][1] = word_index + 1
+    return ranges
+
+def align_corrected_lines(timings, corrected_lines, original_line_count=None):
+    """
+    將校對後的每一行映射回原始逐詞時間軸。
+    若行數與原始行數一致，逐行對齊 (每行只與自身的詞比對，總成本近似線性)；
+    否則對整份文本進行全域帶狀對齊。
+    返回 [(start_ms, end_ms, text), ...]，長度與 corrected_lines 相同；
+    完全無法對齊的行以相鄰行的時間插補。
+    """
+    line_count = len(corrected_lines)
+    if original_line_count is None:
+        original_line_count = (max(timings['line']) + 1) if len(timings['line']) else 0
+    spans = [None] * line_count # 每行對應的 (最小詞索引, 最大詞索引)
+
+    if line_count == original_line_count:
+        word_ranges = _line_word_ranges(timings, line_count)
+        for line_index, line_text in enumerate(corrected_lines):
+            word_start, word_end = word_ranges[line_index]
+            if word_end <= word_start:
+                continue
+            original_chars, owners = _char_stream(timings, range(word_start, word_end))
+            corrected_chars = "".join(line_text.split())
+            if not corrected_chars:
+                continue
+            mapping = align_characters(original_chars, corrected_chars, LINE_ALIGNMENT_BAND, absorb_length_gap=True)
+            matched = [owners[j] for j in mapping if j >= 0]
+            if matched:
+                spans[line_index] = (min(matched), max(matched))
+            else:
+                spans[line_index] = (word_start, word_end - 1)
+    else:
+        original_chars, owners = _char_stream(timings, range(len(timings['words'])))
+        corrected_parts = []
+        corrected_owner_lines = array('i')
+        for line_index, line_text in enumerate(corrected_lines):
+            line_chars = "".join(line_text.split())
+            corrected_parts.append(line_chars)
+            corrected_owner_lines.extend([line_index] * len(line_chars))
+        mapping = align_characters(original_chars, "".join(corrected_parts), GLOBAL_ALIGNMENT_BAND)
+        for k, j in enumerate(mapping):
+            if j < 0:
+                continue
+            line_index = corrected_owner_lines[k]
+            word_index = owners[j]
+            span = spans[line_index]
+            if span is None:
+                spans[line_index] = (word_index, word_index)
+            else:
+                spans[line_index] = (min(span[0], word_index), max(span[1], word_index))
+
+    return _spans_to_cues(timings, corrected_lines, spans)
+
+def _spans_to_cues(timings, corrected_lines, spans):
+    # 將詞索引範圍轉換為時間，並保證時間單調不重疊；無法對齊的行在相鄰行之間插補
+    start_ms_arr, end_ms_arr = timings['start_ms'], timings['end_ms']
+    line_count = len(corrected_lines)
+    cues = [None] * line_count
+    previous_end = 0
+    for line_index in range(line_count):
+        span = spans[line_index]
+        if span is None:
+            continue
+        start_ms = max(start_ms_arr[span[0]], previous_end)
+        end_ms = max(end_ms_arr[span[1]], start_ms)
+        cues[line_index] = [start_ms, end_ms, corrected_lines[line_index]]
+        previous_end = end_ms
+
+    # 插補未對齊的行：在前後已知時間之間平均分配
+    line_index = 0
+    total_end = end_ms_arr[-1] if len(end_ms_arr) else 0
+    while line_index < line_count:
+        if cues[line_index] is not None:
+            line_index += 1
+            continue
+        gap_start = line_index
+        while line_index < line_count and cues[line_index] is None:
+            line_index += 1
+        left = cues[gap_start - 1][1] if gap_start > 0 else 0
+        right = cues[line_index][0] if line_index < line_count else max(total_end, left)
+        step = (right - left) / (line_index - gap_start)
+        for k in range(gap_start, line_index):
+            offset = k - gap_start
+            cues[k] = [left + int(step * offset), left + int(step * (offset + 1)), corrected_lines[k]]
+    return [tuple(cue) for cue in cues]
+
+
+# --- SRT 輸出 ---
+def srt_time_to_ms(time_str):
+    """將 SRT 格式的時間字串 (HH:MM:SS,ms) 轉換為毫秒。"""
+    hms, _, ms = time_str.strip().partition(',')
+    hours, minutes, seconds = hms.split(':')
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(ms or 0)
+
+def format_srt_time_ms(total_ms):
+    """將毫秒格式化為 SRT 格式的時間字串 (HH:MM:SS,ms)"""
+    total_ms = max(0, int(total_ms))
+    hours, remainder = divmod(total_ms, 3600000)
+    minutes, remainder = divmod(remainder, 60000)
+    seconds, milliseconds = divmod(remainder, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+def build_srt_content(cues):
+    """由 [(start_ms, end_ms, text), ...] 生成 SRT 內容；跳過空文本。"""
+    srt_parts = []
+    srt_sequence_number = 1
+    for start_ms, end_ms, text in cues:
+        text = text.strip()
+        if not text:
+            continue
+        srt_parts.append(f"{srt_sequence_number}\n{format_srt_time_ms(start_ms)} --> {format_srt_time_ms(end_ms)}\n{text}\n\n")
+        srt_sequence_number += 1
+    return "".join(srt_parts)
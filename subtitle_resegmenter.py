@@ -0,0 +1,156 @@
+from subtitle_alignment import new_word_timings
+
+# --- 配置變數 (可讀性目標，參考常見中文字幕規範) ---
+MAX_CHARS_PER_LINE = 16 # 每條字幕最大字數 (不含空白)
+MAX_CHARS_PER_SECOND = 9.0 # 目標閱讀速度上限；超出時盡量延長顯示時間
+MIN_CUE_DURATION_MS = 1000 # 每條字幕最短顯示時間
+MAX_CUE_DURATION_MS = 7000 # 每條字幕最長時間，超過則強制斷開
+MIN_CUE_CHARS = 6 # 字數少於此值的字幕會嘗試與下一個片段合併
+MAX_MERGE_GAP_MS = 1200 # 停頓超過此值時一律斷開，不跨越停頓合併
+MIN_CUE_GAP_MS = 80 # 延長顯示時間時，與下一條字幕之間保留的最小間隔
+
+
+def _visible_len(text):
+    return len(text) - text.count(' ')
+
+def _is_cjk(char):
+    # 中日韓文字及全形標點，這些字元之間不加空格
+    return ('\u3000' <= char <= '\u303f' or '\u3400' <= char <= '\u9fff'
+            or '\uf900' <= char <= '\ufaff' or '\uff00' <= char <= '\uffef')
+
+def _can_split_at(text, position):
+    # 在空白處、或任一側為中日韓字元處斷開；兩側都是其他文字 (例如英文單詞內部) 時不斷開
+    before, after = text[position - 1], text[position]
+    return before.isspace() or after.isspace() or _is_cjk(before) or _is_cjk(after)
+
+def _piece_boundaries(text, piece_count):
+    """
+    返回將 text 大致均分為 piece_count 段的斷點 [0, ..., len(text)]。
+    每個斷點取離均分位置最近、且不切開非中日韓單詞的位置；找不到時省略該斷點 (該段保持完整)。
+    """
+    text_len = len(text)
+    cuts = [0]
+    for piece_index in range(1, piece_count):
+        target = (text_len * piece_index) // piece_count
+        for distance in range(text_len):
+            candidates = [position for position in (target - distance, target + distance)
+                          if cuts[-1] < position < text_len and _can_split_at(text, position)]
+            if candidates:
+                cuts.append(candidates[0])
+                break
+            if target - distance <= cuts[-1] and target + distance >= text_len:
+                break
+    cuts.append(text_len)
+    return cuts
+
+def _join_units(units):
+    """
+    拼接斷句單位的文本。同一片段內的單位原樣拼接 (逐詞時間軸的詞自帶前導空格，按字數切開的片段是連續子串)；
+    不同片段之間若兩側都不是中日韓字元且都沒有空白，則補一個空格，避免英文等語言的單詞連在一起。
+    """
+    text = ""
+    previous_segment_index = None
+    for unit_text, _, _, segment_index in units:
+        if (text and unit_text and segment_index != previous_segment_index
+                and not text[-1].isspace() and not unit_text[0].isspace()
+                and not _is_cjk(text[-1]) and not _is_cjk(unit_text[0])):
+            text += " "
+        text += unit_text
+        previous_segment_index = segment_index
+    return text
+
+def _segment_units(segments_list, unwanted_phrase, max_chars):
+    """
+    將片段展開為斷句單位 (text, start_ms, end_ms, segment_index)。
+    有逐詞時間軸時以詞為單位；否則將過長的片段按字數大致均分為若干段 (非中日韓文字只在空白處斷開)，
+    時間按字元線性插值。
+    """
+    for segment_index, segment in enumerate(segments_list):
+        cleaned_text = segment.text.strip()
+        if unwanted_phrase:
+            cleaned_text = cleaned_text.replace(unwanted_phrase, "").strip()
+        if not cleaned_text:
+            continue
+        segment_words = getattr(segment, 'words', None) or []
+        if segment_words:
+            for word in segment_words:
+                if word.word.strip():
+                    yield word.word, int(round(word.start * 1000)), int(round(word.end * 1000)), segment_index
+            continue
+
+        start_ms = int(round(segment.start * 1000))
+        end_ms = max(int(round(segment.end * 1000)), start_ms)
+        text_len = len(cleaned_text)
+        piece_count = -(-_visible_len(cleaned_text) // max_chars)
+        if piece_count <= 1:
+            yield cleaned_text, start_ms, end_ms, segment_index
+            continue
+        ms_per_char = (end_ms - start_ms) / text_len
+        boundaries = _piece_boundaries(cleaned_text, piece_count)
+        for piece_start, piece_end in zip(boundaries, boundaries[1:]):
+            yield (cleaned_text[piece_start:piece_end],
+                   start_ms + int(ms_per_char * piece_start),
+                   start_ms + int(ms_per_char * piece_end),
+                   segment_index)
+
+def resegment_cues(segments_list, unwanted_phrase="",
+                   max_chars=MAX_CHARS_PER_LINE, max_cps=MAX_CHARS_PER_SECOND,
+                   min_duration_ms=MIN_CUE_DURATION_MS, max_duration_ms=MAX_CUE_DURATION_MS):
+    """
+    以單次線性掃描重新切分字幕：合併過短/過碎的片段、拆分過長的片段，
+    並在不與下一條重疊的前提下延長顯示時間，以滿足最短時長與閱讀速度 (CPS) 目標。
+    返回 (cues, word_timings)：
+        cues: [(start_ms, end_ms, text), ...]
+        word_timings: 與 subtitle_alignment 相同結構的逐詞時間軸，'line' 為 cue 的索引。
+    """
+    cues = []
+    word_timings = new_word_timings()
+    current_units = []
+    current_chars = 0
+
+    def close_current():
+        nonlocal current_units, current_chars
+        if not current_units:
+            return
+        text = _join_units(current_units).strip()
+        if unwanted_phrase:
+            text = text.replace(unwanted_phrase, "").strip()
+        if text:
+            line_index = len(cues)
+            cues.append([current_units[0][1], current_units[-1][2], text])
+            for unit_text, unit_start, unit_end, _ in current_units:
+                word_timings['words'].append(unit_text.strip())
+                word_timings['start_ms'].append(unit_start)
+                word_timings['end_ms'].append(unit_end)
+                word_timings['line'].append(line_index)
+        current_units = []
+        current_chars = 0
+
+    for unit in _segment_units(segments_list, unwanted_phrase, max_chars):
+        unit_text, unit_start, unit_end, segment_index = unit
+        unit_chars = _visible_len(unit_text.strip())
+        if current_units:
+            cue_start = current_units[0][1]
+            cue_end = current_units[-1][2]
+            gap_ms = unit_start - cue_end
+            new_segment = segment_index != current_units[-1][3]
+            cue_is_readable = current_chars >= MIN_CUE_CHARS and cue_end - cue_start >= min_duration_ms
+            if (current_chars + unit_chars > max_chars
+                    or unit_end - cue_start > max_duration_ms
+                    or gap_ms > MAX_MERGE_GAP_MS
+                    or (new_segment and cue_is_readable)):
+                close_current()
+        current_units.append(unit)
+        current_chars += unit_chars
+    close_current()
+
+    # 延長顯示時間 (不跨越下一條的開始時間)：滿足最短時長與 CPS 上限
+    for cue_index, cue in enumerate(cues):
+        start_ms, end_ms, text = cue
+        wanted_duration = max(min_duration_ms, int(_visible_len(text) * 1000 / max_cps))
+        if end_ms - start_ms >= wanted_duration:
+            continue
+        limit = cues[cue_index + 1][0] - MIN_CUE_GAP_MS if cue_index + 1 < len(cues) else start_ms + wanted_duration
+        cue[1] = max(end_ms, min(start_ms + wanted_duration, limit))
+
+    return [tuple(cue) for cue in cues], word_timings
@@ -1,9 +1,9 @@
 import os
-import gspread
-from google.auth import default
-from google.colab import auth, drive
 import datetime
 import math # For math.ceil
+import run_metrics
+import runtime_env
+# gspread and google.colab are imported lazily (Colab-only pieces go through runtime_env)
 
 # --- Configuration ---
 OUTPUT_ROOT_DIR = "/content/drive/MyDrive/output_transcriptions"
@@ -37,15 +37,23 @@ def seconds_to_srt_time(total_seconds):
     milliseconds = int((secs_float - seconds) * 1000)
     return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
 
+class _PrintLogger:
+    """Minimal logger facade for runtime_env calls; this script reports through print."""
+    def info(self, message):
+        print(message)
+    warning = error = info
+
+
 def authenticate():
-    """Handles Google Colab authentication for Drive and Sheets."""
-    print("Authenticating for Google Drive and Sheets...")
+    """Handles authentication for Drive and Sheets through the runtime environment (Colab, service account or local)."""
+    environment = runtime_env.get_environment()
+    print(f"Authenticating for Google Drive and Sheets (environment: {environment.name})...")
     try:
-        auth.authenticate_user()
-        creds, _ = default()
-        gc = gspread.authorize(creds)
-        drive.mount('/content/drive', force_remount=True)
-        print("Authentication successful and Google Drive mounted.")
+        gc = environment.authorize_gspread(_PrintLogger())
+        if environment.mount_drive('/content/drive', _PrintLogger()):
+            print("Authentication successful and Google Drive mounted.")
+        else:
+            print("Authentication successful.")
         return gc
     except Exception as e:
         print(f"Error during authentication or mounting Google Drive: {e}")
@@ -69,7 +77,8 @@ def main():
              return
         print(f"No input given, using default spreadsheet name: '{SPREADSHEET_NAME}'")
 
-    gc = authenticate()
+    with run_metrics.stage('auth_mount'):
+        gc = authenticate()
     if not gc:
         print("Exiting due to authentication failure.")
         return
@@ -95,6 +104,7 @@ def main():
     print(f"All output for this run will be saved in: {output_spreadsheet_dir}")
 
     # --- Open Spreadsheet and Access Worksheets ---
+    import gspread
     try:
         print(f"Attempting to open spreadsheet: '{SPREADSHEET_NAME}'...")
         spreadsheet = gc.open(SPREADSHEET_NAME)
@@ -124,7 +134,8 @@ def main():
     # --- Extract Data ---
     try:
         print("Reading data from '文本校對' worksheet...")
-        text_rows = text_worksheet.get_all_values()
+        with run_metrics.stage('sheets.read'):
+            text_rows = text_worksheet.get_all_values()
         if not text_rows or len(text_rows) <= 1: # Assuming header row
             print(f"Worksheet '{text_ws_title}' is empty or has no data beyond headers.")
             return
@@ -133,7 +144,8 @@ def main():
         print(f"Extracted {len(corrected_texts)} text entries from '{text_ws_title}'.")
 
         print("Reading data from '時間軸' worksheet...")
-        timeline_rows = timeline_worksheet.get_all_values()
+        with run_metrics.stage('sheets.read'):
+            timeline_rows = timeline_worksheet.get_all_values()
         if not timeline_rows or len(timeline_rows) <= 1: # Assuming header row
             print(f"Worksheet '{timeline_ws_title}' is empty or has no data beyond headers.")
             return
@@ -213,7 +225,7 @@ def main():
             header_line2 = f"{seconds_to_srt_time(current_part_first_item_actual_start_seconds)} --> {seconds_to_srt_time(min(actual_part_end_time_seconds, current_part_target_end_seconds, total_audio_duration_seconds))}"
 
             try:
-                with open(txt_filename, 'w', encoding='utf-8') as f:
+                with run_metrics.stage('drive_write'), open(txt_filename, 'w', encoding='utf-8') as f:
                     f.write(header_line1 + "\n")
                     f.write(header_line2 + "\n\n")
                     f.write("\n".join(current_part_texts))
@@ -241,7 +253,7 @@ def main():
         header_line2 = f"{seconds_to_srt_time(current_part_first_item_actual_start_seconds if current_part_first_item_actual_start_seconds != -1.0 else 0.0)} --> {seconds_to_srt_time(min(actual_part_end_time_seconds, total_audio_duration_seconds))}"
 
         try:
-            with open(txt_filename, 'w', encoding='utf-8') as f:
+            with run_metrics.stage('drive_write'), open(txt_filename, 'w', encoding='utf-8') as f:
                 f.write(header_line1 + "\n")
                 f.write(header_line2 + "\n\n")
                 f.write("\n".join(current_part_texts))
@@ -253,4 +265,7 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        run_metrics.export('text_segmenter_colab')
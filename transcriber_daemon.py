@@ -0,0 +1,321 @@
+"""
+監視資料夾的常駐轉錄服務：模型只載入一次，持續監視 INPUT_AUDIO_DIR 並轉錄新檔案。
+
+本地磁碟使用 inotify；Google Drive 等 FUSE 掛載點上 inotify 收不到遠端變更，
+因此自動改用 mtime/大小輪詢。檔案大小與修改時間穩定一段時間後才會排入佇列，
+佇列按優先級處理。Drive 重新掛載與模型重新載入每天只進行一次。
+
+用法:
+    python transcriber_daemon.py [--prompt "初始提示詞"]
+"""
+import os
+import sys
+import time
+import heapq
+import errno
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import argparse
+
+import local_transcriber
+import run_metrics
+from job_specs import load_job_manifest, resolve_job_spec, measure_language_detection_seconds
+from hallucination_filter import load_phrases
+
+# --- 配置變數 ---
+POLL_INTERVAL_SECONDS = 10 # 輪詢模式 (FUSE) 的掃描間隔；inotify 模式下為最長等待時間
+FILE_STABLE_SECONDS = 30 # 檔案大小與 mtime 持續不變多久後才視為上傳完成
+DAILY_MAINTENANCE_SECONDS = 24 * 60 * 60 # Drive 重新掛載與模型重新載入的間隔
+URGENT_FILENAME_PREFIX = "urgent_" # 以此前綴命名的檔案優先處理
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 10
+FAILED_RETRY_BASE_SECONDS = 60 # 轉錄失敗後的重試等待: 60、120、240 秒... (檔案內容變化時立即重置)
+FAILED_RETRY_MAX_SECONDS = 6 * 60 * 60
+
+# inotify 常量 (見 <sys/inotify.h>)
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = 0o4000
+_INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_fuse_mount(path):
+    """根據 /proc/mounts 判斷路徑所在掛載點是否為 FUSE (例如 Colab 的 Google Drive)。"""
+    try:
+        real_path = os.path.realpath(path)
+        best_mount, best_fstype = "", ""
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                if (real_path == mount_point or real_path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > len(best_mount):
+                    best_mount, best_fstype = mount_point, fields[2]
+        return best_fstype.startswith('fuse')
+    except OSError:
+        return False
+
+
+class InotifyWatcher:
+    """以 ctypes 調用 libc 的 inotify，監視單個目錄中新寫入/移入的檔案。"""
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError(errno.ENOSYS, "找不到 libc，無法使用 inotify")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失敗")
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_MODIFY
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            error_number = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error_number, f"inotify_add_watch 失敗: {directory}")
+
+    def wait(self, timeout):
+        """等待事件，返回有變動的檔案名集合 (超時返回空集合)。"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset + _INOTIFY_EVENT_HEADER.size <= len(data):
+            _, _, _, name_length = _INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+def file_priority(file_name):
+    return PRIORITY_URGENT if file_name.startswith(URGENT_FILENAME_PREFIX) else PRIORITY_NORMAL
+
+
+class WatchFolderDaemon:
+    """
+    常駐轉錄服務的狀態：已載入的模型、已處理集合、待穩定的候選檔案以及優先級佇列。
+    """
+
+    def __init__(self, logger, initial_prompt, input_dir=None):
+        self.logger = logger
+        self.initial_prompt = initial_prompt
+        self.input_dir = input_dir or local_transcriber.INPUT_AUDIO_DIR
+        self.model = None
+        self.model_loaded_at = 0.0
+        self.language_detection_seconds = None
+        self.hallucination_phrases = None
+        self.processed_files = set()
+        self.candidates = {} # 檔案名 -> (大小, mtime, 首次觀察到該大小/mtime 的時間)
+        self.queue = [] # (優先級, mtime, 檔案名)
+        self.queued = set()
+        self.failed = {} # 檔案名 -> (大小, mtime, 下次重試的 time.time() 時間戳, 失敗次數)；也用於其他工作者持有租約的檔案
+        self.watcher = None
+        self.stopping = False
+
+    # --- 生命週期 ---
+    def request_stop(self, *_):
+        self.logger.info("收到停止信號，將在當前檔案完成後退出。")
+        self.stopping = True
+
+    def daily_maintenance(self):
+        """重新掛載 Drive 並 (重新) 載入模型；每天最多一次，只在佇列空閒時調用。"""
+        self.logger.info("執行每日維護：重新掛載 Google Drive 並載入模型。")
+        if self.model is not None:
+            # 每天輸出一次當天的指標並清空 (JSON 檔案名以運行/清空時間為時間戳，每天一個檔案)；寫入失敗時保留，累計到下一次
+            if run_metrics.export('transcriber_daemon', self.logger) is not None:
+                run_metrics.reset()
+        uploader = local_transcriber.get_output_uploader(self.logger)
+        if uploader is not None:
+            uploader.wait() # 重新掛載前先完成背景上傳
+        if not local_transcriber.mount_google_drive(self.logger):
+            return False
+        self.model = None # 先釋放舊模型佔用的顯存
+        self.model = local_transcriber.load_whisper_model(self.logger)
+        if self.model is None:
+            return False
+        self.model_loaded_at = time.monotonic()
+        if local_transcriber.LANGUAGE_DETECTION_CALIBRATION:
+            self.language_detection_seconds = measure_language_detection_seconds(self.model, self.logger)
+        if local_transcriber.HALLUCINATION_FILTER:
+            self.hallucination_phrases = load_phrases(local_transcriber.HALLUCINATION_PHRASES_FILE, self.logger) # 每日維護時重新讀取
+        self.processed_files = local_transcriber.load_processed_files(local_transcriber.STATE_FILE_PATH, self.logger)
+        if uploader is not None:
+            uploader.recover(local_transcriber.LOCAL_STAGING_DIR, local_transcriber.OUTPUT_TRANSCRIPTIONS_ROOT_DIR, self.processed_files,
+                             lambda audio_file_name, uploaded: local_transcriber.record_recovered_upload(audio_file_name, uploaded, self.logger))
+        self._start_watcher()
+        self.scan_directory() # 掛載期間可能錯過事件，完整掃描一次
+        return True
+
+    def _start_watcher(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        if is_fuse_mount(self.input_dir):
+            self.logger.info(f"'{self.input_dir}' 位於 FUSE 掛載點，使用 mtime 輪詢 (每 {POLL_INTERVAL_SECONDS} 秒)。")
+            return
+        try:
+            self.watcher = InotifyWatcher(self.input_dir)
+            self.logger.info(f"已使用 inotify 監視 '{self.input_dir}'。")
+        except OSError as e:
+            self.logger.warning(f"無法使用 inotify 監視 '{self.input_dir}' ({e})，改用 mtime 輪詢。")
+
+    # --- 監視與穩定性檢查 ---
+    def scan_directory(self):
+        # 單次 scandir 掃描，將未處理的音頻檔案加入候選
+        try:
+            with os.scandir(self.input_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and local_transcriber.is_audio_file(entry.name):
+                        self.observe(entry.name)
+        except OSError as e:
+            self.logger.error(f"掃描輸入目錄 '{self.input_dir}' 時發生錯誤: {e}", exc_info=True)
+
+    def is_uploading(self, file_name):
+        uploader = local_transcriber.get_output_uploader(self.logger)
+        return uploader is not None and uploader.is_pending(file_name)
+
+    def observe(self, file_name):
+        if file_name in self.processed_files or file_name in self.queued or self.is_uploading(file_name):
+            return
+        try:
+            stat_result = os.stat(os.path.join(self.input_dir, file_name))
+        except FileNotFoundError:
+            self.candidates.pop(file_name, None)
+            return
+        signature = (stat_result.st_size, stat_result.st_mtime)
+        failure = self.failed.get(file_name)
+        if failure is not None:
+            if failure[:2] != signature:
+                del self.failed[file_name] # 檔案已被替換或修改，按新檔案處理
+            elif time.time() < failure[2]:
+                return # 退避期間或其他工作者的租約尚未過期
+        previous = self.candidates.get(file_name)
+        if previous is None or previous[:2] != signature:
+            self.candidates[file_name] = (signature[0], signature[1], time.monotonic())
+
+    def promote_stable_files(self):
+        # 大小與 mtime 在 FILE_STABLE_SECONDS 內未變化的候選檔案才排入佇列
+        now = time.monotonic()
+        for file_name, (size, mtime, since) in list(self.candidates.items()):
+            self.observe(file_name) # 重新 stat，若有變化會重置計時
+            current = self.candidates.get(file_name)
+            if current is None or current[2] != since:
+                continue
+            if size > 0 and now - since >= FILE_STABLE_SECONDS:
+                del self.candidates[file_name]
+                heapq.heappush(self.queue, (file_priority(file_name), mtime, file_name))
+                self.queued.add(file_name)
+                self.logger.info(f"檔案 '{file_name}' 已穩定 ({size} 位元組)，已加入佇列 (優先級 {file_priority(file_name)}，佇列長度 {len(self.queue)})。")
+
+    def retry_failed_files(self):
+        # inotify 模式下未變化的檔案不會產生事件，退避到期後主動重新觀察
+        now = time.time()
+        for file_name, (_, _, retry_at, _) in list(self.failed.items()):
+            if retry_at <= now and file_name not in self.candidates:
+                self.observe(file_name)
+
+    def record_result(self, file_name, success):
+        """根據轉錄結果更新 failed：成功時清除；被其他工作者持有時等待其租約過期；否則按指數退避安排重試。"""
+        if success or file_name in self.processed_files:
+            self.failed.pop(file_name, None)
+            return
+        try:
+            stat_result = os.stat(os.path.join(self.input_dir, file_name))
+        except FileNotFoundError:
+            self.failed.pop(file_name, None)
+            return
+        previous = self.failed.get(file_name)
+        work_queue = local_transcriber.get_work_queue(self.logger)
+        held_until = work_queue.held_until(file_name) if work_queue is not None else None
+        if held_until is not None and held_until > time.time():
+            attempts = previous[3] if previous else 0
+            retry_at = held_until
+            self.logger.info(f"'{file_name}' 正由其他工作者處理，在其租約過期或檔案變化前不再嘗試。")
+        else:
+            attempts = (previous[3] if previous else 0) + 1
+            delay = min(FAILED_RETRY_BASE_SECONDS * (2 ** (attempts - 1)), FAILED_RETRY_MAX_SECONDS)
+            retry_at = time.time() + delay
+            run_metrics.increment('daemon.failed_files')
+            self.logger.warning(f"'{file_name}' 轉錄失敗 (第 {attempts} 次)，將在 {delay} 秒後重試 (檔案變化時立即重試)。")
+        self.failed[file_name] = (stat_result.st_size, stat_result.st_mtime, retry_at, attempts)
+
+    def wait_for_changes(self, timeout):
+        if self.watcher is not None:
+            for file_name in self.watcher.wait(timeout):
+                if local_transcriber.is_audio_file(file_name):
+                    self.observe(file_name)
+        else:
+            time.sleep(timeout)
+            self.scan_directory()
+
+    # --- 主循環 ---
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        if not self.daily_maintenance():
+            self.logger.critical("初始化失敗 (Drive 掛載或模型載入)，常駐服務無法啟動。")
+            return 1
+
+        while not self.stopping:
+            if self.queue:
+                _, _, file_name = heapq.heappop(self.queue)
+                self.queued.discard(file_name)
+                if file_name not in self.processed_files and not self.is_uploading(file_name) and os.path.exists(os.path.join(self.input_dir, file_name)):
+                    # 每個檔案重新讀取清單，使常駐期間修改的任務設定立即生效
+                    manifest = load_job_manifest(self.input_dir, self.logger)
+                    job_spec = resolve_job_spec(file_name, self.input_dir, manifest, self.initial_prompt, self.logger)
+                    success = local_transcriber.transcribe_audio_file(self.model, file_name, job_spec, self.processed_files,
+                                                                      self.logger, self.language_detection_seconds, self.hallucination_phrases)
+                    self.record_result(file_name, success)
+                continue
+
+            if time.monotonic() - self.model_loaded_at >= DAILY_MAINTENANCE_SECONDS:
+                if not self.daily_maintenance():
+                    self.logger.error(f"每日維護失敗，將在 {POLL_INTERVAL_SECONDS} 秒後重試。")
+                    time.sleep(POLL_INTERVAL_SECONDS)
+                    continue
+
+            # 有候選檔案等待穩定時縮短等待時間
+            timeout = min(POLL_INTERVAL_SECONDS, FILE_STABLE_SECONDS / 3) if self.candidates else POLL_INTERVAL_SECONDS
+            self.wait_for_changes(timeout)
+            self.retry_failed_files()
+            self.promote_stable_files()
+
+        if self.watcher is not None:
+            self.watcher.close()
+        local_transcriber.close_output_uploader()
+        local_transcriber.close_work_queue()
+        run_metrics.export('transcriber_daemon', self.logger)
+        self.logger.info("常駐轉錄服務已停止。")
+        return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="監視資料夾並持續轉錄新音頻檔案")
+    parser.add_argument('--prompt', default=local_transcriber.DEFAULT_INITIAL_PROMPT, help="Whisper 初始提示詞")
+    args = parser.parse_args(argv)
+
+    logger = local_transcriber.setup_logger()
+    logger.info("transcriber_daemon.py 常駐服務已啟動。")
+    logger.info(f"將使用以下初始提示詞進行轉錄: '{args.prompt}'")
+    return WatchFolderDaemon(logger, args.prompt).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
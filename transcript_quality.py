@@ -0,0 +1,54 @@
+"""
+轉錄品質比較：字元錯誤率 (CER) 與詞錯誤率 (WER)。
+
+用於比較兩種解碼方式 (例如批次推理與逐窗口推理) 的輸出，以其中一份作為參考。
+比較前移除空白與標點並將英文轉為小寫；中日韓文字每個字元算一個詞，其他文字按連續的字母或數字分詞。
+"""
+import re
+
+_WORD_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[^\W\d_\u3400-\u9fff\uf900-\ufaff]+|\d+")
+
+
+def normalize_characters(text):
+    """只保留字母與數字 (含漢字)，英文轉小寫。"""
+    return [char for char in text.lower() if char.isalnum()]
+
+def tokenize_words(text):
+    return _WORD_PATTERN.findall(text.lower())
+
+def word_spans(text):
+    """與 tokenize_words 相同的分詞，返回 [(詞, 起始位置, 結束位置)] (位置對應原文)。"""
+    return [(match.group(), match.start(), match.end()) for match in _WORD_PATTERN.finditer(text.lower())]
+
+def edit_distance(reference, hypothesis):
+    """兩個序列之間的 Levenshtein 距離 (替換、插入、刪除各計 1)，O(len(reference) * len(hypothesis))。"""
+    if len(reference) < len(hypothesis):
+        reference, hypothesis = hypothesis, reference
+    previous = list(range(len(hypothesis) + 1))
+    for i, reference_item in enumerate(reference, start=1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hypothesis_item in enumerate(hypothesis, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (reference_item != hypothesis_item))
+        previous = current
+    return previous[-1]
+
+def _error_rate(reference_items, hypothesis_items):
+    if not reference_items:
+        return 0.0 if not hypothesis_items else 1.0
+    return edit_distance(reference_items, hypothesis_items) / len(reference_items)
+
+def character_error_rate(reference, hypothesis):
+    return _error_rate(normalize_characters(reference), normalize_characters(hypothesis))
+
+def word_error_rate(reference, hypothesis):
+    return _error_rate(tokenize_words(reference), tokenize_words(hypothesis))
+
+def compare_transcripts(reference, hypothesis):
+    """返回 {'cer', 'wer', 'reference_chars', 'reference_words'}。"""
+    return {
+        'cer': character_error_rate(reference, hypothesis),
+        'wer': word_error_rate(reference, hypothesis),
+        'reference_chars': len(normalize_characters(reference)),
+        'reference_words': len(tokenize_words(reference)),
+    }
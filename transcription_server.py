@@ -0,0 +1,295 @@
+"""
+常駐 Whisper 模型服務：在一個進程中保持一個或多個已載入的模型，
+透過 Unix socket 接受轉錄任務並以串流方式返回片段，讓短音頻的延遲只取決於推理本身。
+
+協議：每行一個 JSON 物件 (UTF-8)。
+    請求 {"op": "transcribe", "audio_path": ..., "model": "large-v3", "options": {...}}
+        -> {"type": "accepted", "job_id": ..., "queue_position": n}
+        -> {"type": "info", "language": ..., "language_probability": ..., "duration": ...}
+        -> {"type": "segment", "start": ..., "end": ..., "text": ..., ...} (每個片段一行)
+        -> {"type": "done", "segments": n, "elapsed": 秒}  或  {"type": "error", "message": ...}
+    請求 {"op": "status"} -> {"type": "status", "models": [...],
+                             "workers": {模型: {"running": {...}, "queued": [...], "completed": n}}}
+
+用法:
+    python transcription_server.py [--socket PATH] [--model large-v3 --model medium]
+"""
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import itertools
+import threading
+import socketserver
+from types import SimpleNamespace
+
+# 客戶端可傳入的 model.transcribe 參數白名單
+ALLOWED_TRANSCRIBE_OPTIONS = (
+    'beam_size', 'initial_prompt', 'language', 'vad_filter', 'vad_parameters', 'word_timestamps',
+    'temperature', 'condition_on_previous_text', 'compression_ratio_threshold', 'log_prob_threshold',
+    'no_speech_threshold', 'clip_timestamps', 'without_timestamps',
+)
+CLIENT_CONNECT_TIMEOUT_SECONDS = 2.0
+
+
+# --- 片段序列化 ---
+def segment_to_message(segment):
+    words = getattr(segment, 'words', None)
+    return {
+        'type': 'segment',
+        'start': segment.start,
+        'end': segment.end,
+        'text': segment.text,
+        'avg_logprob': getattr(segment, 'avg_logprob', None),
+        'compression_ratio': getattr(segment, 'compression_ratio', None),
+        'no_speech_prob': getattr(segment, 'no_speech_prob', None),
+        'words': [[word.word, word.start, word.end] for word in words] if words else None,
+    }
+
+def segment_from_message(message):
+    words = message.get('words')
+    return SimpleNamespace(
+        start=message['start'],
+        end=message['end'],
+        text=message['text'],
+        avg_logprob=message.get('avg_logprob'),
+        compression_ratio=message.get('compression_ratio'),
+        no_speech_prob=message.get('no_speech_prob'),
+        words=[SimpleNamespace(word=w, start=s, end=e) for w, s, e in words] if words else None,
+    )
+
+def _send(stream, message):
+    stream.write((json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8'))
+    stream.flush()
+
+
+# --- 服務端 ---
+class ModelWorker:
+    """每個已載入的模型一個工作線程，依序從佇列取出任務執行 (同一模型上的推理串行化)。"""
+
+    def __init__(self, model_size, model, logger):
+        self.model_size = model_size
+        self.model = model
+        self.logger = logger
+        self.jobs = queue.Queue()
+        self.pending = [] # 用於狀態查詢的佇列快照
+        self.running = None
+        self.completed = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, name=f"whisper-{model_size}", daemon=True).start()
+
+    def submit(self, job):
+        with self.lock:
+            self.pending.append(job)
+            position = len(self.pending)
+        self.jobs.put(job)
+        return position
+
+    def status(self):
+        with self.lock:
+            return {
+                'running': self.running and self.running['summary'],
+                'queued': [job['summary'] for job in self.pending],
+                'completed': self.completed,
+            }
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.pending.remove(job)
+                self.running = job
+            events = job['events']
+            started = time.perf_counter()
+            try:
+                segments, info = self.model.transcribe(job['audio_path'], **job['options'])
+                events.put({'type': 'info', 'language': info.language,
+                            'language_probability': info.language_probability,
+                            'duration': getattr(info, 'duration', None)})
+                segment_count = 0
+                for segment in segments:
+                    events.put(segment_to_message(segment))
+                    segment_count += 1
+                events.put({'type': 'done', 'segments': segment_count, 'elapsed': time.perf_counter() - started})
+                self.logger.info(f"任務 {job['job_id']} 完成 ({segment_count} 片段，{time.perf_counter() - started:.1f} 秒): {job['audio_path']}")
+            except Exception as e:
+                self.logger.error(f"任務 {job['job_id']} 轉錄失敗: {e}", exc_info=True)
+                events.put({'type': 'error', 'message': str(e)})
+            finally:
+                with self.lock:
+                    self.running = None
+                    self.completed += 1
+
+
+class TranscriptionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers, logger):
+        self.workers = workers
+        self.logger = logger
+        self.job_ids = itertools.count(1)
+        if os.path.exists(socket_path):
+            os.remove(socket_path) # 清理上次異常退出遺留的 socket 檔案
+        super().__init__(socket_path, TranscriptionRequestHandler)
+
+
+class TranscriptionRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        for raw_line in self.rfile:
+            try:
+                request = json.loads(raw_line.decode('utf-8'))
+            except ValueError:
+                _send(self.wfile, {'type': 'error', 'message': "無效的 JSON 請求"})
+                continue
+            op = request.get('op')
+            if op == 'status':
+                _send(self.wfile, {'type': 'status', 'models': list(server.workers),
+                                   'workers': {name: worker.status() for name, worker in server.workers.items()}})
+            elif op == 'transcribe':
+                self._handle_transcribe(request)
+            else:
+                _send(self.wfile, {'type': 'error', 'message': f"未知的操作: {op}"})
+
+    def _handle_transcribe(self, request):
+        server = self.server
+        model_name = request.get('model') or next(iter(server.workers))
+        worker = server.workers.get(model_name)
+        if worker is None:
+            _send(self.wfile, {'type': 'error', 'message': f"模型 '{model_name}' 未載入。可用模型: {list(server.workers)}"})
+            return
+        audio_path = request.get('audio_path')
+        if not audio_path or not os.path.exists(audio_path):
+            _send(self.wfile, {'type': 'error', 'message': f"音頻檔案不存在: {audio_path}"})
+            return
+        options = {key: value for key, value in (request.get('options') or {}).items() if key in ALLOWED_TRANSCRIBE_OPTIONS}
+        job_id = next(server.job_ids)
+        job = {
+            'job_id': job_id,
+            'audio_path': audio_path,
+            'options': options,
+            'events': queue.Queue(),
+            'summary': {'job_id': job_id, 'audio_path': audio_path, 'model': model_name, 'submitted_at': time.time()},
+        }
+        position = worker.submit(job)
+        server.logger.info(f"已接受任務 {job_id} (模型 {model_name}，佇列位置 {position}): {audio_path}")
+        _send(self.wfile, {'type': 'accepted', 'job_id': job_id, 'queue_position': position})
+        while True:
+            event = job['events'].get()
+            _send(self.wfile, event)
+            if event['type'] in ('done', 'error'):
+                return
+
+
+def serve(socket_path, model_sizes, logger):
+    from local_transcriber import load_local_whisper_model
+    workers = {}
+    for model_size in model_sizes:
+        model = load_local_whisper_model(logger, model_size)
+        if model is None:
+            return 1
+        workers[model_size] = ModelWorker(model_size, model, logger)
+    with TranscriptionServer(socket_path, workers, logger) as server:
+        logger.info(f"常駐模型服務已在 '{socket_path}' 上監聽，已載入模型: {', '.join(workers)}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("收到中斷信號，正在停止服務...")
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+    return 0
+
+
+# --- 客戶端 ---
+class RemoteWhisperModel:
+    """
+    常駐模型服務的客戶端，提供與 faster_whisper.WhisperModel.transcribe 相同的調用方式：
+    返回 (片段生成器, info)，片段在服務端產生時即串流返回。
+    """
+
+    def __init__(self, socket_path, model_size=None):
+        self.socket_path = socket_path
+        self.model_size = model_size
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CLIENT_CONNECT_TIMEOUT_SECONDS)
+        sock.connect(self.socket_path)
+        sock.settimeout(None) # 長音頻可能排隊較久，連線後不設超時
+        return sock
+
+    def status(self):
+        with self._connect() as sock, sock.makefile('rwb') as stream:
+            _send(stream, {'op': 'status'})
+            return json.loads(stream.readline().decode('utf-8'))
+
+    def transcribe(self, audio_path, **options):
+        sock = self._connect()
+        stream = sock.makefile('rwb')
+        _send(stream, {'op': 'transcribe', 'audio_path': os.path.abspath(audio_path), 'model': self.model_size, 'options': options})
+        info = None
+        while info is None:
+            line = stream.readline()
+            if not line:
+                sock.close()
+                raise ConnectionError("常駐模型服務在返回結果前關閉了連線")
+            message = json.loads(line.decode('utf-8'))
+            if message['type'] == 'error':
+                sock.close()
+                raise RuntimeError(f"常駐模型服務返回錯誤: {message['message']}")
+            if message['type'] == 'info':
+                info = SimpleNamespace(language=message['language'], language_probability=message['language_probability'],
+                                       duration=message.get('duration'))
+
+        def segment_stream():
+            try:
+                for line in stream:
+                    message = json.loads(line.decode('utf-8'))
+                    if message['type'] == 'segment':
+                        yield segment_from_message(message)
+                    elif message['type'] == 'done':
+                        return
+                    elif message['type'] == 'error':
+                        raise RuntimeError(f"常駐模型服務返回錯誤: {message['message']}")
+                raise ConnectionError("常駐模型服務在任務完成前關閉了連線")
+            finally:
+                stream.close()
+                sock.close()
+
+        return segment_stream(), info
+
+
+def connect_remote_model(socket_path, model_size, logger):
+    """若常駐模型服務正在運行且已載入指定模型，返回 RemoteWhisperModel；否則返回 None。"""
+    if not os.path.exists(socket_path):
+        return None
+    remote_model = RemoteWhisperModel(socket_path, model_size)
+    try:
+        status = remote_model.status()
+    except OSError as e:
+        logger.warning(f"無法連接常駐模型服務 '{socket_path}' ({e})，將在本進程中載入模型。")
+        return None
+    if model_size not in status.get('models', []):
+        logger.warning(f"常駐模型服務未載入模型 '{model_size}' (已載入: {status.get('models')})，將在本進程中載入模型。")
+        return None
+    logger.info(f"已連接常駐模型服務 '{socket_path}' (模型 {model_size}，佇列中 {len(status['workers'][model_size]['queued'])} 個任務)。")
+    return remote_model
+
+
+def main(argv=None):
+    from local_transcriber import setup_logger, MODEL_SIZE, TRANSCRIPTION_SERVER_SOCKET
+    parser = argparse.ArgumentParser(description="常駐 Whisper 模型服務")
+    parser.add_argument('--socket', default=TRANSCRIPTION_SERVER_SOCKET, help="Unix socket 路徑")
+    parser.add_argument('--model', action='append', dest='models', help=f"要載入的模型 (可重複指定；默認 {MODEL_SIZE})")
+    args = parser.parse_args(argv)
+
+    logger = setup_logger()
+    return serve(args.socket, args.models or [MODEL_SIZE], logger)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
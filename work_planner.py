@@ -0,0 +1,356 @@
+"""
+運行計劃預估 (dry run)：不轉錄、不調用任何 API，只讀取目錄、狀態檔案與音頻標頭，
+預估剩餘的轉錄音頻時長、Gemini 批次數與 token 數、Sheets 寫入次數，並按配額與實測吞吐量排出時間表。
+
+吞吐量優先使用 run_metrics 最近一次運行的實測值 (實時率、Gemini 請求延遲、Sheets 調用延遲)，
+沒有記錄時使用下方的默認值；命令列參數可覆蓋任何一項。
+
+用法:
+    python work_planner.py [--whisper-rtf 0.08] [--gemini-rpm 2] [--gemini-tpm 32000] [--gemini-rpd 50] [--json plan.json]
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import datetime
+
+import local_transcriber
+import sheets_gemini_processor
+import run_metrics
+import gemini_pool
+from audio_probe import probe_audio_duration
+from gemini_pool import estimate_tokens
+
+# --- 默認吞吐量 (無實測數據時使用) ---
+DEFAULT_WHISPER_RTF = 0.08 # large-v3 float16 在 Colab T4 上的典型實時率
+DEFAULT_MODEL_LOAD_SECONDS = 60
+DEFAULT_GEMINI_LATENCY_SECONDS = 40 # 100 行批次的典型響應時間
+DEFAULT_SHEETS_CALL_SECONDS = 1.0
+FALLBACK_AUDIO_BYTES_PER_SECOND = 16000 # 標頭無法解析時按 128 kbps 估計時長
+
+# --- 文本量估計 (有已轉錄的項目時以實際比例校準) ---
+CHARS_PER_AUDIO_SECOND = 4.0 # 普通話講座去除標點後的語速
+CHARS_PER_LINE = 12
+CALIBRATION_SAMPLE_FILES = 20
+
+# --- 配額 (Gemini 配額按每個端點計算，每分鐘配額的默認值見 gemini_pool.py) ---
+GEMINI_REQUESTS_PER_DAY = 50 # Gemini 1.5 Pro 免費層
+SHEETS_WRITES_PER_MINUTE = 60 # Google Sheets API 每用戶每分鐘寫入配額
+SHEETS_WRITES_PER_ITEM = 4 # 完整處理時清除並重寫 "文本校對" 與 "時間軸" 兩個工作表 (增量模式下只寫入有變化的工作表)
+SHEETS_WRITES_PER_CORRECTED_ITEM = 1 # Gemini 結果寫入 B 欄
+SHEETS_WRITES_PER_SRT_REWRITE = 2 # 增量模式：SRT 變更時清除並重寫 "時間軸"
+SHEETS_WRITES_PER_INCREMENTAL_UPDATE = 1 # 增量模式：以一次 batch_update 改寫 "文本校對" 中有變化的行
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, SECONDS_PER_DAY)
+    text = f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{days} 天 {text}" if days else text
+
+def _quiet_logger():
+    logger = logging.getLogger('WorkPlannerLogger')
+    logger.handlers.clear()
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+    return logger
+
+def configured_gemini_endpoints(logger):
+    """已設定的金鑰數 × 模型數；無法讀取密鑰時按 1 個端點計算。"""
+    try:
+        return max(1, len(gemini_pool.load_api_keys(logger)) * len(gemini_pool.GEMINI_POOL_MODELS))
+    except Exception:
+        return 1
+
+def measured_throughput():
+    """從最近一次運行的指標中讀取實測吞吐量；沒有的項目不出現在結果中。"""
+    measured = {}
+    transcriber = run_metrics.load_latest('local_transcriber')
+    if transcriber:
+        rtf = transcriber['derived'].get('real_time_factor')
+        if rtf:
+            measured['whisper_rtf'] = rtf
+        model_load = transcriber['timers'].get('model_load')
+        if model_load:
+            measured['model_load_seconds'] = model_load['total_seconds'] / model_load['count']
+    processor = run_metrics.load_latest('sheets_gemini_processor')
+    if processor:
+        for timer_name, key in (('gemini.request', 'gemini_latency_seconds'), ('sheets.call', 'sheets_call_seconds')):
+            timer = processor['timers'].get(timer_name)
+            if timer and timer['count']:
+                measured[key] = timer['total_seconds'] / timer['count']
+    return measured
+
+def _read_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def _audio_duration(path):
+    duration = probe_audio_duration(path)
+    if duration is not None:
+        return duration, 'header'
+    return os.path.getsize(path) / FALLBACK_AUDIO_BYTES_PER_SECOND, 'size'
+
+def plan_transcription(input_dir, output_root, state_file_path, logger):
+    """
+    返回 (待轉錄檔案列表, 文本量校準)。
+    校準以已轉錄的檔案計算每秒音頻的字數與每行字數，用於估計尚未轉錄的講座會產生多少文本。
+    """
+    processed_files = local_transcriber.load_processed_files(state_file_path, logger)
+    pending, calibration_files, calibration_chars, calibration_seconds, calibration_lines = [], 0, 0, 0.0, 0
+    if not os.path.isdir(input_dir):
+        logger.warning(f"輸入目錄 '{input_dir}' 不存在。")
+        return pending, None
+    for audio_file_name in sorted(os.listdir(input_dir)):
+        if not local_transcriber.is_audio_file(audio_file_name):
+            continue
+        audio_path = os.path.join(input_dir, audio_file_name)
+        if audio_file_name not in processed_files:
+            duration, source = _audio_duration(audio_path)
+            pending.append({'file': audio_file_name, 'audio_seconds': duration, 'duration_source': source})
+            continue
+        if calibration_files >= CALIBRATION_SAMPLE_FILES:
+            continue
+        base_name = os.path.splitext(audio_file_name)[0]
+        normal_text_path = os.path.join(output_root, base_name, f"{base_name}_normal.txt")
+        duration = probe_audio_duration(audio_path)
+        if duration and os.path.exists(normal_text_path):
+            lines = _read_text(normal_text_path).splitlines()
+            calibration_chars += sum(len(line) for line in lines)
+            calibration_lines += len(lines)
+            calibration_seconds += duration
+            calibration_files += 1
+    calibration = None
+    if calibration_seconds and calibration_lines:
+        calibration = {'chars_per_audio_second': calibration_chars / calibration_seconds,
+                       'chars_per_line': calibration_chars / calibration_lines}
+    return pending, calibration
+
+def _batch_token_estimates(lines, main_instruction, correction_rules):
+    # 與 get_gemini_correction 相同的分批方式；目前的處理流程不附帶 PDF 講義上下文
+    batches = []
+    for start in range(0, len(lines), sheets_gemini_processor.GEMINI_API_BATCH_MAX_LINES):
+        batch_lines = lines[start:start + sheets_gemini_processor.GEMINI_API_BATCH_MAX_LINES]
+        batch_text = "\n".join(batch_lines)
+        prompt = (f"{main_instruction}\n\n上課講義內容（作為校對參考，請仔細閱讀）：\n---\n\n---\n\n"
+                  f"以下是需要校對的字幕文本 (共 {len(batch_lines)} 行):\n---\n{batch_text}\n---\n\n"
+                  f"{correction_rules.replace('{batch_line_count}', str(len(batch_lines)))}")
+        batches.append({'lines': len(batch_lines), 'prompt_tokens': estimate_tokens(prompt), 'output_tokens': estimate_tokens(batch_text)})
+    return batches
+
+def _incremental_item(item_name, lines, srt_content, snapshot, main_instruction, correction_rules):
+    # 與 process_item_incrementally 相同：只校對改動區域 (含上下文)，只寫入有變化的工作表；未變更的項目不產生任何調用
+    whisper_changed = lines != snapshot['whisper_lines']
+    srt_changed = hashlib.sha1(srt_content.encode('utf-8')).hexdigest() != snapshot.get('srt_sha1')
+    region_lines = []
+    if whisper_changed:
+        regions, _ = sheets_gemini_processor.changed_line_regions(snapshot['whisper_lines'], lines,
+                                                                   sheets_gemini_processor.GEMINI_INCREMENTAL_CONTEXT_LINES)
+        region_lines = [line for start, end in regions for line in lines[start:end]]
+    return {'item': item_name, 'lines': len(lines), 'estimated': False, 'incremental': True,
+            'needs_gemini': bool(region_lines), 'rows_rewritten': len(region_lines),
+            'batches': _batch_token_estimates(region_lines, main_instruction, correction_rules),
+            'sheets_writes': (SHEETS_WRITES_PER_SRT_REWRITE if srt_changed else 0) + (SHEETS_WRITES_PER_INCREMENTAL_UPDATE if whisper_changed else 0)}
+
+def plan_gemini(output_root, gemini_state_file_path, pending_transcriptions, calibration, logger):
+    """返回 sheets_gemini_processor 下一次 (在轉錄完成後) 運行時會處理的項目列表。"""
+    gemini_processed = sheets_gemini_processor.load_gemini_processed_state(logger, gemini_state_file_path)
+    main_instruction = sheets_gemini_processor.DEFAULT_GEMINI_MAIN_INSTRUCTION
+    correction_rules = sheets_gemini_processor.DEFAULT_GEMINI_CORRECTION_RULES
+    chars_per_second = calibration['chars_per_audio_second'] if calibration else CHARS_PER_AUDIO_SECOND
+    chars_per_line = calibration['chars_per_line'] if calibration else CHARS_PER_LINE
+
+    items = {}
+    if os.path.isdir(output_root):
+        for item_name in sorted(os.listdir(output_root)):
+            normal_text_path = os.path.join(output_root, item_name, f"{item_name}_normal.txt")
+            srt_path = os.path.join(output_root, item_name, f"{item_name}.srt")
+            if not (os.path.exists(normal_text_path) and os.path.exists(srt_path)):
+                continue
+            lines = _read_text(normal_text_path).splitlines()
+            snapshot = None
+            if sheets_gemini_processor.GEMINI_INCREMENTAL_ENABLED and item_name in gemini_processed:
+                snapshot = sheets_gemini_processor.load_gemini_snapshot(logger, os.path.join(output_root, item_name), item_name)
+            if snapshot is not None:
+                items[item_name] = _incremental_item(item_name, lines, _read_text(srt_path), snapshot, main_instruction, correction_rules)
+                continue
+            items[item_name] = {'item': item_name, 'lines': len(lines), 'estimated': False, 'incremental': False,
+                                'needs_gemini': item_name not in gemini_processed and bool(lines),
+                                'batches': _batch_token_estimates(lines, main_instruction, correction_rules)}
+    for pending in pending_transcriptions:
+        # 重新轉錄會覆蓋同名項目的輸出；以估計的文本量代替
+        item_name = os.path.splitext(pending['file'])[0]
+        line_count = max(1, int(pending['audio_seconds'] * chars_per_second / chars_per_line))
+        placeholder_line = "佛" * max(1, int(round(chars_per_line)))
+        lines = [placeholder_line] * line_count
+        items[item_name] = {'item': item_name, 'lines': line_count, 'estimated': True, 'incremental': False,
+                            'needs_gemini': item_name not in gemini_processed,
+                            'batches': _batch_token_estimates(lines, main_instruction, correction_rules)}
+    for item in items.values():
+        if item['incremental']:
+            continue
+        if not item['needs_gemini']:
+            item['batches'] = []
+        item['rows_rewritten'] = item['lines']
+        item['sheets_writes'] = SHEETS_WRITES_PER_ITEM + (SHEETS_WRITES_PER_CORRECTED_ITEM if item['needs_gemini'] else 0)
+    return list(items.values())
+
+def schedule(pending_transcriptions, gemini_items, throughput, quotas):
+    """按處理順序模擬時間線 (先轉錄全部檔案，再處理所有項目)，返回含開始/結束秒數的時間表。"""
+    clock = 0.0
+    transcription_rows = []
+    if pending_transcriptions:
+        clock += throughput['model_load_seconds']
+        for pending in pending_transcriptions:
+            started = clock
+            clock += pending['audio_seconds'] * throughput['whisper_rtf']
+            transcription_rows.append({**pending, 'start_seconds': started, 'end_seconds': clock})
+    transcription_end = clock
+
+    # 客戶端池將請求分散到所有端點，總配額按端點數量放大
+    endpoints = max(1, quotas['gemini_endpoints'])
+    minimum_request_interval = 60.0 / (quotas['gemini_rpm'] * endpoints) if quotas['gemini_rpm'] else 0.0
+    tokens_per_minute = quotas['gemini_tpm'] * endpoints if quotas['gemini_tpm'] else 0
+    requests_per_day = quotas['gemini_rpd'] * endpoints if quotas['gemini_rpd'] else 0
+    day_started_at, requests_today, last_request_at = clock, 0, None
+    gemini_rows = []
+    for item in gemini_items:
+        started = clock
+        if not item['sheets_writes']:
+            gemini_rows.append({**item, 'start_seconds': started, 'end_seconds': clock}) # 增量模式下未變更，直接跳過
+            continue
+        # 工作表寫入 (受每分鐘寫入配額限制)
+        clock += max(item['sheets_writes'] * throughput['sheets_call_seconds'],
+                     item['sheets_writes'] * 60.0 / quotas['sheets_wpm'] if quotas['sheets_wpm'] else 0.0)
+        for batch_index, batch in enumerate(item['batches']):
+            if requests_per_day and requests_today >= requests_per_day:
+                clock = max(clock, day_started_at + SECONDS_PER_DAY) # 每日配額用盡，等待到下一個配額日
+                day_started_at, requests_today = clock, 0
+            if last_request_at is not None:
+                token_interval = (batch['prompt_tokens'] + batch['output_tokens']) * 60.0 / tokens_per_minute if tokens_per_minute else 0.0
+                clock = max(clock, last_request_at + max(minimum_request_interval, token_interval))
+            last_request_at = clock
+            requests_today += 1
+            clock += throughput['gemini_latency_seconds']
+            if batch_index < len(item['batches']) - 1:
+                clock += sheets_gemini_processor.GEMINI_INTER_BATCH_DELAY_SECONDS
+        clock += sheets_gemini_processor.INTER_SPREADSHEET_DELAY_SECONDS
+        gemini_rows.append({**item, 'start_seconds': started, 'end_seconds': clock})
+    return transcription_rows, transcription_end, gemini_rows, clock
+
+def build_plan(throughput_overrides=None, quotas=None, logger=None):
+    logger = logger or _quiet_logger()
+    measured = measured_throughput()
+    throughput = {
+        'whisper_rtf': DEFAULT_WHISPER_RTF,
+        'model_load_seconds': DEFAULT_MODEL_LOAD_SECONDS,
+        'gemini_latency_seconds': DEFAULT_GEMINI_LATENCY_SECONDS,
+        'sheets_call_seconds': DEFAULT_SHEETS_CALL_SECONDS,
+        **measured,
+        **{key: value for key, value in (throughput_overrides or {}).items() if value is not None},
+    }
+    quotas = {
+        'gemini_rpm': gemini_pool.GEMINI_REQUESTS_PER_MINUTE_PER_ENDPOINT, 'gemini_tpm': gemini_pool.GEMINI_TOKENS_PER_MINUTE_PER_ENDPOINT,
+        'gemini_rpd': GEMINI_REQUESTS_PER_DAY, 'sheets_wpm': SHEETS_WRITES_PER_MINUTE,
+        'gemini_endpoints': configured_gemini_endpoints(logger),
+        **{key: value for key, value in (quotas or {}).items() if value is not None},
+    }
+    pending, calibration = plan_transcription(local_transcriber.INPUT_AUDIO_DIR, local_transcriber.OUTPUT_TRANSCRIPTIONS_ROOT_DIR,
+                                              local_transcriber.STATE_FILE_PATH, logger)
+    gemini_items = plan_gemini(sheets_gemini_processor.TRANSCRIPTIONS_ROOT_INPUT_DIR, sheets_gemini_processor.GEMINI_STATE_FILE_PATH,
+                               pending, calibration, logger)
+    transcription_rows, transcription_end, gemini_rows, total_seconds = schedule(pending, gemini_items, throughput, quotas)
+    batches = [batch for item in gemini_items for batch in item['batches']]
+    return {
+        'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'throughput': throughput,
+        'measured': sorted(measured),
+        'quotas': quotas,
+        'calibration': calibration,
+        'totals': {
+            'audio_files': len(pending),
+            'audio_hours': sum(row['audio_seconds'] for row in pending) / 3600,
+            'durations_from_header': sum(1 for row in pending if row['duration_source'] == 'header'),
+            'gemini_items': sum(1 for item in gemini_items if item['needs_gemini']),
+            'gemini_batches': len(batches),
+            'gemini_prompt_tokens': sum(batch['prompt_tokens'] for batch in batches),
+            'gemini_output_tokens': sum(batch['output_tokens'] for batch in batches),
+            'sheets_items': len(gemini_items),
+            'sheets_writes': sum(item['sheets_writes'] for item in gemini_items),
+            'sheets_rows_rewritten': sum(item['rows_rewritten'] for item in gemini_items),
+            'transcription_seconds': transcription_end,
+            'total_seconds': total_seconds,
+        },
+        'transcription_schedule': transcription_rows,
+        'gemini_schedule': [{**row, 'batches': len(row['batches'])} for row in gemini_rows],
+    }
+
+def print_plan(plan):
+    totals, throughput = plan['totals'], plan['throughput']
+    now = datetime.datetime.now()
+    measured = plan['measured']
+    source = lambda key: "實測" if key in measured else "默認"
+    print("=== 運行計劃 (dry run，未執行任何轉錄或 API 調用) ===")
+    print(f"吞吐量: 實時率 {throughput['whisper_rtf']:.3f} ({source('whisper_rtf')})，模型載入 {throughput['model_load_seconds']:.0f} 秒 ({source('model_load_seconds')})，"
+          f"Gemini 請求 {throughput['gemini_latency_seconds']:.1f} 秒 ({source('gemini_latency_seconds')})，Sheets 調用 {throughput['sheets_call_seconds']:.2f} 秒 ({source('sheets_call_seconds')})")
+    quotas = plan['quotas']
+    print(f"配額: Gemini {quotas['gemini_endpoints']} 個端點，每個 {quotas['gemini_rpm']} 請求/分鐘、{quotas['gemini_tpm']} token/分鐘、{quotas['gemini_rpd']} 請求/天；"
+          f"Sheets {quotas['sheets_wpm']} 寫入/分鐘")
+
+    print(f"\n--- 轉錄 (local_transcriber.py) ---")
+    print(f"待轉錄 {totals['audio_files']} 個檔案，共 {totals['audio_hours']:.2f} 小時音頻 "
+          f"({totals['durations_from_header']} 個由標頭讀取時長，其餘按檔案大小估計)")
+    for row in plan['transcription_schedule']:
+        print(f"  {format_duration(row['start_seconds']):>14} → {format_duration(row['end_seconds']):>14}  {row['file']}  "
+              f"({format_duration(row['audio_seconds'])}{'' if row['duration_source'] == 'header' else '，估計'})")
+
+    print(f"\n--- Gemini 校對與 Sheets (sheets_gemini_processor.py) ---")
+    print(f"{totals['sheets_items']} 個項目，其中 {totals['gemini_items']} 個需要 Gemini 校對：{totals['gemini_batches']} 個批次，"
+          f"約 {totals['gemini_prompt_tokens']:,} 輸入 token + {totals['gemini_output_tokens']:,} 輸出 token；"
+          f"Sheets 寫入 {totals['sheets_writes']} 次 (改寫約 {totals['sheets_rows_rewritten']} 行)")
+    if plan['calibration']:
+        print(f"尚未轉錄的項目按已轉錄檔案校準估計文本量: 每秒 {plan['calibration']['chars_per_audio_second']:.2f} 字，每行 {plan['calibration']['chars_per_line']:.1f} 字")
+    for row in plan['gemini_schedule']:
+        print(f"  {format_duration(row['start_seconds']):>14} → {format_duration(row['end_seconds']):>14}  {row['item']}  "
+              f"({row['lines']} 行{'，估計' if row['estimated'] else ''}{'，增量' if row['incremental'] else ''}，{row['batches']} 批次，Sheets 寫入 {row['sheets_writes']} 次)")
+
+    eta = now + datetime.timedelta(seconds=totals['total_seconds'])
+    print(f"\n轉錄預計耗時 {format_duration(totals['transcription_seconds'])}；全部完成預計耗時 {format_duration(totals['total_seconds'])}，"
+          f"預計完成時間 {eta:%Y-%m-%d %H:%M}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="預估剩餘工作量、API 調用與完成時間 (不執行任何處理)")
+    parser.add_argument('--whisper-rtf', type=float, help="Whisper 實時率 (默認使用最近一次運行的實測值)")
+    parser.add_argument('--model-load-seconds', type=float, help="模型載入秒數")
+    parser.add_argument('--gemini-latency', type=float, help="每個 Gemini 請求的延遲秒數")
+    parser.add_argument('--sheets-latency', type=float, help="每次 Sheets 調用的延遲秒數")
+    parser.add_argument('--gemini-endpoints', type=int, help="Gemini 客戶端池的端點數 (默認為已設定的金鑰數 × 模型數)")
+    parser.add_argument('--gemini-rpm', type=int, help=f"每個 Gemini 端點的每分鐘請求配額 (默認 {gemini_pool.GEMINI_REQUESTS_PER_MINUTE_PER_ENDPOINT})")
+    parser.add_argument('--gemini-tpm', type=int, help=f"每個 Gemini 端點的每分鐘 token 配額 (默認 {gemini_pool.GEMINI_TOKENS_PER_MINUTE_PER_ENDPOINT})")
+    parser.add_argument('--gemini-rpd', type=int, help=f"每個 Gemini 端點的每日請求配額 (默認 {GEMINI_REQUESTS_PER_DAY}，0 表示不限)")
+    parser.add_argument('--sheets-wpm', type=int, help=f"Sheets 每分鐘寫入配額 (默認 {SHEETS_WRITES_PER_MINUTE})")
+    parser.add_argument('--json', help="將完整計劃寫入指定的 JSON 檔案")
+    args = parser.parse_args(argv)
+
+    plan = build_plan(
+        throughput_overrides={'whisper_rtf': args.whisper_rtf, 'model_load_seconds': args.model_load_seconds,
+                              'gemini_latency_seconds': args.gemini_latency, 'sheets_call_seconds': args.sheets_latency},
+        quotas={'gemini_endpoints': args.gemini_endpoints, 'gemini_rpm': args.gemini_rpm, 'gemini_tpm': args.gemini_tpm, 'gemini_rpd': args.gemini_rpd, 'sheets_wpm': args.sheets_wpm})
+    print_plan(plan)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, ensure_ascii=False, indent=2)
+        print(f"計劃已寫入 {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+多個運行環境 (例如多個 Colab 執行階段) 分攤同一批工作的租約佇列。
+
+每個工作項目 (音頻檔案名、轉錄項目等) 以一個鍵表示。工作者處理前先認領該鍵的租約，
+租約在 WORK_QUEUE_LEASE_SECONDS 後過期，持有期間由背景線程每 WORK_QUEUE_HEARTBEAT_SECONDS 續期一次。
+工作者崩潰或斷線後租約不再續期，過期後由其他工作者自動接手。完成的項目記錄為已完成，不會再被認領。
+
+兩種後端提供相同的介面：
+    LeaseFileQueue    共享目錄中的租約檔案 (每個鍵一個 .lease / .done 檔案)，適用於多台機器共用的 Google Drive。
+                      以 O_EXCL 創建租約，接手過期租約或創建後等待 LEASE_CLAIM_SETTLE_SECONDS 再讀回確認持有者，
+                      以降低 Drive 同步延遲造成的重複認領 (Drive 不保證跨機器的原子性，極少數情況下仍可能重複處理)。
+    SqliteLeaseQueue  單個 SQLite 資料庫 (BEGIN IMMEDIATE 保證認領的原子性)，適用於同一台機器或支持檔案鎖的本地磁碟上的多個進程。
+"""
+import os
+import re
+import json
+import time
+import uuid
+import socket
+import hashlib
+import sqlite3
+import threading
+import contextlib
+
+import run_metrics
+
+WORK_QUEUE_LEASE_SECONDS = 600 # 租約有效期；應遠大於續期間隔與機器之間的時鐘偏差
+WORK_QUEUE_HEARTBEAT_SECONDS = 60
+LEASE_CLAIM_SETTLE_SECONDS = 2.0 # 寫入租約檔案後等待多久再讀回確認 (等待其他機器的寫入同步)
+LEASE_FILE_SUFFIX = ".lease"
+DONE_FILE_SUFFIX = ".done"
+SQLITE_FILE_NAME = "work_queue.sqlite3"
+SQLITE_TIMEOUT_SECONDS = 30
+
+
+def default_worker_id():
+    """主機名-進程號-隨機後綴；可以環境變數 AUTOSRT_WORKER_ID 指定。"""
+    return os.environ.get('AUTOSRT_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def worker_temp_path(path):
+    """path 的臨時檔案名，包含主機名、進程號與線程號，使多個工作者 (及同一進程的多個線程) 不會寫入同一個臨時檔案。"""
+    return f"{path}.{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+class Lease:
+    def __init__(self, key, token, expires_at):
+        self.key = key
+        self.token = token
+        self.expires_at = expires_at
+        self.lost = False # 續期時發現已被其他工作者接手
+
+
+class _LeaseQueue:
+    """租約的持有與續期；後端實現 _try_claim / _renew / _release / is_done。"""
+
+    def __init__(self, logger, worker_id=None, lease_seconds=WORK_QUEUE_LEASE_SECONDS, heartbeat_seconds=WORK_QUEUE_HEARTBEAT_SECONDS):
+        self.logger = logger
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.held = {} # 鍵 -> Lease
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    def claim(self, key):
+        """嘗試認領 key；成功時返回 Lease，已被其他工作者持有、已完成或認領時發生錯誤時返回 None。"""
+        token = f"{self.worker_id}:{uuid.uuid4().hex}"
+        try:
+            with run_metrics.stage('work_queue.claim'):
+                lease = self._try_claim(key, token, time.time() + self.lease_seconds)
+        except (OSError, sqlite3.Error) as e:
+            # 與其他工作者競爭時的暫時性錯誤 (例如 Drive 同步中的檔案、資料庫鎖逾時)：視為未認領，之後再試
+            self.logger.warning(f"認領 '{key}' 的租約時發生錯誤: {e}。視為未認領，稍後重試。")
+            lease = None
+        if lease is None:
+            run_metrics.increment('work_queue.claim_conflicts')
+            return None
+        run_metrics.increment('work_queue.claims')
+        with self.lock:
+            self.held[key] = lease
+            if self.heartbeat_thread is None:
+                self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="work-queue-heartbeat", daemon=True)
+                self.heartbeat_thread.start()
+        return lease
+
+    def release(self, lease, done=False):
+        """釋放租約；done=True 時將該鍵記錄為已完成。"""
+        with self.lock:
+            self.held.pop(lease.key, None)
+        if lease.lost:
+            self.logger.warning(f"'{lease.key}' 的租約在處理期間已被其他工作者接手，該項目可能被重複處理。")
+        try:
+            self._release(lease, done)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f"釋放 '{lease.key}' 的租約時發生錯誤: {e}。租約將在過期後由其他工作者接手。")
+        if done:
+            run_metrics.increment('work_queue.completed')
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.wait(self.heartbeat_seconds):
+            with self.lock:
+                leases = list(self.held.values())
+            for lease in leases:
+                try:
+                    renewed = self._renew(lease, time.time() + self.lease_seconds)
+                except (OSError, sqlite3.Error) as e:
+                    self.logger.warning(f"續期 '{lease.key}' 的租約時發生錯誤: {e}")
+                    continue
+                run_metrics.increment('work_queue.heartbeats')
+                if not renewed:
+                    lease.lost = True
+                    run_metrics.increment('work_queue.lost_leases')
+                    self.logger.warning(f"'{lease.key}' 的租約已過期並被其他工作者接手。")
+                    with self.lock:
+                        self.held.pop(lease.key, None)
+
+    def close(self):
+        """停止續期並釋放仍持有的租約 (不標記為已完成)。"""
+        self.stop_event.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        with self.lock:
+            leases = list(self.held.values())
+        for lease in leases:
+            self.release(lease)
+
+
+class LeaseFileQueue(_LeaseQueue):
+    def __init__(self, lease_dir, logger, **kwargs):
+        super().__init__(logger, **kwargs)
+        self.lease_dir = lease_dir
+        os.makedirs(lease_dir, exist_ok=True)
+
+    def _path(self, key, suffix):
+        # 檔案名保留可讀的鍵，並附加雜湊以避免不同的鍵在替換字元後相同
+        readable = re.sub(r'[^\w.-]', '_', key)[:100]
+        return os.path.join(self.lease_dir, f"{readable}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}{suffix}")
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, record):
+        # 每個工作者/線程使用各自的臨時檔案，同時接手同一個過期租約時不會互相刪除對方的臨時檔案
+        temp_path = worker_temp_path(path)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def _record(self, key, token, expires_at):
+        return {'key': key, 'worker': self.worker_id, 'token': token, 'expires_at': expires_at, 'renewed_at': time.time()}
+
+    def _try_claim(self, key, token, expires_at):
+        if self.is_done(key):
+            return None
+        path = self._path(key, LEASE_FILE_SUFFIX)
+        record = self._record(key, token, expires_at)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+        except FileExistsError:
+            existing = self._read(path)
+            if existing is None:
+                # 內容不可讀 (其他工作者正在寫入)：以檔案的修改時間判斷是否過期
+                try:
+                    if time.time() - os.path.getmtime(path) < self.lease_seconds:
+                        return None
+                except OSError:
+                    return None
+            elif existing.get('expires_at', 0) > time.time():
+                return None
+            self.logger.info(f"'{key}' 的租約已過期 (持有者 {existing.get('worker') if existing else '未知'})，接手該項目。")
+            run_metrics.increment('work_queue.recovered_leases')
+            self._write(path, record)
+        run_metrics.sleep(LEASE_CLAIM_SETTLE_SECONDS, 'lease_settle')
+        current = self._read(path)
+        if current is None or current.get('token') != token:
+            return None # 同時認領的其他工作者後寫入，由它持有
+        if self.is_done(key):
+            # 其他工作者在我們檢查後完成並刪除了租約 (完成標記總是先於刪除租約寫入)
+            os.remove(path)
+            return None
+        return Lease(key, token, expires_at)
+
+    def _renew(self, lease, expires_at):
+        path = self._path(lease.key, LEASE_FILE_SUFFIX)
+        current = self._read(path)
+        if current is None or current.get('token') != lease.token:
+            return False
+        self._write(path, self._record(lease.key, lease.token, expires_at))
+        lease.expires_at = expires_at
+        return True
+
+    def _release(self, lease, done):
+        if done:
+            self._write(self._path(lease.key, DONE_FILE_SUFFIX), {'key': lease.key, 'worker': self.worker_id, 'completed_at': time.time()})
+        path = self._path(lease.key, LEASE_FILE_SUFFIX)
+        current = self._read(path)
+        if current is not None and current.get('token') == lease.token:
+            os.remove(path)
+
+    def is_done(self, key):
+        return os.path.exists(self._path(key, DONE_FILE_SUFFIX))
+
+    def held_until(self, key):
+        """返回 key 當前租約的過期時間 (time.time() 時間戳)；沒有租約時返回 None。"""
+        path = self._path(key, LEASE_FILE_SUFFIX)
+        existing = self._read(path)
+        if existing is not None:
+            return existing.get('expires_at')
+        try:
+            return os.path.getmtime(path) + self.lease_seconds # 內容不可讀 (正在寫入)：按修改時間估算
+        except OSError:
+            return None
+
+
+class SqliteLeaseQueue(_LeaseQueue):
+    def __init__(self, database_path, logger, **kwargs):
+        super().__init__(logger, **kwargs)
+        self.database_path = database_path
+        os.makedirs(os.path.dirname(database_path) or '.', exist_ok=True)
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, worker TEXT, token TEXT, "
+                               "expires_at REAL NOT NULL DEFAULT 0, done INTEGER NOT NULL DEFAULT 0)")
+
+    def _connect(self):
+        # 每次操作使用新的連線 (續期在背景線程中進行)；isolation_level=None 以便手動控制交易
+        return sqlite3.connect(self.database_path, timeout=SQLITE_TIMEOUT_SECONDS, isolation_level=None)
+
+    def _try_claim(self, key, token, expires_at):
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT worker, expires_at, done FROM leases WHERE key = ?", (key,)).fetchone()
+            if row is not None and (row[2] or row[1] > time.time()):
+                connection.execute("ROLLBACK")
+                return None
+            if row is not None and row[0]:
+                self.logger.info(f"'{key}' 的租約已過期 (持有者 {row[0]})，接手該項目。")
+                run_metrics.increment('work_queue.recovered_leases')
+            connection.execute("INSERT OR REPLACE INTO leases (key, worker, token, expires_at, done) VALUES (?, ?, ?, ?, 0)",
+                               (key, self.worker_id, token, expires_at))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return Lease(key, token, expires_at)
+
+    def _renew(self, lease, expires_at):
+        with contextlib.closing(self._connect()) as connection:
+            renewed = connection.execute("UPDATE leases SET expires_at = ? WHERE key = ? AND token = ? AND done = 0",
+                                         (expires_at, lease.key, lease.token)).rowcount == 1
+        if renewed:
+            lease.expires_at = expires_at
+        return renewed
+
+    def _release(self, lease, done):
+        with contextlib.closing(self._connect()) as connection:
+            if done:
+                connection.execute("UPDATE leases SET done = 1, token = NULL, expires_at = 0 WHERE key = ? AND token = ?",
+                                   (lease.key, lease.token))
+            else:
+                connection.execute("DELETE FROM leases WHERE key = ? AND token = ?", (lease.key, lease.token))
+
+    def is_done(self, key):
+        with contextlib.closing(self._connect()) as connection:
+            row = connection.execute("SELECT done FROM leases WHERE key = ?", (key,)).fetchone()
+        return bool(row and row[0])
+
+    def held_until(self, key):
+        with contextlib.closing(self._connect()) as connection:
+            row = connection.execute("SELECT expires_at FROM leases WHERE key = ? AND done = 0", (key,)).fetchone()
+        return row[0] if row else None
+
+
+def open_work_queue(backend, directory, logger, **kwargs):
+    """
+    backend: None (不分攤，單個運行環境處理全部工作)、"lease_files" 或 "sqlite"。
+    directory: 租約檔案目錄；sqlite 後端在其中使用 SQLITE_FILE_NAME。
+    """
+    if not backend:
+        return None
+    if backend == "lease_files":
+        queue = LeaseFileQueue(directory, logger, **kwargs)
+    elif backend == "sqlite":
+        queue = SqliteLeaseQueue(os.path.join(directory, SQLITE_FILE_NAME), logger, **kwargs)
+    else:
+        raise ValueError(f"未知的工作佇列後端: {backend}")
+    logger.info(f"已啟用工作分攤 ({backend}，'{directory}')，工作者 ID: {queue.worker_id}，"
+                f"租約 {queue.lease_seconds} 秒，每 {queue.heartbeat_seconds} 秒續期。")
+    return queue